@@ -1,33 +1,230 @@
-import csv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 import os
+import shutil
 import multiprocessing as mp
+from queue import Queue
 import time
-from threading import Thread
+from threading import Lock, Thread
+from urllib.parse import urlparse
 
-import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+
+from ratelimiter import get_backoff_time, get_host_throttle, parse_retry_after, reset_host_throttles
+from responsecache import CachedResponse, ResponseCache
+from runmanifest import RunManifest
+from scrapemetrics import ScrapeMetrics
+from shardcoordinator import ShardCoordinator, get_shard_id
+from sinks import SQLITE_EXTENSION, CSVSink, ParquetSink, SQLiteSink, concatenate_csv_files, merge_parquet_datasets, read_sqlite_max, read_sqlite_rows
+from workqueue import WorkQueue
+
+def import_aiohttp():
+    # only scrape_async needs aiohttp (and asyncio), importing them costs every other run a tenth of a second
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError('scrape_async requires aiohttp (pip install aiohttp).') from None
+
+    return aiohttp
+
+# scraper used by the parse processes of scrape_pipelined, set once per process
+parse_worker_scraper = None
+
+def init_parse_worker(scraper):
+    global parse_worker_scraper
+    # with fork the scraper is inherited rather than pickled, drop the parent's session
+    # and throttles so parsers that make requests of their own do not share its sockets
+    scraper.__setstate__(scraper.__getstate__())
+    parse_worker_scraper = scraper
+    reset_host_throttles()
+
+def parse_in_worker(url, content):
+    # the parse time goes back with the rows, the parent process keeps the metrics
+    start = time.perf_counter()
+    block = parse_worker_scraper.parse_response(url, content)
+    return block, time.perf_counter() - start
 
 class BaseScraper:
     DEFAULT_PRINT_COUNT = 30
     DEFAULT_ERROR_LIMIT = 5
-    DEFAULT_WAIT_TIME_SHORT_SECS = 5
+    DEFAULT_BACKOFF_BASE_SECS = 1
+    DEFAULT_BACKOFF_MAX_SECS = 60
+    # requests per second to one host, None for no limit
+    DEFAULT_RATE_LIMIT = 20
+    # concurrent requests per host start here and grow while the host keeps up
+    DEFAULT_INITIAL_CONCURRENCY = 4
+    DEFAULT_POOL_CONNECTIONS = 4
+    DEFAULT_TIMEOUT_SECS = 30
+    DEFAULT_MAX_IN_FLIGHT = 200
+    DEFAULT_PIPELINE_QUEUE_SIZE = 64
+    # urls parsed by a thread before its rows are written out and checkpointed
+    DEFAULT_FLUSH_COUNT = 10
+    # shards of a scrape_sharded run, far more than workers so a slow shard does not hold up the end of the run
+    DEFAULT_SHARD_COUNT = 64
+    # cached pages that may still change are revalidated after this long
+    DEFAULT_CACHE_REVALIDATE_SECS = 300
+    # games older than this are final and their pages never change
+    DEFAULT_FINAL_AFTER_DAYS = 2
+    # a metrics summary is printed this often during a run, 0 turns it off
+    DEFAULT_PROGRESS_SECS = 30
+
+    FILE_PREFIX = ''
+
+    OUTPUT_FORMATS = ('csv', 'parquet', 'sqlite')
+    # typed parquet columns, a list of (column, pyarrow type name) pairs
+    OUTPUT_SCHEMA = None
+    # parquet datasets are split into [PARTITION_COLUMN]=[value] folders by get_partition_value
+    PARTITION_COLUMN = None
+    # sqlite output, rows are upserted on PRIMARY_KEY and INDEX_COLUMNS are indexed (a column or a tuple of columns each)
+    PRIMARY_KEY = None
+    INDEX_COLUMNS = ()
+    DEFAULT_STORE_FILE_NAME = 'scraper_data' + SQLITE_EXTENSION
+
+    # gzip/deflate always, br when brotli is installed
+    DEFAULT_HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+        'Accept': '*/*',
+        'Accept-Encoding': DEFAULT_ACCEPT_ENCODING,
+        'Connection': 'keep-alive',
+    }
+
+    # per scraper additions to DEFAULT_HEADERS
+    HEADERS = {}
 
     EXCEPTIONS = (
         RequestException,
     )
 
-    def __init__(self, max_threads=None):
+    # statuses that mean the host wants fewer requests
+    THROTTLE_STATUS_CODES = (429, 503)
+
+    def __init__(self, max_threads=None, pool_size=None, headers=None, use_cache=False, cache_max_bytes=None, resume=False, output_format='csv', rate_limit=None, max_concurrency=None, progress_secs=None, metrics_port=None, profile=False, store_file_path=None, priority=0):
         self.data_folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
         self.thread_data_folder_path = os.path.join(self.data_folder_path, 'thread_data')
-        self.create_folders([self.data_folder_path, self.thread_data_folder_path])
+        self.manifest_folder_path = os.path.join(self.data_folder_path, 'manifests')
+        self.metrics_folder_path = os.path.join(self.data_folder_path, 'metrics')
+        self.create_folders([self.data_folder_path, self.thread_data_folder_path, self.manifest_folder_path, self.metrics_folder_path])
+
+        self.resume = resume
+        self.run_manifest = None
+
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f'Unknown output format {output_format}, expected one of {self.OUTPUT_FORMATS}.')
+
+        if output_format == 'parquet' and self.OUTPUT_SCHEMA is None:
+            raise ValueError(f'{type(self).__name__} has no parquet schema.')
+
+        if output_format == 'sqlite' and (self.OUTPUT_SCHEMA is None or self.PRIMARY_KEY is None):
+            raise ValueError(f'{type(self).__name__} has no sqlite schema or primary key.')
+
+        self.output_format = output_format
+
+        # every scraper writes its own table of one database by default
+        if store_file_path is None:
+            self.store_file_path = os.path.join(self.data_folder_path, self.DEFAULT_STORE_FILE_NAME)
+        else:
+            self.store_file_path = store_file_path
+
+        if use_cache:
+            self.response_cache = ResponseCache(os.path.join(self.data_folder_path, 'response_cache'), max_bytes=cache_max_bytes)
+        else:
+            self.response_cache = None
     
         if max_threads is None:
             self.max_threads = mp.cpu_count()
         else:
             self.max_threads = max_threads
 
+        # one connection per thread so no thread waits on the pool
+        if pool_size is None:
+            self.pool_size = self.max_threads
+        else:
+            self.pool_size = pool_size
+
+        # 0 turns the per host rate limit off
+        if rate_limit is None:
+            self.rate_limit = self.DEFAULT_RATE_LIMIT
+        else:
+            self.rate_limit = rate_limit
+
+        # by default the adaptive limit can grow up to one request per worker
+        self.max_concurrency = max_concurrency
+        self.worker_count = self.max_threads
+        # when scrapers run side by side, requests with the lower priority number get the free slots of a host first
+        self.priority = priority
+
+        self.headers = dict(self.DEFAULT_HEADERS)
+        self.headers.update(self.HEADERS)
+        if headers is not None:
+            self.headers.update(headers)
+
+        self.session = None
+        self.session_lock = Lock()
+
+        if progress_secs is None:
+            self.progress_secs = self.DEFAULT_PROGRESS_SECS
+        else:
+            self.progress_secs = progress_secs
+
+        # profile=True dumps a cProfile of the fetch and parse stages to data/profiles after each run
+        if profile:
+            self.metrics = ScrapeMetrics(self.get_metrics_name(), os.path.join(self.data_folder_path, 'profiles'))
+        else:
+            self.metrics = ScrapeMetrics(self.get_metrics_name())
+
+        if metrics_port is not None:
+            self.metrics.start_server(metrics_port)
+
+        # called with (url, block) for every page scrape_multi_thread_worker parses, lets another stage start on its rows
+        self.block_callback = None
+
+    def __getstate__(self):
+        # sessions and locks cannot be sent to the parse processes
+        state = self.__dict__.copy()
+        state['session'] = None
+        state['response_cache'] = None
+        state['run_manifest'] = None
+        state['block_callback'] = None
+        state['metrics'] = None
+        del state['session_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.session_lock = Lock()
+        # metrics of a parse process are never read
+        if self.metrics is None:
+            self.metrics = ScrapeMetrics(self.get_metrics_name())
+
+    def create_session(self):
+        session = requests.Session()
+        session.headers.update(self.headers)
+
+        adapter = HTTPAdapter(pool_connections=self.DEFAULT_POOL_CONNECTIONS, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
+
+    def get_session(self):
+        # the session is shared by all threads, urllib3 connection pools are thread safe
+        if self.session is None:
+            with self.session_lock:
+                if self.session is None:
+                    self.session = self.create_session()
+
+        return self.session
+
+    def close_session(self):
+        with self.session_lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
     def create_folders(self, folder_paths):
         for folder_path in folder_paths:
             if not os.path.exists(folder_path):
@@ -44,7 +241,10 @@ class BaseScraper:
             if file_prefix != '' and file_prefix[-1] != '_':
                 file_prefix += '_'
             
-            file_name = f'{file_prefix}_{self.get_timestamp()}_{thread_id:05}.csv'
+            if thread_id is None:
+                file_name = f'{file_prefix}{self.get_timestamp()}.csv'
+            else:
+                file_name = f'{file_prefix}{self.get_timestamp()}_{thread_id:05}.csv'
         
         if thread_data:
             folder_path = self.thread_data_folder_path
@@ -52,38 +252,240 @@ class BaseScraper:
             folder_path = self.data_folder_path
         
         file_path = os.path.join(folder_path, file_name)
-        
-        data_df = pd.DataFrame(data)
-        data_df.to_csv(file_path, index=False)
 
-    def attempt_get(self, url, error_limit=None, wait_time=None):
+        with self.open_sink(file_path) as sink:
+            sink.write_block(data)
+
+    def get_season_end_year(self, dt):
+        # seasons start in october and are named after the year they end in
+        if dt.month >= 10:
+            return dt.year + 1
+
+        return dt.year
+
+    def get_current_season_end_year(self):
+        return self.get_season_end_year(datetime.now())
+
+    def is_final_date(self, dt, at=None):
+        # whether the games of dt were final at the time at, now by default
+        if at is None:
+            at = datetime.now()
+
+        return (at - dt).days >= self.DEFAULT_FINAL_AFTER_DAYS
+
+    def is_immutable_url(self, url, fetched_at):
+        # scrapers return True for pages of games and seasons that were already finished when the page
+        # was fetched (a unix time), a page fetched before then may still show a game that had not started
+        return False
+
+    def get_cached_response(self, url):
+        # returns (cached response that can be used as is, cached response to revalidate)
+        if self.response_cache is None:
+            return None, None
+
+        cached_response = self.response_cache.get(url)
+        if cached_response is None:
+            return None, None
+
+        if self.is_immutable_url(url, cached_response.fetched_at) or cached_response.get_age() < self.DEFAULT_CACHE_REVALIDATE_SECS:
+            return cached_response, None
+
+        return None, cached_response
+
+    def get_throttle(self, url):
+        if self.max_concurrency is None:
+            max_concurrency = self.worker_count
+        else:
+            max_concurrency = self.max_concurrency
+
+        host = urlparse(url).netloc
+        return get_host_throttle(host, self.rate_limit, max_concurrency, self.DEFAULT_INITIAL_CONCURRENCY)
+
+    def get_status_action(self, status_code):
+        # what attempt_get does with a response: use it, back off and retry, or give up
+        if status_code in (200, 304):
+            return 'ok'
+
+        if status_code in self.THROTTLE_STATUS_CODES:
+            return 'throttled'
+
+        if status_code >= 500 or status_code == 408:
+            return 'retry'
+
+        return 'fail'
+
+    def get_metrics_name(self):
+        return self.FILE_PREFIX or type(self).__name__
+
+    def get_metrics_file_path(self):
+        return os.path.join(self.metrics_folder_path, f'{self.get_metrics_name()}.prom')
+
+    def start_metrics(self, url_count):
+        self.metrics.start_run(url_count, self.progress_secs, self.get_metrics_file_path())
+
+    def finish_metrics(self):
+        self.metrics.finish_run(self.get_metrics_file_path())
+
+    def get_block_row_count(self, block):
+        # a block is a list of dicts or a header row followed by list rows
+        if len(block) == 0 or isinstance(block[0], dict):
+            return len(block)
+
+        return len(block) - 1
+
+    def attempt_get(self, url, error_limit=None, wait_time=None, headers=None):
+        start = time.perf_counter()
+        with self.metrics.profile('fetch'):
+            response, attempt_count, status_code = self.get_with_retries(url, error_limit, wait_time, headers)
+
+        self.metrics.record_fetch(
+            time.perf_counter() - start,
+            None if response is None else len(response.content),
+            max(0, attempt_count - 1),
+            status_code,
+            from_cache=isinstance(response, CachedResponse)
+        )
+        return response
+
+    def get_with_retries(self, url, error_limit=None, wait_time=None, headers=None):
+        # returns the response (None if every attempt failed), the attempts made and the last status code
+        # headers are added to the request, a caller sending its own validators gets a 304 back as is
         if error_limit is None:
             error_limit = self.DEFAULT_ERROR_LIMIT
 
         if wait_time is None:
-            wait_time = self.DEFAULT_WAIT_TIME_SHORT_SECS
+            wait_time = self.DEFAULT_BACKOFF_BASE_SECS
+
+        cached_response, stale_response = self.get_cached_response(url)
+        if cached_response is not None:
+            return cached_response, 0, cached_response.status_code
+
+        request_headers = {}
+        if headers is not None:
+            request_headers.update(headers)
+
+        if stale_response is not None:
+            request_headers.update(stale_response.get_revalidation_headers())
+
+        throttle = self.get_throttle(url)
+        status_code = None
+        for attempt in range(1, error_limit + 1):
+            retry_after = None
 
-        attempt = 1
-        while True:
+            throttle.acquire(self.priority)
             try:
-                response = requests.get(url)
-                if response.status_code != 200:
-                    raise requests.exceptions.RequestException
-                
-                break
+                response = self.get_session().get(url, headers=request_headers or None, timeout=self.DEFAULT_TIMEOUT_SECS)
             except self.EXCEPTIONS:
-                print(f'Unable to get {url} on attempt {attempt} of {error_limit}. Sleeping for {wait_time} seconds.')
-                attempt += 1
-                time.sleep(wait_time)
-            
-            if attempt > error_limit:
-                print(f'Unable to get {url} after {error_limit} attempts.')
-                response = None
-                break
+                throttle.release(success=False)
+                status_code = None
+                action = 'retry'
+            else:
+                status_code = response.status_code
+                action = self.get_status_action(status_code)
+                throttle.release(success=(action in ('ok', 'fail')))
 
-        return response
+            if action == 'ok':
+                if status_code == 304 and stale_response is not None:
+                    self.response_cache.refresh(stale_response)
+                    return stale_response, attempt, status_code
+
+                if self.response_cache is not None and status_code == 200:
+                    self.response_cache.put(url, response.content, response.headers)
+
+                return response, attempt, status_code
+
+            if action == 'fail':
+                print(f'Unable to get {url}, status code {status_code}.')
+                return None, attempt, status_code
+
+            if action == 'throttled':
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+            backoff_time = get_backoff_time(attempt, wait_time, self.DEFAULT_BACKOFF_MAX_SECS, retry_after)
+            print(f'Unable to get {url} on attempt {attempt} of {error_limit}. Sleeping for {backoff_time:.1f} seconds.')
+            time.sleep(backoff_time)
+
+        print(f'Unable to get {url} after {error_limit} attempts.')
+        return None, error_limit, status_code
+
+    async def attempt_get_async(self, client, url, error_limit=None, wait_time=None):
+        start = time.perf_counter()
+        content, attempt_count, status_code, from_cache = await self.get_with_retries_async(client, url, error_limit, wait_time)
+
+        self.metrics.record_fetch(
+            time.perf_counter() - start,
+            None if content is None else len(content),
+            max(0, attempt_count - 1),
+            status_code,
+            from_cache=from_cache
+        )
+        return content
+
+    async def get_with_retries_async(self, client, url, error_limit=None, wait_time=None):
+        # returns the content (None if every attempt failed), the attempts made, the last status code and whether it came from the cache
+        import asyncio
+        aiohttp = import_aiohttp()
+
+        if error_limit is None:
+            error_limit = self.DEFAULT_ERROR_LIMIT
+
+        if wait_time is None:
+            wait_time = self.DEFAULT_BACKOFF_BASE_SECS
+
+        cached_response, stale_response = self.get_cached_response(url)
+        if cached_response is not None:
+            return cached_response.content, 0, cached_response.status_code, True
+
+        request_headers = None
+        if stale_response is not None:
+            request_headers = stale_response.get_revalidation_headers()
+
+        throttle = self.get_throttle(url)
+        status_code = None
+        for attempt in range(1, error_limit + 1):
+            retry_after = None
+
+            await throttle.acquire_async(self.priority)
+            try:
+                async with client.get(url, headers=request_headers) as response:
+                    status_code = response.status
+                    action = self.get_status_action(status_code)
+                    if action == 'ok':
+                        content = await response.read()
+                    elif action == 'throttled':
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status_code = None
+                action = 'retry'
+
+            throttle.release(success=(action in ('ok', 'fail')))
+
+            if action == 'ok':
+                if status_code == 304 and stale_response is not None:
+                    self.response_cache.refresh(stale_response)
+                    return stale_response.content, attempt, status_code, True
+
+                if self.response_cache is not None:
+                    self.response_cache.put(url, content, response.headers)
+
+                return content, attempt, status_code, False
+
+            if action == 'fail':
+                print(f'Unable to get {url}, status code {status_code}.')
+                return None, attempt, status_code, False
+
+            backoff_time = get_backoff_time(attempt, wait_time, self.DEFAULT_BACKOFF_MAX_SECS, retry_after)
+            print(f'Unable to get {url} on attempt {attempt} of {error_limit}. Sleeping for {backoff_time:.1f} seconds.')
+            await asyncio.sleep(backoff_time)
+
+        print(f'Unable to get {url} after {error_limit} attempts.')
+        return None, error_limit, status_code, False
     
     def consolidate_files(self, file_name_prefix, thread_data=False):
+        # sqlite rows are already in the store, there are no files to consolidate
+        if self.output_format == 'sqlite':
+            return
+
         consolidated_folder_path = os.path.join(self.data_folder_path, 'consolidated_data')
         self.create_folders([consolidated_folder_path])
 
@@ -96,47 +498,41 @@ class BaseScraper:
 
         # filter files
         prefix_length = len(file_name_prefix)
+        file_extension = self.get_file_extension()
         filtered_files = []
         for file_name in all_files:
-            if file_name[:prefix_length].lower() == file_name_prefix.lower():
+            if file_name[:prefix_length].lower() == file_name_prefix.lower() and file_name.endswith(file_extension):
                 file_path = os.path.join(input_file_folder_path, file_name)
                 filtered_files.append(file_path)
 
         file_count = len(filtered_files)        
         print(f'Found {file_count} files with the prefix {file_name_prefix}.')
 
-        # read data from files
-        data = []
-        for i, file_path in enumerate(filtered_files):            
-            with open(file_path, 'r', newline='') as f:
-                reader = csv.reader(f)
-
-                for j, row in enumerate(reader):
-                    if (j == 0) and (i != 0):
-                        # skip headers except for first file
-                        print(f'Skipping first row for file {i + 1} ({file_path}).')
-                        continue
-                    
-                    data.append(row)
-                
-                #print(f'File {i+1} has {j+1} rows.')                
-                #print(f'Row count after {i+1} files: {len(data)}.')
-
         # write data to new file
         file_name_postfix = self.get_timestamp()
-        file_name = f'{file_name_prefix}_consolidated_data_{file_name_postfix}.csv'
+        file_name = f'{file_name_prefix}_consolidated_data_{file_name_postfix}{file_extension}'
         file_path = os.path.join(consolidated_folder_path, file_name)
 
-        with open(file_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-
-            for row in data:
-                writer.writerow(row)
+        self.concatenate_outputs(filtered_files, file_path)
     
         # remove thread files
         if thread_data:            
             for file_path in filtered_files:
-                os.remove(file_path)
+                self.remove_output(file_path)
+
+    def concatenate_outputs(self, file_paths, output_file_path):
+        # rows are never loaded into memory all at once
+        if self.output_format == 'parquet':
+            merge_parquet_datasets(file_paths, output_file_path)
+        else:
+            concatenate_csv_files(file_paths, output_file_path)
+
+    def remove_output(self, file_path):
+        # parquet outputs are dataset folders
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path)
+        else:
+            os.remove(file_path)
 
     def start_threads(self, worker_function, data_list):
         data_length = len(data_list)
@@ -146,20 +542,483 @@ class BaseScraper:
 
         thread_count = min(data_length, self.max_threads)
 
-        data_chunk_size = data_length // thread_count
+        print(f'Starting {thread_count} threads. Data length: {data_length}.')
 
-        print(f'Starting {thread_count} threads. Data length: {data_length}, data chunk size: {data_chunk_size}.')
+        # workers pull items from a shared queue so one slow item does not hold up a whole chunk
+        work_queue = WorkQueue(data_list)
+        for thread in self.start_queue_threads(worker_function, work_queue, thread_count):
+            thread.join()
 
-        data_chunks = []
+        work_queue.print_timing_summary()
+
+    def start_queue_threads(self, worker_function, work_queue, thread_count):
         threads = []
         for i in range(thread_count):
-            if i == (thread_count - 1):
-                data_chunks.append(data_list[data_chunk_size * i:])
-            else:
-                data_chunks.append(data_list[data_chunk_size * i: data_chunk_size * (i + 1)])
-
-            threads.append(Thread(target=worker_function, args=(data_chunks[-1], i + 1)))
+            threads.append(Thread(target=worker_function, args=(work_queue.worker_items(), i + 1)))
             threads[-1].start()
 
-        for thread in threads:
-            thread.join()
\ No newline at end of file
+        return threads
+
+    def get_urls(self):
+        raise NotImplementedError
+
+    def parse_response(self, url, content):
+        # returns the rows extracted from one page
+        raise NotImplementedError
+
+    def parse_block(self, url, content):
+        # parse_response with its time and rows recorded
+        start = time.perf_counter()
+        try:
+            with self.metrics.profile('parse'):
+                block = self.parse_response(url, content)
+        except Exception:
+            self.metrics.record_parse_error()
+            raise
+
+        self.metrics.record_parse(time.perf_counter() - start, self.get_block_row_count(block))
+        return block
+
+    def write_block(self, sink, block):
+        sink.write_block(block)
+        self.metrics.record_rows('written', self.get_block_row_count(block))
+
+    def get_file_extension(self):
+        if self.output_format == 'parquet':
+            return '.parquet'
+
+        if self.output_format == 'sqlite':
+            return SQLITE_EXTENSION
+
+        return '.csv'
+
+    def get_partition_value(self, row):
+        return None
+
+    def open_sink(self, file_path, append=False):
+        if self.output_format == 'parquet':
+            return ParquetSink(file_path, self.OUTPUT_SCHEMA, self.PARTITION_COLUMN, self.get_partition_value, append=append)
+
+        # every sink writes to the store whatever file_path it was opened for
+        if self.output_format == 'sqlite':
+            return SQLiteSink(
+                self.store_file_path, self.FILE_PREFIX, self.OUTPUT_SCHEMA, self.PRIMARY_KEY, self.INDEX_COLUMNS,
+                self.PARTITION_COLUMN, self.get_partition_value, append=append
+            )
+
+        return CSVSink(file_path, append=append)
+
+    def read_store_rows(self, where='', parameters=()):
+        # rows of this scraper's sqlite table, e.g. read_store_rows('team_name = ?', ('Boston Celtics',))
+        return read_sqlite_rows(self.store_file_path, self.FILE_PREFIX, where, parameters)
+
+    def read_store_max(self, column):
+        return read_sqlite_max(self.store_file_path, self.FILE_PREFIX, column)
+
+    def get_thread_file_path(self, thread_id):
+        file_name = f'{self.FILE_PREFIX}_{self.get_timestamp()}_{thread_id:05}{self.get_file_extension()}'
+        return os.path.join(self.thread_data_folder_path, file_name)
+
+    def get_output_file_path(self):
+        consolidated_folder_path = os.path.join(self.data_folder_path, 'consolidated_data')
+        self.create_folders([consolidated_folder_path])
+
+        file_name = f'{self.FILE_PREFIX}_consolidated_data_{self.get_timestamp()}{self.get_file_extension()}'
+        return os.path.join(consolidated_folder_path, file_name)
+
+    def consolidate_results(self):
+        self.consolidate_files(self.FILE_PREFIX, thread_data=True)
+
+    def start_run_manifest(self, urls):
+        manifest_file_path = os.path.join(self.manifest_folder_path, f'{self.FILE_PREFIX}_manifest.sqlite')
+        self.run_manifest = RunManifest(manifest_file_path)
+
+        if not self.resume:
+            self.run_manifest.reset()
+            return urls
+
+        self.run_manifest.truncate_outputs()
+        completed_urls = self.run_manifest.get_completed_urls()
+        remaining_urls = [url for url in urls if url not in completed_urls]
+
+        print(f'Resuming run, skipping {len(urls) - len(remaining_urls)} completed url(s) of {len(urls)}.')
+        return remaining_urls
+
+    def finish_run_manifest(self):
+        self.run_manifest.delete()
+        self.run_manifest = None
+
+    def checkpoint(self, sink, urls):
+        # the manifest must never point at rows that are not on disk yet
+        output_offset = sink.flush()
+
+        if self.run_manifest is not None and len(urls) > 0:
+            self.run_manifest.commit_urls(urls, sink.file_path, output_offset)
+
+    def scrape_multi_thread_worker(self, urls, thread_id):
+        url_count = len(urls)
+        print(f'Thread {thread_id:05} started, {url_count} url(s) queued.')
+
+        file_path = self.get_thread_file_path(thread_id)
+        if self.run_manifest is not None:
+            self.run_manifest.register_output(file_path)
+
+        # rows go to disk as each page is parsed and are checkpointed every DEFAULT_FLUSH_COUNT urls
+        checkpoint_urls = []
+        i = 0
+        with self.open_sink(file_path, append=True) as sink:
+            for i, url in enumerate(urls, 1):
+                if i % self.DEFAULT_PRINT_COUNT == 0:
+                    print(f'Thread {thread_id:05} getting its url {i} ({url_count} queued in total).')
+
+                response = self.attempt_get(url)
+                if response is None:
+                    if self.run_manifest is not None:
+                        self.run_manifest.mark_failed(url)
+                    continue
+
+                block = self.parse_block(url, response.content)
+                self.write_block(sink, block)
+                checkpoint_urls.append(url)
+
+                if self.block_callback is not None:
+                    self.block_callback(url, block)
+
+                if len(checkpoint_urls) >= self.DEFAULT_FLUSH_COUNT:
+                    self.checkpoint(sink, checkpoint_urls)
+                    checkpoint_urls = []
+
+            self.checkpoint(sink, checkpoint_urls)
+
+        print(f'Thread {thread_id:05} complete after {i} url(s), {sink.row_count} row(s).')
+
+    def fetch_and_parse(self, url):
+        response = self.attempt_get(url)
+        if response is None:
+            return None
+
+        return self.parse_block(url, response.content)
+
+    def fetch_and_parse_all(self, urls):
+        # for small runs whose rows fit in memory, returns {url: rows} for the urls that could be fetched
+        with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            blocks = executor.map(self.fetch_and_parse, urls)
+            return {url: block for url, block in zip(urls, blocks) if block is not None}
+
+    def scrape(self):
+        urls = self.start_run_manifest(self.get_urls())
+
+        self.start_metrics(len(urls))
+        self.start_threads(self.scrape_multi_thread_worker, urls)
+        self.consolidate_results()
+        self.finish_run_manifest()
+        self.finish_metrics()
+
+    def get_shard_key(self, url):
+        # urls with the same key always end up in the same shard
+        return url
+
+    def get_shard_output_path(self, folder_path, shard_id):
+        return os.path.join(folder_path, f'{self.FILE_PREFIX}_shard_{shard_id:05}{self.get_file_extension()}')
+
+    def scrape_shard(self, urls, file_path):
+        # urls are fetched and parsed by max_threads threads and written in order by this one, returns the urls that failed
+        failed_urls = []
+        if len(urls) == 0:
+            return failed_urls
+
+        with ThreadPoolExecutor(max_workers=min(len(urls), self.max_threads)) as executor, self.open_sink(file_path) as sink:
+            for url, block in zip(urls, executor.map(self.fetch_and_parse, urls)):
+                if block is None:
+                    failed_urls.append(url)
+                    continue
+
+                self.write_block(sink, block)
+
+                if self.block_callback is not None:
+                    self.block_callback(url, block)
+
+        return failed_urls
+
+    def publish_shard_output(self, partial_file_path, file_path):
+        # a worker whose lease ran out may have published the shard already
+        if os.path.exists(file_path):
+            self.remove_output(file_path)
+
+        os.replace(partial_file_path, file_path)
+
+    def scrape_sharded(self, coordinator_folder_path=None, shard_count=None, worker_id=None, lease_secs=None, merge=True):
+        '''
+        one worker of a sharded run, start it in as many processes, on as many hosts, as wanted with
+        the same coordinator folder (on a filesystem they share) and shard count
+        every worker scrapes the urls of the first one to plan the run, split into the same shards
+        by get_shard_key, claims shards one at a time with a lease, and writes each to its own
+        [FILE_PREFIX]_shard_[id] output in the coordinator folder, the worker that finds every
+        shard done merges the outputs into the usual consolidated output and deletes the run's
+        shards.sqlite, so the next run in the folder starts over
+        returns the urls of the shards that failed, whose rows are missing, the shard outputs
+        are only merged once there are none
+        '''
+        if coordinator_folder_path is None:
+            coordinator_folder_path = os.path.join(self.data_folder_path, 'shards', self.FILE_PREFIX)
+
+        if shard_count is None:
+            shard_count = self.DEFAULT_SHARD_COUNT
+
+        coordinator = ShardCoordinator(coordinator_folder_path, shard_count, lease_secs, worker_id)
+
+        shard_urls = {}
+        for url in coordinator.plan_urls(self.get_urls()):
+            shard_urls.setdefault(get_shard_id(self.get_shard_key(url), shard_count), []).append(url)
+
+        print(f'Worker {coordinator.worker_id} joined a run of {shard_count} shards in {coordinator_folder_path}.')
+
+        self.start_metrics(0)
+        shard_total = 0
+        merged = False
+        try:
+            while True:
+                shard_id = coordinator.claim()
+                if shard_id is None:
+                    # a worker that died holding a lease leaves its shard to whoever is still around
+                    if coordinator.is_finished():
+                        break
+
+                    coordinator.wait()
+                    continue
+
+                urls = shard_urls.get(shard_id, [])
+                self.metrics.add_urls(len(urls))
+                print(f'Worker {coordinator.worker_id} scraping shard {shard_id:05}, {len(urls)} url(s).')
+
+                file_path = self.get_shard_output_path(coordinator_folder_path, shard_id)
+                # named after the worker so a worker that lost its lease never writes over the new one
+                partial_file_path = f'{file_path}.{coordinator.worker_id}.partial'
+
+                coordinator.start_renewing(shard_id)
+                try:
+                    failed_urls = self.scrape_shard(urls, partial_file_path)
+                except Exception:
+                    coordinator.stop_renewing()
+                    coordinator.release(shard_id)
+                    raise
+
+                coordinator.stop_renewing()
+
+                if len(failed_urls) > 0:
+                    if os.path.exists(partial_file_path):
+                        self.remove_output(partial_file_path)
+
+                    attempts = coordinator.get_attempts(shard_id)
+                    if attempts < coordinator.DEFAULT_MAX_ATTEMPTS:
+                        print(f'Shard {shard_id:05} has {len(failed_urls)} url(s) that could not be fetched, releasing it to be retried.')
+                        coordinator.release(shard_id)
+                    else:
+                        print(f'Shard {shard_id:05} still has {len(failed_urls)} url(s) that could not be fetched after {attempts} attempts, marking it failed.')
+                        coordinator.fail(shard_id, failed_urls)
+                    continue
+
+                # shards without rows (or written to the sqlite store) have no file to publish
+                if os.path.exists(partial_file_path):
+                    completed = coordinator.complete(
+                        shard_id, file_path, len(urls), lambda: self.publish_shard_output(partial_file_path, file_path)
+                    )
+                else:
+                    completed = coordinator.complete(shard_id, None, len(urls))
+
+                if completed:
+                    shard_total += 1
+                else:
+                    print(f'Shard {shard_id:05} was taken over by another worker, discarding its output.')
+                    if os.path.exists(partial_file_path):
+                        self.remove_output(partial_file_path)
+
+            print(f'Worker {coordinator.worker_id} completed {shard_total} shard(s), shards by status: {coordinator.get_status_counts()}.')
+
+            run_failed_urls = coordinator.get_failed_urls()
+            if len(run_failed_urls) > 0:
+                print(f'{len(run_failed_urls)} url(s) of failed shards could not be fetched, the shard outputs are not merged. Run a worker again to retry them.')
+            elif merge and coordinator.claim_merge():
+                self.merge_shards(coordinator)
+                merged = True
+        finally:
+            coordinator.close()
+            self.finish_metrics()
+
+        # the run is over, the next one in the same folder starts from a new plan
+        if merged:
+            coordinator.delete()
+
+        return run_failed_urls
+
+    def merge_shards(self, coordinator):
+        file_paths = coordinator.get_output_files()
+        print(f'Merging {len(file_paths)} shard output(s).')
+
+        # sqlite rows are already in the store
+        if self.output_format == 'sqlite':
+            return
+
+        self.concatenate_outputs(file_paths, self.get_output_file_path())
+
+        # along with what workers that died part way through a shard left behind
+        partial_file_paths = [
+            os.path.join(coordinator.folder_path, file_name) for file_name in os.listdir(coordinator.folder_path) if file_name.endswith('.partial')
+        ]
+        for file_path in file_paths + partial_file_paths:
+            self.remove_output(file_path)
+
+    async def fetch_and_parse_async(self, urls, max_in_flight, parse_executor, sink):
+        import asyncio
+        aiohttp = import_aiohttp()
+
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(max_in_flight)
+        url_count = len(urls)
+        completed = 0
+
+        async def fetch_and_parse(client, url):
+            nonlocal completed
+
+            async with semaphore:
+                content = await self.attempt_get_async(client, url)
+
+            completed += 1
+            if completed % self.DEFAULT_PRINT_COUNT == 0:
+                print(f'Got url {completed} of {url_count}.')
+
+            if content is None:
+                return
+
+            # parsing is CPU bound, keep it off the event loop
+            # one page that fails must not take the rest of the run down with it in gather
+            try:
+                block = await loop.run_in_executor(parse_executor, self.parse_block, url, content)
+            except Exception as e:
+                # parse_block has already counted the parse error
+                print(f'Unable to parse {url}: {e!r}')
+                return
+
+            try:
+                self.write_block(sink, block)
+            except Exception as e:
+                print(f'Unable to write the rows of {url}: {e!r}')
+
+        connector = aiohttp.TCPConnector(limit=max_in_flight)
+        timeout = aiohttp.ClientTimeout(total=self.DEFAULT_TIMEOUT_SECS)
+        async with aiohttp.ClientSession(headers=self.headers, connector=connector, timeout=timeout) as client:
+            await asyncio.gather(*[fetch_and_parse(client, url) for url in urls])
+
+    def scrape_async(self, max_in_flight=None, parse_workers=None):
+        import asyncio
+        import_aiohttp()
+
+        if max_in_flight is None:
+            max_in_flight = self.DEFAULT_MAX_IN_FLIGHT
+
+        if parse_workers is None:
+            parse_workers = self.max_threads
+
+        urls = self.get_urls()
+        if len(urls) == 0:
+            print('No data found.')
+            return
+
+        print(f'Getting {len(urls)} urls with up to {max_in_flight} requests in flight.')
+        self.worker_count = max_in_flight
+
+        self.start_metrics(len(urls))
+        loop = asyncio.new_event_loop()
+        try:
+            with ThreadPoolExecutor(max_workers=parse_workers) as parse_executor, self.open_sink(self.get_output_file_path()) as sink:
+                loop.run_until_complete(self.fetch_and_parse_async(urls, max_in_flight, parse_executor, sink))
+        finally:
+            loop.close()
+            self.finish_metrics()
+
+        print(f'Wrote {sink.row_count} row(s) to {sink.file_path}.')
+
+    def scrape_pipelined(self, fetch_workers=None, parse_workers=None, queue_size=None):
+        if fetch_workers is None:
+            fetch_workers = self.max_threads
+
+        if parse_workers is None:
+            parse_workers = mp.cpu_count()
+
+        if queue_size is None:
+            queue_size = self.DEFAULT_PIPELINE_QUEUE_SIZE
+
+        urls = self.get_urls()
+        if len(urls) == 0:
+            print('No data found.')
+            return
+
+        print(f'Getting {len(urls)} urls with {fetch_workers} fetch threads and {parse_workers} parse processes.')
+        self.worker_count = fetch_workers
+        self.start_metrics(len(urls))
+
+        # fetch threads block on the bounded queue when the parsers fall behind
+        content_queue = Queue(maxsize=queue_size)
+        work_queue = WorkQueue(urls)
+
+        def fetch_worker(thread_urls):
+            for url in thread_urls:
+                response = self.attempt_get(url)
+                if response is not None:
+                    content_queue.put((url, response.content))
+
+        def run_fetch_workers():
+            threads = [Thread(target=fetch_worker, args=(work_queue.worker_items(),)) for _ in range(fetch_workers)]
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+            content_queue.put(None)
+
+        fetch_thread = Thread(target=run_fetch_workers)
+        fetch_thread.start()
+
+        futures = deque()
+        parsed_count = 0
+
+        def collect_oldest(sink):
+            nonlocal parsed_count
+
+            url, future = futures.popleft()
+            try:
+                block, parse_seconds = future.result()
+            except Exception as e:
+                # keep draining the queue, a stopped consumer would leave the fetch threads blocked
+                print(f'Unable to parse {url}: {e!r}')
+                self.metrics.record_parse_error()
+                return
+
+            self.metrics.record_parse(parse_seconds, self.get_block_row_count(block))
+            self.write_block(sink, block)
+
+            parsed_count += 1
+            if parsed_count % self.DEFAULT_PRINT_COUNT == 0:
+                print(f'Parsed {parsed_count} of {len(urls)} urls.')
+
+        with ProcessPoolExecutor(max_workers=parse_workers, initializer=init_parse_worker, initargs=(self,)) as executor, self.open_sink(self.get_output_file_path()) as sink:
+            while True:
+                item = content_queue.get()
+                if item is None:
+                    break
+
+                futures.append((item[0], executor.submit(parse_in_worker, *item)))
+
+                # cap the pages waiting in the process pool as well
+                while len(futures) >= queue_size:
+                    collect_oldest(sink)
+
+            while len(futures) > 0:
+                collect_oldest(sink)
+
+        fetch_thread.join()
+        work_queue.print_timing_summary()
+        self.finish_metrics()
+
+        print(f'Wrote {sink.row_count} row(s) to {sink.file_path}.')
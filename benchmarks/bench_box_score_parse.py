@@ -0,0 +1,80 @@
+'''
+per page parse time of each ESPNBoxScoreScraper extract mode, and a check
+that every mode returns exactly the rows of the full html.parser mode
+
+usage: python -m benchmarks.bench_box_score_parse [pages_dir]
+pages_dir holds saved box score pages named [game_id].html and, for the json
+mode, their summary api responses named [game_id].json, synthetic pages from
+benchmarks.fixtures are used when it is not given
+'''
+import importlib.util
+import os
+import sys
+import time
+
+from benchmarks.fixtures import box_score_pages, box_score_summary_body
+from espnboxscorescraper import ESPNBoxScoreScraper
+
+DEFAULT_PAGE_COUNT = 20
+DEFAULT_REPEAT_COUNT = 3
+
+
+def read_pages(pages_dir, page_extension='.html'):
+    pages = {}
+    for file_name in sorted(os.listdir(pages_dir)):
+        game_id, extension = os.path.splitext(file_name)
+        if extension != page_extension:
+            continue
+
+        with open(os.path.join(pages_dir, file_name), 'rb') as f:
+            pages[game_id] = f.read()
+
+    return pages
+
+
+def time_mode(extract_mode, pages):
+    scraper = ESPNBoxScoreScraper(None, extract_mode=extract_mode)
+
+    rows = {}
+    start = time.perf_counter()
+    for _ in range(DEFAULT_REPEAT_COUNT):
+        for game_id, content in pages.items():
+            rows[game_id] = scraper.extract_reponse_data(content, game_id)
+    elapsed = time.perf_counter() - start
+
+    return elapsed / (DEFAULT_REPEAT_COUNT * len(pages)), rows
+
+
+def main(pages_dir=None):
+    if pages_dir is None:
+        pages = box_score_pages(DEFAULT_PAGE_COUNT)
+        summaries = {game_id: box_score_summary_body(int(game_id)) for game_id in pages}
+    else:
+        pages = read_pages(pages_dir)
+        summaries = read_pages(pages_dir, '.json')
+
+    page_bytes = sum(len(content) for content in pages.values()) / len(pages)
+    print(f'{len(pages)} pages, {page_bytes / 1024:.0f} KiB per page on average.')
+
+    extract_modes = [mode for mode in ESPNBoxScoreScraper.EXTRACT_MODES if mode != 'lxml' or importlib.util.find_spec('lxml') is not None]
+
+    # the json mode reads the summary of each page's game, when there is one for every page
+    if set(summaries) == set(pages):
+        summary_bytes = sum(len(content) for content in summaries.values()) / len(summaries)
+        print(f'{len(summaries)} summaries, {summary_bytes / 1024:.0f} KiB per summary on average.')
+    else:
+        extract_modes.remove('json')
+
+    timings = {
+        extract_mode: time_mode(extract_mode, summaries if extract_mode == 'json' else pages)
+        for extract_mode in extract_modes
+    }
+    full_seconds, full_rows = timings['full']
+
+    for extract_mode, (seconds, rows) in timings.items():
+        identical = 'identical' if rows == full_rows else 'DIFFERENT'
+        print(f'{extract_mode:10} {seconds * 1000:8.2f} ms/page {full_seconds / seconds:7.1f}x  rows {identical}')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,58 @@
+'''
+compares one connection per request (requests.get) with the pooled
+keep-alive session used by BaseScraper.attempt_get
+
+usage: python -m benchmarks.bench_http_session [request_count] [thread_count]
+'''
+import sys
+import time
+from threading import Thread
+
+import requests
+
+from basescraper import BaseScraper
+from benchmarks.mockserver import MockServer
+
+DEFAULT_REQUEST_COUNT = 2000
+DEFAULT_THREAD_COUNT = 8
+DEFAULT_BODY_SIZE = 50000
+
+
+def run_threads(get_function, url, request_count, thread_count):
+    def worker(count):
+        for _ in range(count):
+            get_function(url)
+
+    per_thread = request_count // thread_count
+    threads = [Thread(target=worker, args=(per_thread,)) for _ in range(thread_count)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return (per_thread * thread_count) / elapsed
+
+
+def main(request_count=DEFAULT_REQUEST_COUNT, thread_count=DEFAULT_THREAD_COUNT):
+    server = MockServer(body=b'x' * DEFAULT_BODY_SIZE).start()
+    url = f'{server.base_url}/nba/scoreboard/_/date/20230101'
+
+    try:
+        # no rate limit and one request in flight per thread, this measures the connection pool and not the throttle
+        scraper = BaseScraper(max_threads=thread_count, rate_limit=0, max_concurrency=thread_count)
+
+        unpooled = run_threads(requests.get, url, request_count, thread_count)
+        pooled = run_threads(scraper.attempt_get, url, request_count, thread_count)
+    finally:
+        server.stop()
+
+    print(f'requests.get:        {unpooled:10.1f} requests/sec')
+    print(f'pooled attempt_get:  {pooled:10.1f} requests/sec')
+    print(f'speedup:             {pooled / unpooled:10.2f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,304 @@
+'''
+end to end throughput of every scraper against a local FixtureServer, in each scrape mode
+reports pages/sec, p50/p99 page latency (attempt_get, retries and throttling included),
+parse cpu time and peak rss, every run is a fresh process so peak rss and the host
+throttles of one run do not leak into the next
+
+usage: python -m benchmarks.bench_scrapers [--scrapers ...] [--modes ...] [--latency secs]
+       [--error-rate share] [--throttle-rate share] [--recorded-cache path] [--json path]
+'''
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak rss and child cpu are not reported there
+    resource = None
+
+from benchmarks.mockserver import FixtureServer
+from espnboxscorescraper import ESPNBoxScoreScraper
+from espngameresultscraper import ESPNGameResultScraper
+from espnplayerstatsscraper import ESPNPlayerStatsScraper
+from nbaplayerstatsscraper import NBAPlayerStatsScraper
+
+SCRAPER_NAMES = ('game_results', 'box_score', 'espn_player_stats', 'nba_player_stats')
+MODES = ('threads', 'async', 'pipelined')
+
+DEFAULT_THREAD_COUNT = 8
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_LATENCY_SECS = 0.02
+DEFAULT_DATE_COUNT = 60
+DEFAULT_GAME_COUNT = 150
+DEFAULT_SEASON_COUNT = 5
+FIRST_DATE = datetime(2022, 11, 1)
+NBA_STAT_CATEGORIES = ['PTS', 'REB', 'AST', 'FG_PCT']
+
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+HOST_PATTERN = re.compile(r'^https?://[^/{]+')
+
+
+class TimedScraperMixin:
+    '''
+    records the latency of every attempt_get and the cpu time of every parse_response
+    list appends are atomic, so no lock is needed and the scraper still pickles for the parse processes
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetch_seconds = []
+        self.parse_cpu_seconds = []
+
+    def attempt_get(self, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().attempt_get(url, *args, **kwargs)
+        finally:
+            self.fetch_seconds.append(time.perf_counter() - start)
+
+    async def attempt_get_async(self, client, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().attempt_get_async(client, url, *args, **kwargs)
+        finally:
+            self.fetch_seconds.append(time.perf_counter() - start)
+
+    def parse_response(self, url, content):
+        start = time.thread_time()
+        try:
+            return super().parse_response(url, content)
+        finally:
+            self.parse_cpu_seconds.append(time.thread_time() - start)
+
+
+class TimedGameResultScraper(TimedScraperMixin, ESPNGameResultScraper):
+    pass
+
+
+class TimedBoxScoreScraper(TimedScraperMixin, ESPNBoxScoreScraper):
+    pass
+
+
+class TimedESPNPlayerStatsScraper(TimedScraperMixin, ESPNPlayerStatsScraper):
+    pass
+
+
+class TimedNBAPlayerStatsScraper(TimedScraperMixin, NBAPlayerStatsScraper):
+    pass
+
+
+def point_at_server(scraper, base_url):
+    # instance attributes so the scraper still pickles by its class
+    for name in ('BASE_URL', 'BASE_URL_RESULTS', 'SCOREBOARD_API_URL', 'SUMMARY_URL'):
+        if hasattr(scraper, name):
+            setattr(scraper, name, HOST_PATTERN.sub(base_url, getattr(scraper, name)))
+
+
+def write_box_score_url_file(file_path, base_url, game_count):
+    # game ids in the form the scoreboard fixture uses, a dozen games a day
+    with open(file_path, 'w', newline='') as f:
+        f.write('date,box_score_url\n')
+        for i in range(game_count):
+            date_string = (FIRST_DATE + timedelta(days=i // 12)).strftime('%Y%m%d')
+            f.write(f'{date_string},{base_url}/nba/boxscore/_/gameId/{int(date_string) * 100 + i % 12}\n')
+
+
+def create_scraper(scraper_name, base_url, folder_path, config):
+    kwargs = {'max_threads': config['threads'], 'rate_limit': config['rate_limit']}
+
+    if scraper_name == 'game_results':
+        last_date = FIRST_DATE + timedelta(days=config['dates'] - 1)
+        scraper = TimedGameResultScraper(FIRST_DATE, last_date, **kwargs)
+    elif scraper_name == 'box_score':
+        url_file_path = os.path.join(folder_path, 'box_score_urls.csv')
+        write_box_score_url_file(url_file_path, base_url, config['games'])
+        scraper = TimedBoxScoreScraper(url_file_path, extract_mode=config['extract_mode'], **kwargs)
+    elif scraper_name == 'espn_player_stats':
+        scraper = TimedESPNPlayerStatsScraper(2010, 2010 + config['seasons'] - 1, **kwargs)
+    else:
+        scraper = TimedNBAPlayerStatsScraper(2010, 2010 + config['seasons'] - 1, stat_categories=NBA_STAT_CATEGORIES, **kwargs)
+
+    point_at_server(scraper, base_url)
+
+    scraper.data_folder_path = folder_path
+    scraper.thread_data_folder_path = os.path.join(folder_path, 'thread_data')
+    scraper.manifest_folder_path = os.path.join(folder_path, 'manifests')
+    if hasattr(scraper, 'calendar_file_path'):
+        scraper.calendar_file_path = os.path.join(folder_path, 'season_calendar.json')
+    scraper.create_folders([scraper.thread_data_folder_path, scraper.manifest_folder_path])
+
+    return scraper
+
+
+def get_rusage(who):
+    if resource is None:
+        return None
+
+    return resource.getrusage(who)
+
+
+def get_peak_rss_mib(usage):
+    if usage is None:
+        return None
+
+    # bytes on macos, kib everywhere else
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss / 1024 ** 2
+
+    return usage.ru_maxrss / 1024
+
+
+def get_percentile(values, share):
+    if len(values) == 0:
+        return None
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run_child(scraper_name, mode, base_url, config):
+    folder_path = tempfile.mkdtemp(prefix=f'bench_{scraper_name}_')
+    try:
+        scraper = create_scraper(scraper_name, base_url, folder_path, config)
+
+        start = time.perf_counter()
+        if mode == 'threads':
+            scraper.scrape()
+        elif mode == 'async':
+            scraper.scrape_async(max_in_flight=config['max_in_flight'])
+        else:
+            scraper.scrape_pipelined()
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(folder_path, ignore_errors=True)
+
+    self_usage = get_rusage(resource.RUSAGE_SELF) if resource is not None else None
+    children_usage = get_rusage(resource.RUSAGE_CHILDREN) if resource is not None else None
+
+    # in pipelined mode the parse processes do all the parsing, their timings stay in those processes
+    parse_process_peak_rss = None
+    if mode == 'pipelined':
+        if children_usage is None:
+            parse_cpu = None
+        else:
+            parse_cpu = children_usage.ru_utime + children_usage.ru_stime
+            parse_process_peak_rss = get_peak_rss_mib(children_usage)
+    else:
+        parse_cpu = sum(scraper.parse_cpu_seconds)
+
+    result = {
+        'scraper': scraper_name,
+        'mode': mode,
+        'seconds': elapsed,
+        'p50_ms': get_percentile(scraper.fetch_seconds, 0.5) * 1000,
+        'p99_ms': get_percentile(scraper.fetch_seconds, 0.99) * 1000,
+        'parse_cpu_secs': parse_cpu,
+        'peak_rss_mib': get_peak_rss_mib(self_usage),
+        'parse_process_peak_rss_mib': parse_process_peak_rss,
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+def run_benchmark(scraper_name, mode, server, config):
+    server.reset_counts()
+    command = [sys.executable, '-m', 'benchmarks.bench_scrapers', '--child', scraper_name, mode, server.base_url, json.dumps(config)]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            result = json.loads(line[len(RESULT_PREFIX):])
+            # counted by the server, the parse processes' own requests are included
+            result['status_counts'] = server.reset_counts()
+            result['pages'] = result['status_counts'].get(200, 0)
+            result['pages_per_sec'] = result['pages'] / result['seconds']
+            return result
+
+    print(f'{scraper_name} {mode} failed:')
+    print(completed.stderr[-2000:])
+    return None
+
+
+def format_number(value, width):
+    if value is None:
+        return f'{"n/a":>{width}}'
+
+    return f'{value:{width}.2f}'
+
+
+def print_results(results):
+    print(f'{"scraper":18} {"mode":10} {"pages":>6} {"pages/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"parse cpu s":>11} {"peak rss MiB":>12} {"parse proc MiB":>14}  responses')
+    for result in results:
+        status_counts = ', '.join(f'{status}: {count}' for status, count in sorted(result['status_counts'].items()))
+        print(
+            f'{result["scraper"]:18} {result["mode"]:10} {result["pages"]:6} {result["pages_per_sec"]:9.1f} '
+            f'{result["p50_ms"]:8.1f} {result["p99_ms"]:8.1f} {format_number(result["parse_cpu_secs"], 11)} '
+            f'{format_number(result["peak_rss_mib"], 12)} {format_number(result["parse_process_peak_rss_mib"], 14)}  {status_counts}'
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the scrapers against a local mock of espn.com and stats.nba.com.')
+    parser.add_argument('--scrapers', nargs='+', choices=SCRAPER_NAMES, default=list(SCRAPER_NAMES))
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY_SECS, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of responses that are 500s')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='share of responses that are 429s')
+    parser.add_argument('--recorded-cache', help='response cache folder of a real run to serve pages from')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREAD_COUNT)
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument('--rate-limit', type=float, default=0, help='per host rate limit of the scrapers, 0 for none')
+    parser.add_argument('--extract-mode', default='lxml', choices=ESPNBoxScoreScraper.EXTRACT_MODES)
+    parser.add_argument('--dates', type=int, default=DEFAULT_DATE_COUNT)
+    parser.add_argument('--games', type=int, default=DEFAULT_GAME_COUNT)
+    parser.add_argument('--seasons', type=int, default=DEFAULT_SEASON_COUNT)
+    parser.add_argument('--json', help='also write the results to this file')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = {
+        'threads': args.threads,
+        'max_in_flight': args.max_in_flight,
+        'rate_limit': args.rate_limit,
+        'extract_mode': args.extract_mode,
+        'dates': args.dates,
+        'games': args.games,
+        'seasons': args.seasons,
+    }
+
+    server = FixtureServer(
+        recorded_cache_path=args.recorded_cache, latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate
+    ).start()
+
+    results = []
+    try:
+        for scraper_name in args.scrapers:
+            for mode in args.modes:
+                result = run_benchmark(scraper_name, mode, server, config)
+                if result is not None:
+                    results.append(result)
+    finally:
+        server.stop()
+
+    print_results(results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        run_child(sys.argv[2], sys.argv[3], sys.argv[4], json.loads(sys.argv[5]))
+    else:
+        main()
@@ -0,0 +1,140 @@
+'''
+cold start of every scraper module: the wall time of a fresh interpreter that imports it,
+less that of one that imports nothing, its cumulative import time from python -X importtime,
+the slowest top level packages under it and which heavy optional dependencies it loaded
+every sample is a new process, like a cron run or a spawned parse worker
+
+usage: python -m benchmarks.bench_startup [--modules ...] [--repeat n] [--top n] [--json path]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = (
+    'basescraper',
+    'espngameresultscraper',
+    'espnboxscorescraper',
+    'espnplayerstatsscraper',
+    'nbaplayerstatsscraper',
+    'livescoreboard',
+    'main',
+)
+# dependencies that only some scrape modes, output formats or extract modes use
+HEAVY_MODULES = ('aiohttp', 'pyarrow', 'numpy', 'pandas', 'bs4', 'lxml', 'orjson', 'asyncio')
+
+DEFAULT_REPEAT_COUNT = 10
+DEFAULT_TOP_COUNT = 5
+
+REPO_FOLDER_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHILD_CODE = '''
+import json, sys
+import {module}
+print(json.dumps(sorted(name for name in {heavy_modules!r} if name in sys.modules)))
+'''
+
+
+def run_python(arguments):
+    # seconds from spawning the interpreter to its exit and its stdout, stderr
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable] + arguments, cwd=REPO_FOLDER_PATH, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+    )
+    return time.perf_counter() - start, completed.stdout, completed.stderr
+
+
+def get_median_seconds(arguments, repeat_count):
+    return statistics.median(run_python(arguments)[0] for _ in range(repeat_count))
+
+
+def parse_import_times(stderr):
+    # (name, depth, self us, cumulative us) of every -X importtime line
+    import_times = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # one space after the bar at the top level, two more per level below it
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        import_times.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+
+    return import_times
+
+
+def measure_module(module, baseline_seconds, repeat_count, top_count):
+    code = CHILD_CODE.format(module=module, heavy_modules=HEAVY_MODULES)
+    # the first run writes the module's .pyc files, every sample after it is a warm disk cold start
+    _, stdout, _ = run_python(['-c', code])
+    heavy_modules = json.loads(stdout.strip().splitlines()[-1])
+
+    seconds = get_median_seconds(['-c', code], repeat_count)
+
+    _, _, stderr = run_python(['-X', 'importtime', '-c', f'import {module}'])
+
+    # a module's line comes after those of the imports under it, the interpreter's own imports (site) come before them
+    subtree = []
+    for name, depth, _, cumulative_us in parse_import_times(stderr):
+        if depth == 0 and name == module:
+            import_us = cumulative_us
+            break
+
+        subtree.append((name, depth, cumulative_us))
+        if depth == 0:
+            subtree = []
+
+    # so does a package's line after its submodules', the first line of each name is the one to keep
+    packages = {}
+    for name, _, cumulative_us in subtree:
+        if '.' not in name and name not in packages:
+            packages[name] = cumulative_us
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:top_count]
+
+    return {
+        'module': module,
+        'startup_ms': (seconds - baseline_seconds) * 1000,
+        'import_ms': import_us / 1000,
+        'heavy_modules': heavy_modules,
+        'slowest_imports': [(name, cumulative_us / 1000) for name, cumulative_us in slowest],
+    }
+
+
+def print_results(baseline_seconds, results):
+    print(f'Interpreter start without imports: {baseline_seconds * 1000:.0f} ms.')
+    print(f'{"module":24} {"startup ms":>10} {"import ms":>9}  {"heavy modules loaded":36} slowest imports (ms)')
+    for result in results:
+        slowest = ', '.join(f'{name} {ms:.0f}' for name, ms in result['slowest_imports'])
+        print(
+            f'{result["module"]:24} {result["startup_ms"]:10.0f} {result["import_ms"]:9.0f}  '
+            f'{", ".join(result["heavy_modules"]) or "-":36} {slowest}'
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure the cold start of every scraper module.')
+    parser.add_argument('--modules', nargs='+', default=list(MODULES))
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT_COUNT, help='fresh processes per module, the median is reported')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_COUNT, help='slowest top level imports to list')
+    parser.add_argument('--json', help='also write the results to this file')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    baseline_seconds = get_median_seconds(['-c', 'pass'], args.repeat)
+    results = [measure_module(module, baseline_seconds, args.repeat, args.top) for module in args.modules]
+
+    print_results(baseline_seconds, results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'repeat': args.repeat, 'baseline_ms': baseline_seconds * 1000, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+'''
+synthetic pages shaped like the espn.com pages the scrapers parse
+used when no saved pages are available, the content is random but deterministic
+'''
+from datetime import date, timedelta
+import json
+import random
+
+STAT_HEADERS = ['MIN', 'FG', '3PT', 'FT', 'OREB', 'DREB', 'REB', 'AST', 'STL', 'BLK', 'TO', 'PF', '+/-', 'PTS']
+POSITIONS = ['G', 'F', 'C', 'PG', 'SG', 'SF', 'PF']
+TEAMS = [
+    ('Denver Nuggets', 'Nuggets'),
+    ('Boston Celtics', 'Celtics'),
+    ('Miami Heat', 'Heat'),
+    ('Chicago Bulls', 'Bulls'),
+    ('Dallas Mavericks', 'Mavericks'),
+    ('Oklahoma City Thunder', 'Thunder'),
+]
+
+# rest of the page (navigation, scripts, ads) the parser has to get through
+PAGE_FILLER_BLOCK_COUNT = 400
+
+
+def page_filler(rng):
+    blocks = []
+    for i in range(PAGE_FILLER_BLOCK_COUNT):
+        blocks.append(
+            f'<div class="Nav__Item nav-{i}"><a href="/nba/story/_/id/{rng.randint(1, 10 ** 8)}">'
+            f'<span class="Nav__Text">Story {i} &amp; more</span></a>'
+            f'<script>window.__data_{i} = {{"id": {rng.randint(1, 10 ** 6)}}};</script></div>'
+        )
+
+    return '\n'.join(blocks)
+
+
+def shooting(rng):
+    attempts = rng.randint(0, 20)
+    return f'{rng.randint(0, attempts)}-{attempts}'
+
+
+def player_stats_cells(rng):
+    cells = [str(rng.randint(1, 44)), shooting(rng), shooting(rng), shooting(rng)]
+    cells.extend(str(rng.randint(0, 12)) for _ in range(8))
+    cells.append(f'{rng.choice(["+", "-", ""])}{rng.randint(0, 20)}')
+    cells.append(str(rng.randint(0, 40)))
+    return cells
+
+
+def box_score_team_players(rng):
+    # (player id, name, position, starter, stat cells or None for a player who did not play) and the team totals
+    players = []
+    for section, player_count in (('starters', 5), ('bench', rng.randint(5, 8))):
+        for _ in range(player_count):
+            player_id = rng.randint(1000, 5000000)
+            name = f'{chr(rng.randint(65, 90))}. Player{player_id}'
+            position = rng.choice(POSITIONS)
+
+            if section == 'bench' and rng.random() < 0.2:
+                cells = None
+            else:
+                cells = player_stats_cells(rng)
+
+            players.append((player_id, name, position, section == 'starters', cells))
+
+    return players, player_stats_cells(rng)
+
+
+def box_score_team_div(rng, game_id, team_name):
+    players, totals = box_score_team_players(rng)
+
+    name_rows = ['<tr><td>starters</td></tr>']
+    stat_rows = ['<tr>' + ''.join(f'<td>{header}</td>' for header in STAT_HEADERS) + '</tr>']
+
+    for i, (player_id, name, position, starter, cells) in enumerate(players):
+        if not starter and players[i - 1][3]:
+            name_rows.append('<tr><td>bench</td></tr>')
+            stat_rows.append('<tr>' + ''.join(f'<td>{header}</td>' for header in STAT_HEADERS) + '</tr>')
+
+        name_rows.append(
+            f'<tr><td><div><a href="https://www.espn.com/nba/player/_/id/{player_id}/player-{player_id}">'
+            f'<span>{name}</span></a> <span>{position}</span></div></td></tr>'
+        )
+
+        if cells is None:
+            stat_rows.append('<tr><td colspan="14">DNP-COACH\'S DECISION</td></tr>')
+        else:
+            stat_rows.append('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>')
+
+    name_rows.extend(['<tr><td>team</td></tr>', '<tr><td></td></tr>'])
+    stat_rows.append('<tr><td></td>' + ''.join(f'<td>{cell}</td>' for cell in totals[1:]) + '</tr>')
+    stat_rows.append('<tr><td></td>' + ''.join('<td>45.5%</td>' for _ in STAT_HEADERS[1:]) + '</tr>')
+
+    return (
+        '<div class="Boxscore flex flex-column">'
+        f'<div class="Boxscore__Title"><div class="BoxscoreItem__TeamName h5">{team_name}</div></div>'
+        '<div class="flex"><div class="Table__ScrollerWrapper">'
+        f'<table class="Table Table--align-right Table--fixed">{"".join(name_rows)}</table>'
+        f'<table class="Table Table--align-right">{"".join(stat_rows)}</table>'
+        '</div></div></div>'
+    )
+
+
+def box_score_team_summary(rng, team):
+    players, totals = box_score_team_players(rng)
+
+    athletes = []
+    for player_id, name, position, starter, cells in players:
+        athletes.append({
+            'active': False,
+            'athlete': {
+                'id': str(player_id),
+                'displayName': f'Player {player_id}',
+                'shortName': name,
+                'links': [{'rel': ['playercard', 'desktop', 'athlete'], 'href': f'https://www.espn.com/nba/player/_/id/{player_id}/player-{player_id}'}],
+                'position': {'name': position, 'abbreviation': position},
+            },
+            'starter': starter,
+            'didNotPlay': cells is None,
+            'reason': "COACH'S DECISION" if cells is None else '',
+            'ejected': False,
+            'stats': [] if cells is None else cells,
+        })
+
+    return {
+        'team': {'displayName': team[0], 'shortDisplayName': team[1]},
+        'statistics': [{'names': STAT_HEADERS, 'keys': [header.lower() for header in STAT_HEADERS], 'athletes': athletes, 'totals': [''] + totals[1:]}],
+    }
+
+
+def box_score_page(game_id, seed=None):
+    rng = random.Random(game_id if seed is None else seed)
+    away_team, home_team = rng.sample(TEAMS, 2)
+
+    return (
+        '<!DOCTYPE html><html><head><title>Box Score</title></head><body>'
+        f'{page_filler(rng)}'
+        '<div class="Boxscore Boxscore__ResponsiveWrapper">'
+        f'{box_score_team_div(rng, game_id, away_team[0])}'
+        f'{box_score_team_div(rng, game_id, home_team[0])}'
+        '</div>'
+        f'{page_filler(rng)}'
+        '</body></html>'
+    ).encode('utf-8')
+
+
+def box_score_summary_body(game_id, seed=None):
+    # the summary api json of the game box_score_page shows, the page filler is drawn too so both describe the same players
+    rng = random.Random(game_id if seed is None else seed)
+    away_team, home_team = rng.sample(TEAMS, 2)
+    page_filler(rng)
+
+    return json.dumps({
+        'header': {'id': str(game_id)},
+        'boxscore': {'players': [box_score_team_summary(rng, away_team), box_score_team_summary(rng, home_team)]},
+    }).encode('utf-8')
+
+
+def box_score_pages(count, first_game_id=400830080):
+    return {str(game_id): box_score_page(game_id) for game_id in range(first_game_id, first_game_id + count)}
+
+
+def scoreboard_game_section(rng, game_id):
+    away_team, home_team = rng.sample(TEAMS, 2)
+    quarters = [[rng.randint(15, 40) for _ in range(4)] for _ in range(2)]
+
+    teams = ''.join(
+        f'<div class="ScoreCell__TeamName ScoreCell__TeamName--shortDisplayName truncate db">{team[1]}</div>'
+        for team in (home_team, away_team)
+    )
+    # the scraper reads the away team's scores first
+    scores_final = ''.join(
+        f'<div class="ScoreCell__Score h4 clr-gray-01 fw-heavy tar ScoreCell_Score--scoreboard pl2">{sum(team_quarters)}</div>'
+        for team_quarters in quarters
+    )
+    scores_quarter = ''.join(
+        f'<div class="ScoreboardScoreCell__Value flex justify-center pl2 basketball">{score}</div>'
+        for team_quarters in quarters for score in team_quarters
+    )
+    links = ''.join(
+        f'<a class="AnchorLink Button Button--sm Button--anchorLink Button--alt mb4 w-100 mr2" href="/nba/{page}/_/gameId/{game_id}">{page}</a>'
+        for page in ('game', 'boxscore')
+    )
+
+    return f'<section class="Scoreboard bg-clr-white flex flex-auto justify-between">{teams}{scores_final}{scores_quarter}{links}</section>'
+
+
+def scoreboard_page(date_string, games_per_day=(0, 12)):
+    # game ids are unique per date so pages for different dates never share a game
+    rng = random.Random(int(date_string))
+    game_count = rng.randint(*games_per_day)
+    first_game_id = int(date_string) * 100
+
+    return (
+        '<!DOCTYPE html><html><head><title>Scoreboard</title></head><body>'
+        f'{page_filler(rng)}'
+        + ''.join(scoreboard_game_section(rng, first_game_id + i) for i in range(game_count))
+        + '</body></html>'
+    ).encode('utf-8')
+
+
+def scoreboard_calendar_body(date_string, games_per_day=(0, 12)):
+    # site.api.espn.com scoreboard json, its calendar lists the days of the date's season that scoreboard_page has games on
+    year, month = int(date_string[:4]), int(date_string[4:6])
+    season = year + 1 if month >= 10 else year
+
+    calendar = []
+    day = date(season - 1, 10, 1)
+    while day <= date(season, 6, 30):
+        if random.Random(int(day.strftime('%Y%m%d'))).randint(*games_per_day) > 0:
+            calendar.append(day.strftime('%Y-%m-%dT07:00Z'))
+        day += timedelta(days=1)
+
+    return json.dumps({
+        'leagues': [{'abbreviation': 'NBA', 'calendarType': 'day', 'calendarIsWhitelist': True, 'calendar': calendar}],
+        'events': [],
+    }).encode('utf-8')
+
+
+LEAGUE_LEADERS_HEADERS = [
+    'PLAYER_ID', 'RANK', 'PLAYER', 'TEAM_ID', 'TEAM', 'GP', 'MIN', 'FGM', 'FGA', 'FG_PCT', 'FG3M', 'FG3A', 'FG3_PCT',
+    'FTM', 'FTA', 'FT_PCT', 'OREB', 'DREB', 'REB', 'AST', 'STL', 'BLK', 'TOV', 'PTS', 'EFF',
+]
+
+
+def league_leaders_body(season, season_type, stat_category, player_count=250):
+    # stats.nba.com leagueLeaders json, percentage categories only list players with enough attempts
+    rng = random.Random(f'{season}{season_type}')
+    rows = []
+    for player_id in range(1, player_count + 1):
+        row = [player_id, 0, f'Player {player_id}', 1610612700 + rng.randint(1, 30), 'TM', rng.randint(1, 82)]
+        row.extend(round(rng.uniform(0, 40), 1) for _ in LEAGUE_LEADERS_HEADERS[6:])
+        rows.append(row)
+
+    if stat_category.endswith('_PCT'):
+        rows = rows[:player_count // 2]
+
+    column = LEAGUE_LEADERS_HEADERS.index(stat_category)
+    rows.sort(key=lambda row: row[column], reverse=True)
+    for rank, row in enumerate(rows, 1):
+        row[1] = rank
+
+    return json.dumps({
+        'resource': 'leagueleaders',
+        'parameters': {'Season': season, 'SeasonType': season_type, 'StatCategory': stat_category},
+        'resultSet': {'name': 'LeagueLeaders', 'headers': LEAGUE_LEADERS_HEADERS, 'rowSet': rows},
+    }).encode('utf-8')
+
+
+def espn_athletes_body(season, season_type, page, limit, qualified=False, athlete_count=None):
+    # site.web.api.espn.com byathlete json, qualified lists only have the players with enough games
+    rng = random.Random(f'{season}{season_type}')
+    if athlete_count is None:
+        athlete_count = rng.randint(150, 550) if season_type == 2 else rng.randint(80, 220)
+
+    if qualified:
+        athlete_count //= 3
+
+    first = (page - 1) * limit
+    athletes = []
+    for athlete_id in range(first + 1, min(first + limit, athlete_count) + 1):
+        athletes.append({
+            'athlete': {'id': str(athlete_id), 'displayName': f'Athlete {athlete_id}'},
+            'categories': [
+                {'name': 'general', 'totals': [str(rng.randint(1, 82)), f'{rng.uniform(5, 40):.1f}']},
+                {'name': 'offensive', 'totals': [f'{rng.uniform(0, 35):.1f}', f'{rng.uniform(0, 10):.1f}']},
+            ],
+        })
+
+    return json.dumps({
+        'pagination': {'count': athlete_count, 'limit': limit, 'page': page, 'pages': max(1, -(-athlete_count // limit))},
+        'athletes': athletes,
+    }).encode('utf-8')
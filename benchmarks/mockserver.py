@@ -0,0 +1,174 @@
+import gzip
+import hashlib
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks import fixtures
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, Nagle would delay every kept-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status_code, headers, body = self.server.get_response(self.path)
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', headers.pop('Content-Type', 'text/html; charset=utf-8'))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    '''
+    local stand-in for espn.com / stats.nba.com
+    serves a fixed body for every path, run it with start() and stop()
+    latency is added to every response, error_rate and throttle_rate are the
+    shares of requests answered with a 500 or a 429 with a Retry-After header
+    '''
+
+    daemon_threads = True
+
+    RETRY_AFTER_SECS = 1
+
+    def __init__(self, body=b'', host='127.0.0.1', port=0, latency=0, error_rate=0, throttle_rate=0, seed=0):
+        super().__init__((host, port), MockRequestHandler)
+        self.body = body
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.thread = None
+
+        self.random = random.Random(seed)
+        self.lock = Lock()
+        self.status_counts = {}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def get_body(self, path):
+        return self.body
+
+    def get_injected_status(self):
+        with self.lock:
+            draw = self.random.random()
+
+        if draw < self.throttle_rate:
+            return 429
+
+        if draw < self.throttle_rate + self.error_rate:
+            return 500
+
+        return 200
+
+    def get_response(self, path):
+        if self.latency:
+            time.sleep(self.latency)
+
+        status_code = self.get_injected_status()
+        if status_code == 429:
+            response = (429, {'Retry-After': str(self.RETRY_AFTER_SECS)}, b'')
+        elif status_code == 500:
+            response = (500, {}, b'')
+        else:
+            response = (200, {}, self.get_body(path))
+
+        with self.lock:
+            self.status_counts[response[0]] = self.status_counts.get(response[0], 0) + 1
+
+        return response
+
+    def reset_counts(self):
+        with self.lock:
+            status_counts = self.status_counts
+            self.status_counts = {}
+
+        return status_counts
+
+    def start(self):
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+class FixtureServer(MockServer):
+    '''
+    MockServer that answers the paths of all four scrapers
+    pages are read from a response cache folder recorded by a real run with use_cache=True
+    when one is given and has the page, otherwise synthetic pages from benchmarks.fixtures are served
+    '''
+
+    # hosts the scrapers' paths were recorded from
+    RECORDED_HOSTS = (
+        'https://www.espn.com',
+        'https://site.web.api.espn.com',
+        'https://site.api.espn.com',
+        'https://stats.nba.com',
+    )
+    TRAILING_NUMBER_PATTERN = re.compile(r'(\d+)$')
+
+    def __init__(self, recorded_cache_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.recorded_cache_path = recorded_cache_path
+
+    def get_recorded_body(self, path):
+        # same layout as responsecache.ResponseCache
+        for host in self.RECORDED_HOSTS:
+            key = hashlib.sha256(f'{host}{path}'.encode('utf-8')).hexdigest()
+            file_path = os.path.join(self.recorded_cache_path, key[:2], key + '.gz')
+            if os.path.exists(file_path):
+                with gzip.open(file_path, 'rb') as f:
+                    return f.read()
+
+        return None
+
+    def get_body(self, path):
+        if self.recorded_cache_path is not None:
+            body = self.get_recorded_body(path)
+            if body is not None:
+                return body
+
+        parsed_url = urlparse(path)
+        query = {name: values[0] for name, values in parse_qs(parsed_url.query).items()}
+
+        if '/scoreboard/' in parsed_url.path:
+            return fixtures.scoreboard_page(self.TRAILING_NUMBER_PATTERN.findall(parsed_url.path)[0])
+
+        if parsed_url.path.endswith('/nba/scoreboard'):
+            return fixtures.scoreboard_calendar_body(query['dates'])
+
+        if parsed_url.path.endswith('/nba/summary'):
+            return fixtures.box_score_summary_body(int(query['event']))
+
+        if '/boxscore/' in parsed_url.path:
+            return fixtures.box_score_page(int(self.TRAILING_NUMBER_PATTERN.findall(parsed_url.path)[0]))
+
+        if parsed_url.path.endswith('/byathlete'):
+            return fixtures.espn_athletes_body(
+                int(query['season']), int(query['seasontype']), int(query['page']), int(query['limit']), query['isqualified'] == 'true'
+            )
+
+        if parsed_url.path.endswith('/leagueLeaders'):
+            return fixtures.league_leaders_body(query['Season'], query['SeasonType'], query['StatCategory'])
+
+        return b''
@@ -0,0 +1,297 @@
+import csv
+from datetime import datetime
+import os
+import re
+
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.dataset
+except ImportError:
+    # csv files are read with the csv module without it, parquet datasets need it
+    pyarrow = None
+
+class BoxScoreAggregator:
+    '''
+    season totals, per game averages and shooting percentages of players and teams
+    computed from ESPNBoxScoreScraper output (a csv file or a parquet dataset folder)
+    the box scores are loaded once into typed numpy columns and every rollup is a
+    vectorized group by (np.unique + np.bincount) over them
+    '''
+
+    # summed per group, box score column -> output column
+    STAT_COLUMNS = {
+        'min': 'minutes',
+        'pts': 'points',
+        'oreb': 'offensive_rebounds',
+        'dreb': 'defensive_rebounds',
+        'reb': 'rebounds',
+        'ast': 'assists',
+        'stl': 'steals',
+        'blk': 'blocks',
+        'to': 'turnovers',
+        'pf': 'fouls',
+        'field_goal_made': 'field_goals_made',
+        'field_goal_attemps': 'field_goals_attempted',
+        'three_point_made': 'three_pointers_made',
+        'three_point_attemps': 'three_pointers_attempted',
+        'free_throw_made': 'free_throws_made',
+        'free_throw_attemps': 'free_throws_attempted',
+    }
+    SHOOTING_PERCENTAGES = {
+        'field_goal_pct': ('field_goals_made', 'field_goals_attempted'),
+        'three_point_pct': ('three_pointers_made', 'three_pointers_attempted'),
+        'free_throw_pct': ('free_throws_made', 'free_throws_attempted'),
+    }
+    PER_GAME_COLUMNS = ('minutes', 'points', 'rebounds', 'assists', 'steals', 'blocks', 'turnovers')
+
+    PLAYER_ID_PATTERN = re.compile(r'/id/(\d+)')
+    GAME_ID_PATTERN = re.compile(r'(\d+)$')
+
+    # the season is unknown when there is no season column and no game results file
+    UNKNOWN_SEASON = 0
+
+    # NBA totals are games x a per game average rounded to 0.1
+    RECONCILE_TOLERANCE_PER_GAME = 0.05
+
+    def __init__(self, box_score_path, game_results_path=None):
+        self.box_score_path = box_score_path
+
+        if os.path.isdir(box_score_path):
+            columns = self.read_parquet_columns(box_score_path)
+        else:
+            columns = self.read_csv_columns(box_score_path)
+
+        self.row_count = len(columns['game_id'])
+
+        self.stats = {column: self.to_int_array(columns[column]) for column in self.STAT_COLUMNS}
+        self.game_ids = self.to_int_array(columns['game_id']).astype(np.int64)
+        self.team_names = np.asarray(columns['team_name'], dtype=object)
+        self.player_names = np.asarray(columns['player_name'], dtype=object)
+        self.player_page_urls = np.asarray(columns['player_page_url'], dtype=object)
+        self.player_ids = np.array([self.get_player_id(url) for url in self.player_page_urls], dtype=np.int64)
+
+        if 'season' in columns:
+            self.seasons = self.to_int_array(columns['season'])
+        elif game_results_path is not None:
+            game_seasons = self.read_game_seasons(game_results_path)
+            self.seasons = np.array([game_seasons.get(game_id, self.UNKNOWN_SEASON) for game_id in self.game_ids], dtype=np.int64)
+        else:
+            self.seasons = np.full(self.row_count, self.UNKNOWN_SEASON, dtype=np.int64)
+
+        # a player who did not play has a line of zeros
+        self.played = self.stats['min'] > 0
+
+        print(f'Loaded {self.row_count} box score lines of {len(np.unique(self.game_ids))} games.')
+
+    def read_csv_columns(self, file_path):
+        if pyarrow is not None:
+            table = pyarrow.csv.read_csv(file_path)
+            return {name: table.column(name).to_pylist() for name in table.column_names}
+
+        # utf-8-sig, files saved by excel start with a byte order mark
+        with open(file_path, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            values = list(zip(*reader))
+
+        if len(values) == 0:
+            return {name: [] for name in header}
+
+        return dict(zip(header, values))
+
+    def read_parquet_columns(self, folder_path):
+        if pyarrow is None:
+            raise ImportError('Reading parquet box scores requires pyarrow (pip install pyarrow).')
+
+        table = pyarrow.dataset.dataset(folder_path, format='parquet', partitioning='hive').to_table()
+        return {name: table.column(name).to_pylist() for name in table.column_names}
+
+    def to_int_array(self, values):
+        # missing values ('', '--', None) count as 0
+        result = np.zeros(len(values), dtype=np.int64)
+        for i, value in enumerate(values):
+            try:
+                result[i] = int(value)
+            except (TypeError, ValueError):
+                pass
+
+        return result
+
+    def get_player_id(self, url):
+        match = self.PLAYER_ID_PATTERN.search(url or '')
+        if match is None:
+            return 0
+
+        return int(match.group(1))
+
+    def get_season_end_year(self, date_string):
+        dt = datetime.strptime(date_string, '%Y%m%d')
+        if dt.month >= 10:
+            return dt.year + 1
+
+        return dt.year
+
+    def read_game_seasons(self, file_path):
+        # game id -> season end year from an ESPNGameResultScraper csv
+        game_seasons = {}
+        with open(file_path, 'r', newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                match = self.GAME_ID_PATTERN.search(row['box_score_url'])
+                if match is not None:
+                    game_seasons[int(match.group(1))] = self.get_season_end_year(row['date'])
+
+        return game_seasons
+
+    def group_by(self, keys):
+        # keys is a list of equal length arrays, returns the distinct key columns and each row's group
+        key_table = np.rec.fromarrays(keys)
+        groups, inverse = np.unique(key_table, return_inverse=True)
+        return [groups[name] for name in groups.dtype.names], inverse.ravel()
+
+    def aggregate(self, keys, key_names):
+        # returns the group columns and each row's group
+        group_keys, inverse = self.group_by(keys)
+        group_count = len(group_keys[0])
+
+        result = dict(zip(key_names, group_keys))
+        result['games'] = np.bincount(inverse, weights=self.played, minlength=group_count).astype(np.int64)
+
+        for column, output_column in self.STAT_COLUMNS.items():
+            result[output_column] = np.bincount(inverse, weights=self.stats[column], minlength=group_count).astype(np.int64)
+
+        games = np.maximum(result['games'], 1)
+        for column in self.PER_GAME_COLUMNS:
+            result[f'{column}_per_game'] = np.round(result[column] / games, 2)
+
+        for column, (made_column, attempted_column) in self.SHOOTING_PERCENTAGES.items():
+            attempted = result[attempted_column]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[column] = np.where(attempted > 0, np.round(result[made_column] / attempted, 3), np.nan)
+
+        return result, inverse
+
+    def get_player_seasons(self):
+        result, _ = self.aggregate([self.player_ids, self.seasons], ['player_id', 'season'])
+
+        # the name and page of each player's first line
+        _, first_rows = np.unique(self.player_ids, return_index=True)
+        names = dict(zip(self.player_ids[first_rows], self.player_names[first_rows]))
+        urls = dict(zip(self.player_ids[first_rows], self.player_page_urls[first_rows]))
+        player_ids = result.pop('player_id')
+        return {
+            'player_id': player_ids,
+            'player_name': np.array([names[player_id] for player_id in player_ids], dtype=object),
+            'player_page_url': np.array([urls[player_id] for player_id in player_ids], dtype=object),
+            **result,
+        }
+
+    def get_team_seasons(self):
+        team_names, team_codes = np.unique(self.team_names.astype(str), return_inverse=True)
+        team_codes = team_codes.ravel()
+        result, inverse = self.aggregate([team_codes, self.seasons], ['team_code', 'season'])
+
+        # player games summed per team are not team games, count one line of every team and game instead
+        _, game_rows = np.unique(np.rec.fromarrays([team_codes, self.game_ids]), return_index=True)
+        result['games'] = np.bincount(inverse[game_rows], minlength=len(result['season'])).astype(np.int64)
+
+        games = np.maximum(result['games'], 1)
+        for column in self.PER_GAME_COLUMNS:
+            result[f'{column}_per_game'] = np.round(result[column] / games, 2)
+
+        return {'team_name': team_names[result.pop('team_code')], **result}
+
+    def get_slug(self, name):
+        # 'LeBron James' and .../id/1966/lebron-james both become lebron-james
+        return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+    def reconcile(self, player_stats_path, tolerance_per_game=None):
+        '''
+        compares the box score points of every player season with the totals of an
+        ESPNPlayerStatsScraper or NBAPlayerStatsScraper csv, regular season and playoffs
+        are added up because the box scores do not tell them apart
+        espn rows are matched on the espn player id, nba rows on the name in the player page url
+        '''
+        if tolerance_per_game is None:
+            tolerance_per_game = self.RECONCILE_TOLERANCE_PER_GAME
+
+        player_seasons = self.get_player_seasons()
+
+        stats_totals = {}
+        with open(player_stats_path, 'r', newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                # espn files have year, nba files end_year
+                if 'end_year' in row:
+                    key = (self.get_slug(row['name']), int(row['end_year']))
+                else:
+                    key = (int(row['id']), int(row['year']))
+
+                games, points = stats_totals.get(key, (0, 0.0))
+                stats_totals[key] = (games + int(float(row['games_played'])), points + float(row['total_points']))
+
+        is_nba = len(stats_totals) > 0 and isinstance(next(iter(stats_totals))[0], str)
+
+        rows = []
+        for i in range(len(player_seasons['player_id'])):
+            if is_nba:
+                key = (player_seasons['player_page_url'][i].rstrip('/').rsplit('/', 1)[-1], int(player_seasons['season'][i]))
+            else:
+                key = (int(player_seasons['player_id'][i]), int(player_seasons['season'][i]))
+
+            if key not in stats_totals:
+                continue
+
+            stats_games, stats_points = stats_totals[key]
+            box_points = int(player_seasons['points'][i])
+            difference = box_points - stats_points
+            rows.append({
+                'player_id': int(player_seasons['player_id'][i]),
+                'player_name': player_seasons['player_name'][i],
+                'season': int(player_seasons['season'][i]),
+                'box_score_games': int(player_seasons['games'][i]),
+                'stats_games': stats_games,
+                'box_score_points': box_points,
+                'stats_points': round(stats_points, 1),
+                'difference': round(difference, 1),
+                'matches': abs(difference) <= tolerance_per_game * max(stats_games, 1) + 0.5,
+            })
+
+        mismatch_count = sum(not row['matches'] for row in rows)
+        print(f'Reconciled {len(rows)} of {len(player_seasons["player_id"])} player seasons against {player_stats_path}, {mismatch_count} do not match.')
+
+        return rows
+
+    def write_csv(self, result, file_path):
+        # result is a dict of equal length columns (the output of get_player_seasons, get_team_seasons) or a list of dicts
+        if isinstance(result, dict):
+            columns = list(result)
+            rows = zip(*[result[column] for column in columns])
+        else:
+            columns = list(result[0]) if len(result) > 0 else []
+            rows = ([row[column] for column in columns] for row in result)
+
+        with open(file_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(['' if isinstance(value, float) and np.isnan(value) else value for value in row])
+
+        print(f'Wrote {file_path}.')
+
+
+if __name__ == '__main__':
+    data_folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+    box_score_path = os.path.join(data_folder_path, 'box_score_consolidated_data_EXAMPLE.csv')
+    game_results_path = os.path.join(data_folder_path, 'game_results_consolidated_data_EXAMPLE.csv')
+    player_stats_path = os.path.join(data_folder_path, 'player_stats_data_espn_consolidated_data_EXAMPLE.csv')
+
+    aggregator = BoxScoreAggregator(box_score_path, game_results_path)
+    aggregator.write_csv(aggregator.get_player_seasons(), os.path.join(data_folder_path, 'player_season_totals.csv'))
+    aggregator.write_csv(aggregator.get_team_seasons(), os.path.join(data_folder_path, 'team_season_totals.csv'))
+
+    reconciliation = aggregator.reconcile(player_stats_path)
+    if len(reconciliation) > 0:
+        aggregator.write_csv(reconciliation, os.path.join(data_folder_path, 'player_season_reconciliation.csv'))
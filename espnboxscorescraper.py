@@ -1,69 +1,256 @@
 import csv
 from datetime import datetime
+from functools import lru_cache
+import json
 import os
 import re
 
-from bs4 import BeautifulSoup
-
 from basescraper import BaseScraper
+from workqueue import WorkQueue
+
+
+# the parsers are imported by the first page of the extract mode that uses them, the json mode needs neither bs4 nor lxml
+def import_lxml():
+    try:
+        import lxml.html
+    except ImportError:
+        raise ImportError('The lxml extract mode requires lxml (pip install lxml).') from None
+
+    return lxml
+
+
+@lru_cache(maxsize=None)
+def import_orjson():
+    # the json extract mode falls back to the json module without it
+    try:
+        import orjson
+    except ImportError:
+        return None
+
+    return orjson
+
+class LxmlElement:
+    '''
+    wraps an lxml element in the small part of the BeautifulSoup tag api that
+    extract_data_from_box_score_divs uses, so both parsers share the extraction code
+    '''
+
+    __slots__ = ('element',)
+
+    def __init__(self, element):
+        self.element = element
+
+    def find(self, name, attrs=None):
+        elements = self.find_all(name, attrs)
+        if len(elements) == 0:
+            return None
+
+        return elements[0]
+
+    def find_all(self, name, attrs=None):
+        if attrs is None:
+            return [LxmlElement(element) for element in self.element.iterdescendants(name)]
+
+        return [
+            LxmlElement(element) for element in self.element.iterdescendants(name)
+            if all(element.get(key) == value for key, value in attrs.items())
+        ]
+
+    @property
+    def text(self):
+        return self.element.text_content()
+
+    @property
+    def attrs(self):
+        return dict(self.element.attrib)
+
+class BoxScoreLine:
+    '''
+    one player's line of a box score, the numbers are converted once when the page is parsed
+    iterating gives the values in COLUMNS order, so a header row followed by lines is a block the sinks can write
+    '''
+
+    STAT_COLUMNS = ('min', 'fg', '3pt', 'ft', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk', 'to', 'pf', '+/-', 'pts')
+    # made-attempted strings, split into two numbers each
+    SHOOTING_COLUMNS = ('fg', '3pt', 'ft')
+
+    COLUMNS = STAT_COLUMNS + (
+        'field_goal_made',
+        'field_goal_attemps',
+        'three_point_made',
+        'three_point_attemps',
+        'free_throw_made',
+        'free_throw_attemps',
+        'player_name',
+        'position',
+        'player_page_url',
+        'team_name',
+        'game_id',
+    )
+
+    # COLUMNS as attribute names
+    __slots__ = (
+        'min', 'fg', 'three_pt', 'ft', 'oreb', 'dreb', 'reb', 'ast', 'stl', 'blk', 'to', 'pf', 'plus_minus', 'pts',
+        'field_goal_made', 'field_goal_attemps', 'three_point_made', 'three_point_attemps', 'free_throw_made', 'free_throw_attemps',
+        'player_name', 'position', 'player_page_url', 'team_name', 'game_id',
+    )
+
+    def __init__(self, *values):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+    @staticmethod
+    def parse_int(value):
+        # '--' and other placeholders become None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def split_shooting(cls, value):
+        try:
+            made, attempts = value.split('-')
+        except (AttributeError, ValueError):
+            return 0, 0
+
+        return cls.parse_int(made), cls.parse_int(attempts)
+
+    @classmethod
+    def from_stats(cls, stats, player_name, position, player_page_url, team_name, game_id):
+        # stats maps the lowercased stat headers to the cell text, an empty dict is a player who did not play
+        if len(stats) == 0:
+            stat_values = [0 if column not in cls.SHOOTING_COLUMNS else '0' for column in cls.STAT_COLUMNS]
+        else:
+            stat_values = [
+                stats.get(column) if column in cls.SHOOTING_COLUMNS else cls.parse_int(stats.get(column))
+                for column in cls.STAT_COLUMNS
+            ]
+
+        shooting_values = []
+        for column in cls.SHOOTING_COLUMNS:
+            shooting_values.extend(cls.split_shooting(stats.get(column)))
+
+        return cls(*stat_values, *shooting_values, player_name, position, player_page_url, team_name, int(game_id))
+
+    def __iter__(self):
+        return (getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, BoxScoreLine) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f'BoxScoreLine({", ".join(repr(value) for value in self)})'
+
+    def __getstate__(self):
+        return tuple(self)
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
 
 class ESPNBoxScoreScraper(BaseScraper):
-    GAME_ID_PATTERN = re.compile(r'.*/(\d{1,15})$')    
+    # box score pages end in /gameId/[id], summary api urls in event=[id]
+    GAME_ID_PATTERN = re.compile(r'.*[/=](\d{1,15})$')
     PLAYER_NAME_PATTERN = re.compile(r'(.*) (\w+)')
+
+    FILE_PREFIX = 'box_score'
+
+    OUTPUT_SCHEMA = [
+        ('min', 'int32'),
+        ('fg', 'string'),
+        ('3pt', 'string'),
+        ('ft', 'string'),
+        ('oreb', 'int32'),
+        ('dreb', 'int32'),
+        ('reb', 'int32'),
+        ('ast', 'int32'),
+        ('stl', 'int32'),
+        ('blk', 'int32'),
+        ('to', 'int32'),
+        ('pf', 'int32'),
+        ('+/-', 'int32'),
+        ('pts', 'int32'),
+        ('field_goal_made', 'int32'),
+        ('field_goal_attemps', 'int32'),
+        ('three_point_made', 'int32'),
+        ('three_point_attemps', 'int32'),
+        ('free_throw_made', 'int32'),
+        ('free_throw_attemps', 'int32'),
+        ('player_name', 'string'),
+        ('position', 'string'),
+        ('player_page_url', 'string'),
+        ('team_name', 'string'),
+        ('game_id', 'int64'),
+    ]
+    PARTITION_COLUMN = 'season'
+    PRIMARY_KEY = ('game_id', 'player_page_url')
+    INDEX_COLUMNS = ('player_page_url', 'team_name', 'season')
+
+    BOX_SCORE_DIV_ATTRS = {'class': 'Boxscore flex flex-column'}
+    # the data the box score page is rendered from, a fraction of the page's size
+    SUMMARY_URL = 'https://site.api.espn.com/apis/site/v2/sports/basketball/nba/summary?event={}'
+    PLAYER_PAGE_URL = 'https://www.espn.com/nba/player/_/id/{}'
+
+    # full: html.parser over the whole page
+    # strained: html.parser, only the box score divs are built
+    # lxml: lxml over the whole page, no BeautifulSoup tree at all
+    # json: the game's summary api json instead of the page
+    EXTRACT_MODES = ('full', 'strained', 'lxml', 'json')
     
-    def __init__(self, url_file_path, max_threads=None, page_limit=None, page_start=None):
-        super().__init__(max_threads=max_threads)
+    def __init__(self, url_file_path=None, max_threads=None, page_limit=None, page_start=None, extract_mode='full', **kwargs):
+        super().__init__(max_threads=max_threads, **kwargs)
         self.url_file_path = url_file_path        
         self.urls = []
+        # game dates from the game results file, used to tell finished games apart
+        self.url_dates = {}
+        self.game_dates = {}
         self.page_limit = page_limit
 
+        if extract_mode not in self.EXTRACT_MODES:
+            raise ValueError(f'Unknown extract mode {extract_mode}, expected one of {self.EXTRACT_MODES}.')
+
+        if extract_mode == 'lxml':
+            import_lxml()
+
+        self.extract_mode = extract_mode
+
         if page_start is None:
             self.page_start = 0
         else:
             self.page_start = page_start
 
-    def write_data_to_file(self, data, file_path=None):
+    def write_data_to_file(self, data, file_path=None, append=False):
         if file_path is None:
-            file_name_postfix = self.get_timestamp()
-            file_name = f'box_score_data_{file_name_postfix}.csv'
-            file_path = os.path.join(self.data_folder_path, file_name)        
-
-        with open(file_path, 'w', newline='') as f:
-            writer = csv.writer(f)
+            file_path = self.get_output_file_path()
 
-            for i, block in enumerate(data):
-                for j, row in enumerate(block):
-                    if (j == 0) and (i != 0):
-                        # skip headers except on first occurrence
-                        continue
-                    
-                    writer.writerow(row)
+        # headers are skipped except on first occurrence in the file
+        with self.open_sink(file_path, append=append) as sink:
+            for block in data:
+                sink.write_block(block)
 
     def consolidate_thread_data(self):
-        file_names = os.listdir(self.thread_data_folder_path)
+        # sqlite rows are already in the store
+        if self.output_format == 'sqlite':
+            return
+
+        file_extension = self.get_file_extension()
+        # other scrapers can be writing their own thread files to the same folder
+        file_names = [
+            file_name for file_name in os.listdir(self.thread_data_folder_path)
+            if file_name.startswith('thread_') and file_name.endswith(file_extension)
+        ]
 
         if file_names == []:
             print(f'No thread files found.')
             return
-        
-        data = []        
-        for i, file_name in enumerate(file_names):
-            file_path = os.path.join(self.thread_data_folder_path, file_name)
-            
-            with open(file_path, 'r', newline='') as f:
-                reader = csv.reader(f)
 
-                for j, row in enumerate(reader):
-                    if (j == 0):
-                        if not (i == 0):
-                            continue
-                    
-                    data.append(row)
+        file_paths = [os.path.join(self.thread_data_folder_path, file_name) for file_name in file_names]
+        self.concatenate_outputs(file_paths, self.get_output_file_path())
 
-            # delete temp file
-            os.remove(file_path)
-
-        self.write_data_to_file([data])
+        # delete temp files
+        for file_path in file_paths:
+            self.remove_output(file_path)
 
     def set_urls(self):
         initial_url_count = len(self.urls)
@@ -101,52 +288,53 @@ class ESPNBoxScoreScraper(BaseScraper):
             for i, row in enumerate(reader):
                 if i != 0:
                     # skip header row
-                    urls.append(row[-1])
+                    url = self.get_source_url(row[-1])
+                    urls.append(url)
+                    self.add_url_date(url, row[0])
             
             self.urls = urls
 
         self.set_urls()    
 
-    def augment_stats_table_row(self, stats_table_row, headers=False):
-        if headers:
-            fgm = 'field_goal_made'
-            fga = 'field_goal_attemps'
-            tpm = 'three_point_made'
-            tpa = 'three_point_attemps'
-            ftm = 'free_throw_made'
-            fta = 'free_throw_attemps'
-        else:
-            try:
-                fgm, fga = stats_table_row[1].split('-')
-                tpm, tpa = stats_table_row[2].split('-')
-                ftm, fta = stats_table_row[3].split('-')
-            except (AttributeError, ValueError):
-                fgm = 0
-                fga = 0
-                tpm = 0
-                tpa = 0
-                ftm = 0
-                fta = 0
-
-        stats_table_row.extend([fgm, fga, tpm, tpa, ftm, fta])
-        return stats_table_row
+    def get_source_url(self, box_score_url):
+        # the url the box score of a game is read from in the current extract mode
+        if self.extract_mode == 'json' and re.match(self.GAME_ID_PATTERN, box_score_url):
+            return self.SUMMARY_URL.format(self.extract_game_id(box_score_url))
+
+        return box_score_url
+
+    def add_url_date(self, url, date_string):
+        self.url_dates[url] = date_string
+
+        if re.match(self.GAME_ID_PATTERN, url):
+            self.game_dates[self.extract_game_id(url)] = date_string
+
+    def is_immutable_url(self, url, fetched_at):
+        date_string = self.url_dates.get(url)
+        if date_string is None:
+            return False
+
+        return self.is_final_date(datetime.strptime(date_string, '%Y%m%d'), datetime.fromtimestamp(fetched_at))
+
+    def get_partition_value(self, row):
+        date_string = self.game_dates.get(str(row['game_id']))
+        if date_string is None:
+            return None
+
+        return self.get_season_end_year(datetime.strptime(date_string, '%Y%m%d'))
 
     def extract_data_from_box_score_divs(self, box_score_divs, game_id):
-        names = []
-        positions = []
-        player_page_urls = []
-        team_names = []
-        game_ids = []
-        stats_table_rows = []
+        lines = []
 
         exclude_rows = ['starters', 'bench', 'team', '']
 
-        for i, box_score_div in enumerate(box_score_divs):
+        for box_score_div in box_score_divs:
             team_name = box_score_div.find('div', attrs={'class': 'BoxscoreItem__TeamName h5'}).text.strip()
 
             # player names            
             team_player_names_table, stats_table = box_score_div.find_all('table')
 
+            players = []
             for tr in team_player_names_table.find_all('tr'):
                 name_data = tr.text.strip()
                 if name_data not in exclude_rows:
@@ -156,58 +344,99 @@ class ESPNBoxScoreScraper(BaseScraper):
                         print('err', name_data)
                         raise IndexError
 
-                    player_page_url = tr.find('a').attrs['href']
-                    
-                    names.append(name)
-                    positions.append(position)
-                    player_page_urls.append(player_page_url)
-                    team_names.append(team_name)
-                    game_ids.append(game_id)
+                    players.append((name, position, tr.find('a').attrs['href']))
 
-            # stats            
-            for j, tr in enumerate(stats_table.find_all('tr')):
+            # stats, the rows are in the same order as the names
+            stat_columns = None
+            player_index = 0
+            for tr in stats_table.find_all('tr'):
                 stats_table_row = [cell.text.strip().lower() for cell in tr.find_all('td')]
                 first_col = stats_table_row[0]
 
-                if j == 0:
-                    if i == 0:
-                        column_count = len(stats_table_row)
-                    else:
-                        continue
+                if stat_columns is None:
+                    stat_columns = stats_table_row
+                    continue
                 elif first_col == 'min':
+                    # header of the bench rows
                     continue
-                elif first_col[:3] == 'dnp':
-                    stats_table_row = [0] * column_count
                 elif first_col == '':
+                    # team totals
                     break
 
-                if j == 0:
-                    if i == 0:
-                        stats_table_row = self.augment_stats_table_row(stats_table_row, headers=True)
-                    else:
-                        continue
+                name, position, player_page_url = players[player_index]
+                player_index += 1
+
+                if first_col[:3] == 'dnp':
+                    stats = {}
                 else:
-                    stats_table_row = self.augment_stats_table_row(stats_table_row, headers=False)
-                
-                stats_table_rows.append(stats_table_row)
+                    stats = dict(zip(stat_columns, stats_table_row))
 
+                lines.append(BoxScoreLine.from_stats(stats, name, position, player_page_url, team_name, game_id))
 
-        player_info = list(zip(names, positions, player_page_urls, team_names, game_ids))
+        return [list(BoxScoreLine.COLUMNS)] + lines
 
-        headers = stats_table_rows[0]
-        headers.extend(['player_name', 'position', 'player_page_url', 'team_name', 'game_id'])
-        
-        final_data = [headers]        
-        for i, row in enumerate(stats_table_rows[1:]):
-            row.extend(player_info[i])
-            final_data.append(row)
+    def get_player_page_url(self, athlete):
+        for link in athlete.get('links', []):
+            if 'playercard' in link.get('rel', []):
+                return link['href']
+
+        return self.PLAYER_PAGE_URL.format(athlete['id'])
+
+    def extract_data_from_summary(self, summary, game_id):
+        # same lines as extract_data_from_box_score_divs, from the summary api's boxscore.players
+        lines = []
+
+        for team_players in summary['boxscore'].get('players', []):
+            team_name = team_players['team']['displayName']
+
+            for statistics in team_players['statistics']:
+                # names in current payloads, labels in older ones
+                stat_columns = [column.lower() for column in statistics.get('names') or statistics.get('labels', [])]
+
+                for athlete_stats in statistics['athletes']:
+                    athlete = athlete_stats['athlete']
+
+                    if athlete_stats.get('didNotPlay') or len(athlete_stats.get('stats', [])) == 0:
+                        stats = {}
+                    else:
+                        stats = dict(zip(stat_columns, athlete_stats['stats']))
+
+                    name = athlete.get('shortName') or athlete['displayName']
+                    position = athlete.get('position', {}).get('abbreviation', '')
+                    lines.append(BoxScoreLine.from_stats(stats, name, position, self.get_player_page_url(athlete), team_name, game_id))
+
+        return [list(BoxScoreLine.COLUMNS)] + lines
+
+    def load_json(self, content):
+        orjson = import_orjson()
+        if orjson is not None:
+            return orjson.loads(content)
 
-        return final_data
+        return json.loads(content)
+
+    def find_box_score_divs(self, reponse_content):
+        if self.extract_mode == 'lxml':
+            lxml = import_lxml()
+            # espn pages are utf-8, do not let lxml guess
+            parser = lxml.html.HTMLParser(encoding='utf-8')
+            root = LxmlElement(lxml.html.document_fromstring(reponse_content, parser=parser))
+            return root.find_all('div', attrs=self.BOX_SCORE_DIV_ATTRS)
+
+        from bs4 import BeautifulSoup, SoupStrainer
+
+        if self.extract_mode == 'strained':
+            strainer = SoupStrainer('div', attrs=self.BOX_SCORE_DIV_ATTRS)
+            soup = BeautifulSoup(reponse_content, 'html.parser', parse_only=strainer)
+        else:
+            soup = BeautifulSoup(reponse_content, 'html.parser')
+
+        return soup.find_all('div', attrs=self.BOX_SCORE_DIV_ATTRS)
 
     def extract_reponse_data(self, reponse_content, game_id):
-        soup = BeautifulSoup(reponse_content, 'html.parser')
+        if self.extract_mode == 'json':
+            return self.extract_data_from_summary(self.load_json(reponse_content), game_id)
 
-        box_score_divs = soup.find_all('div', attrs={'class':'Boxscore flex flex-column'})
+        box_score_divs = self.find_box_score_divs(reponse_content)
         data = self.extract_data_from_box_score_divs(box_score_divs, game_id)
 
         return data
@@ -216,35 +445,81 @@ class ESPNBoxScoreScraper(BaseScraper):
         game_id = re.findall(self.GAME_ID_PATTERN, url)[0]
         return game_id
 
-    def scrape_multi_thread_worker(self, urls, thread_id):
-        url_count = len(urls)
-        print(f'Thread {thread_id:05} getting {url_count} url(s).')
-
-        data = []
-        for i, url in enumerate(urls):
-            if (i + 1) % self.DEFAULT_PRINT_COUNT == 0:
-                print(f'Thread {thread_id:05} getting url {i + 1} of {url_count}.')
+    def get_shard_key(self, url):
+        return self.extract_game_id(url)
 
-            response = self.attempt_get(url)
-            if response is None:
-                continue
+    def get_urls(self):
+        self.read_data_file()
+        return self.urls
+
+    def parse_response(self, url, content):
+        game_id = self.extract_game_id(url)
+        return self.extract_reponse_data(content, game_id)
+
+    def get_thread_file_path(self, thread_id):
+        return os.path.join(self.thread_data_folder_path, f'thread_{thread_id:05}{self.get_file_extension()}')
+
+    def get_output_file_path(self):
+        file_name = f'box_score_data_{self.get_timestamp()}{self.get_file_extension()}'
+        return os.path.join(self.data_folder_path, file_name)
+
+    def consolidate_results(self):
+        self.consolidate_thread_data()
+
+    def scrape_from_game_results(self, game_result_scraper):
+        '''
+        scrapes the games of game_result_scraper's date range without the game results file,
+        box score urls are queued as each scoreboard page is parsed so both stages run at once
+        game results are still written and consolidated as in game_result_scraper.scrape()
+        '''
+        game_result_urls = game_result_scraper.get_urls()
+        if len(game_result_urls) == 0:
+            print('No dates found.')
+            return
 
-            game_id = self.extract_game_id(url)
-            data.append(self.extract_reponse_data(response.content, game_id))
+        box_score_queue = WorkQueue([], closed=False)
+        queued_urls = set()
 
-        file_name = f'thread_{thread_id:05}.csv'
-        file_path = os.path.join(self.thread_data_folder_path, file_name)
-        
-        self.write_data_to_file(data, file_path)
-        
-        print(f'Thread {thread_id:05} complete.')
+        def queue_box_scores(url, block):
+            for row in block:
+                box_score_url = self.get_source_url(row['box_score_url'])
+                if box_score_url in queued_urls:
+                    continue
 
-    def scrape(self):
-        self.read_data_file()
-        
-        if self.urls != []:
-            self.start_threads(self.scrape_multi_thread_worker, self.urls)
-            self.consolidate_thread_data()
+                queued_urls.add(box_score_url)
+                self.add_url_date(box_score_url, row['date'])
+                box_score_queue.add(box_score_url)
+                self.metrics.add_urls(1)
+
+        game_result_queue = WorkQueue(game_result_urls)
+        game_result_scraper.block_callback = queue_box_scores
+        game_result_scraper.start_metrics(len(game_result_urls))
+        # the box score total grows as scoreboard pages are parsed
+        self.start_metrics(0)
+
+        print(f'Starting {game_result_scraper.max_threads} game result threads and {self.max_threads} box score threads. Dates: {len(game_result_urls)}.')
+        box_score_threads = self.start_queue_threads(self.scrape_multi_thread_worker, box_score_queue, self.max_threads)
+        game_result_threads = game_result_scraper.start_queue_threads(
+            game_result_scraper.scrape_multi_thread_worker, game_result_queue, min(len(game_result_urls), game_result_scraper.max_threads)
+        )
+
+        try:
+            for thread in game_result_threads:
+                thread.join()
+        finally:
+            # box score threads finish the queue and stop
+            box_score_queue.close()
+            game_result_scraper.block_callback = None
+
+        game_result_scraper.consolidate_results()
+        game_result_scraper.finish_metrics()
+
+        for thread in box_score_threads:
+            thread.join()
+
+        box_score_queue.print_timing_summary()
+        self.consolidate_results()
+        self.finish_metrics()
 
 if __name__ == '__main__':
     data_folder_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
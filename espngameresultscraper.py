@@ -1,15 +1,50 @@
+import csv
 from datetime import datetime, timedelta
+import glob
+import json
+import os
 import re
 
-from bs4 import BeautifulSoup
 
 from basescraper import BaseScraper
+from sinks import atomic_write
 
 class ESPNGameResultScraper(BaseScraper):
     BASE_URL = 'https://www.espn.com{}'
     BASE_URL_RESULTS = 'https://www.espn.com/nba/scoreboard/_/date/{}'
+    # the scoreboard api has the games of a date and lists every game day of the date's season
+    SCOREBOARD_API_URL = 'https://site.api.espn.com/apis/site/v2/sports/basketball/nba/scoreboard?dates={}'
 
     URL_DATE_PATTERN = re.compile(r'\d+')
+
+    FILE_PREFIX = 'game_results'
+
+    OUTPUT_SCHEMA = [
+        ('date', 'date32'),
+        ('home_team', 'string'),
+        ('away_team', 'string'),
+        ('home_team_score_final', 'int32'),
+        ('home_team_score_q1', 'int32'),
+        ('home_team_score_q2', 'int32'),
+        ('home_team_score_q3', 'int32'),
+        ('home_team_score_q4', 'int32'),
+        ('away_team_score_final', 'int32'),
+        ('away_team_score_q1', 'int32'),
+        ('away_team_score_q2', 'int32'),
+        ('away_team_score_q3', 'int32'),
+        ('away_team_score_q4', 'int32'),
+        ('date_results_url', 'string'),
+        ('box_score_url', 'string'),
+    ]
+    PARTITION_COLUMN = 'season'
+    # the primary key also serves lookups by date
+    PRIMARY_KEY = ('date', 'home_team', 'away_team')
+    INDEX_COLUMNS = ('home_team', 'away_team', 'season')
+
+    # a game is the same game if these match
+    GAME_KEY_COLUMNS = ('date', 'home_team', 'away_team')
+    # sync updates the csv sync file or upserts into the sqlite store
+    SYNC_FORMATS = ('csv', 'sqlite')
     
     # no games in july, august and september
     MONTHS = [
@@ -24,11 +59,27 @@ class ESPNGameResultScraper(BaseScraper):
         6,
     ]
     
-    def __init__(self, start_date, end_date, max_threads=None):
-        super().__init__(max_threads=max_threads)
+    def __init__(self, start_date, end_date, max_threads=None, sync_file_path=None, use_calendar=True, calendar_file_path=None, **kwargs):
+        super().__init__(max_threads=max_threads, **kwargs)
         self.start_date = start_date
         self.end_date = end_date
 
+        if sync_file_path is None:
+            self.sync_file_path = os.path.join(self.data_folder_path, 'consolidated_data', f'{self.FILE_PREFIX}_sync.csv')
+        else:
+            self.sync_file_path = sync_file_path
+
+        # only request the days of each season that have games
+        self.use_calendar = use_calendar
+        if calendar_file_path is None:
+            self.calendar_file_path = os.path.join(self.data_folder_path, 'season_calendar.json')
+        else:
+            self.calendar_file_path = calendar_file_path
+
+        # season end year -> set of game day date strings, None where no calendar could be found
+        self.season_calendars = {}
+        self.prior_run_dates = None
+
     def get_url_from_datetime(self, dt):
         date_string = dt.strftime('%Y%m%d')
         url = self.BASE_URL_RESULTS.format(date_string)
@@ -36,7 +87,17 @@ class ESPNGameResultScraper(BaseScraper):
         return url
     
     def get_date_string_from_url(self, url):
-        return re.findall(self.URL_DATE_PATTERN, url)[0]
+        return re.findall(self.URL_DATE_PATTERN, url)[-1]
+
+    def get_shard_key(self, url):
+        return self.get_date_string_from_url(url)
+
+    def is_immutable_url(self, url, fetched_at):
+        date = datetime.strptime(self.get_date_string_from_url(url), '%Y%m%d')
+        return self.is_final_date(date, datetime.fromtimestamp(fetched_at))
+
+    def get_partition_value(self, row):
+        return self.get_season_end_year(datetime.strptime(row['date'], '%Y%m%d'))
 
     def parse_results(self, soup, url):
         date_string = self.get_date_string_from_url(url)
@@ -83,64 +144,271 @@ class ESPNGameResultScraper(BaseScraper):
 
         return data
 
-    def scrape_multi_thread_worker(self, urls, thread_id):
-        url_count = len(urls)
-        print(f'Thread {thread_id:05} getting {url_count} urls.')
+    def read_calendar_file(self):
+        if not os.path.exists(self.calendar_file_path):
+            return {}
+
+        with open(self.calendar_file_path, 'r', encoding='utf-8') as f:
+            return {int(season): set(dates) for season, dates in json.load(f).items()}
+
+    def write_calendar_file(self, calendars):
+        with atomic_write(self.calendar_file_path, encoding='utf-8') as f:
+            json.dump({str(season): sorted(dates) for season, dates in sorted(calendars.items())}, f)
+
+    def fetch_season_calendar(self, season):
+        # a january date is in the season on every schedule, lockout seasons included
+        url = self.SCOREBOARD_API_URL.format(f'{season}0115')
+        response = self.attempt_get(url)
+        if response is None:
+            return None
+
+        try:
+            league = json.loads(response.content)['leagues'][0]
+            # the calendar can also be a list of days without games
+            if not league.get('calendarIsWhitelist', True):
+                return None
+
+            # entries look like 2023-01-15T08:00Z, the date part is the us date of the games
+            return set(entry[:10].replace('-', '') for entry in league['calendar'] if isinstance(entry, str))
+        except (ValueError, KeyError, IndexError, TypeError):
+            print(f'Unable to read the {season} season calendar from {url}.')
+            return None
+
+    def read_prior_run_dates(self):
+        # season end year -> dates with games in the sync file and consolidated csv files
+        prior_run_dates = {}
+        file_paths = glob.glob(os.path.join(self.data_folder_path, 'consolidated_data', f'{self.FILE_PREFIX}_consolidated_data_*.csv'))
+        if os.path.exists(self.sync_file_path):
+            file_paths.append(self.sync_file_path)
+
+        for file_path in file_paths:
+            with open(file_path, 'r', newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    season = self.get_season_end_year(datetime.strptime(row['date'], '%Y%m%d'))
+                    prior_run_dates.setdefault(season, set()).add(row['date'])
+
+        return prior_run_dates
+
+    def get_season_calendar(self, season):
+        # game days of a season from the calendar file, the scoreboard api or an earlier run, None when unknown
+        if season in self.season_calendars:
+            return self.season_calendars[season]
+
+        calendars = self.read_calendar_file()
+        calendar = calendars.get(season)
 
+        if calendar is None:
+            calendar = self.fetch_season_calendar(season)
+            # schedules of seasons still being played can change, only finished seasons are kept
+            if calendar and season < self.get_current_season_end_year():
+                calendars[season] = calendar
+                self.write_calendar_file(calendars)
+
+        if not calendar and season < self.get_current_season_end_year():
+            if self.prior_run_dates is None:
+                self.prior_run_dates = self.read_prior_run_dates()
+
+            prior_run_dates = self.prior_run_dates.get(season)
+            if prior_run_dates is not None:
+                print(f'Using the game days of an earlier run for the {season} season.')
+                # the earlier run may have covered part of the season, days outside its range are still requested
+                first_date, last_date = datetime.strptime(min(prior_run_dates), '%Y%m%d'), datetime.strptime(max(prior_run_dates), '%Y%m%d')
+                season_start, season_end = datetime(season - 1, 10, 1), datetime(season, 6, 30)
+                calendar = set(prior_run_dates)
+                for i in range((season_end - season_start).days + 1):
+                    current_date = season_start + timedelta(days=i)
+                    if current_date < first_date or current_date > last_date:
+                        calendar.add(current_date.strftime('%Y%m%d'))
+
+        self.season_calendars[season] = calendar or None
+        return self.season_calendars[season]
+
+    def extract_data_from_scoreboard_events(self, events, date_string):
+        # rows like parse_results' from the scoreboard api's events
         data = []
-        for i, url in enumerate(urls):
-            if (i + 1) % self.DEFAULT_PRINT_COUNT == 0:
-                print(f'Thread {thread_id:05} getting url {i + 1} of {url_count}.')
-            
-            response = self.attempt_get(url)
-            if response is None:
-                continue
+        for event in events:
+            competitors = {competitor['homeAway']: competitor for competitor in event['competitions'][0]['competitors']}
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-            results = self.parse_results(soup, url)
+            row = {
+                'date': date_string,
+                'home_team': competitors['home']['team']['shortDisplayName'],
+                'away_team': competitors['away']['team']['shortDisplayName'],
+            }
+            for home_away in ('home', 'away'):
+                competitor = competitors[home_away]
+                row[f'{home_away}_team_score_final'] = competitor.get('score', '')
 
-            data.extend(results)
+                # quarters not played yet are empty, overtimes are only in the final score
+                quarter_scores = [str(int(line_score['value'])) for line_score in competitor.get('linescores', [])]
+                for quarter in range(1, 5):
+                    row[f'{home_away}_team_score_q{quarter}'] = quarter_scores[quarter - 1] if quarter <= len(quarter_scores) else ''
+
+            row['date_results_url'] = self.get_url_from_datetime(datetime.strptime(date_string, '%Y%m%d'))
+            row['box_score_url'] = self.BASE_URL.format(f'/nba/boxscore/_/gameId/{event["id"]}')
 
-        self.save_data(data, file_prefix='game_results', thread_data=True, thread_id=thread_id)
+            data.append({column: row[column] for column, _ in self.OUTPUT_SCHEMA})
 
-    def scrape(self):
-        urls = []
-        total_days = (self.end_date - self.start_date).days + 1
+        return data
+
+    def get_dates(self, start_date, end_date):
+        dates = []
+        total_days = (end_date - start_date).days + 1
         for i in range(total_days):
-            current_date = self.start_date + timedelta(days=i)
-            if current_date.month in self.MONTHS:
-                urls.append(self.get_url_from_datetime(current_date))
-        
-        self.start_threads(self.scrape_multi_thread_worker, urls)
-        self.consolidate_files(file_name_prefix='game_results', thread_data=True)
+            current_date = start_date + timedelta(days=i)
+            if current_date.month not in self.MONTHS:
+                continue
+
+            if self.use_calendar:
+                calendar = self.get_season_calendar(self.get_season_end_year(current_date))
+                if calendar is not None and current_date.strftime('%Y%m%d') not in calendar:
+                    continue
+
+            dates.append(current_date)
+
+        if self.use_calendar:
+            print(f'Planned {len(dates)} game day(s) of {total_days} day(s) from {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}.')
+
+        return dates
+
+    def get_urls(self):
+        return [self.get_url_from_datetime(current_date) for current_date in self.get_dates(self.start_date, self.end_date)]
+
+    def get_game_key(self, row):
+        return tuple(row[column] for column in self.GAME_KEY_COLUMNS)
+
+    def is_final_row(self, row):
+        return row['home_team_score_final'] != '' and row['away_team_score_final'] != ''
+
+    def read_sync_rows(self):
+        # the sync file, or the newest full scrape the first time sync runs
+        file_path = self.sync_file_path
+        if not os.path.exists(file_path):
+            consolidated_file_paths = glob.glob(os.path.join(self.data_folder_path, 'consolidated_data', f'{self.FILE_PREFIX}_consolidated_data_*.csv'))
+            if len(consolidated_file_paths) == 0:
+                return []
+
+            file_path = max(consolidated_file_paths)
+            print(f'No sync file yet, starting from {file_path}.')
+
+        with open(file_path, 'r', newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def read_store_sync_rows(self):
+        # the latest date in the store and the stored rows that may still change, as csv strings
+        high_water_mark = self.read_store_max('date')
+        if high_water_mark is None:
+            return None, []
+
+        cutoff_date = (datetime.now() - timedelta(days=self.DEFAULT_FINAL_AFTER_DAYS)).date()
+        rows = self.read_store_rows(
+            'date >= ? OR home_team_score_final IS NULL OR away_team_score_final IS NULL', (cutoff_date.isoformat(),)
+        )
+
+        rows = [{column: '' if value is None else str(value) for column, value in row.items()} for row in rows]
+        for row in rows:
+            row['date'] = row['date'].replace('-', '')
+
+        return high_water_mark.replace('-', ''), rows
+
+    def get_sync_dates(self, high_water_mark, rows):
+        end_date = min(self.end_date, datetime.now())
+
+        if high_water_mark is None:
+            return self.get_dates(self.start_date, end_date)
+
+        high_water_mark = datetime.strptime(high_water_mark, '%Y%m%d')
+        print(f'Latest synced game is on {high_water_mark:%Y-%m-%d}.')
+
+        # dates after the high water mark plus known dates that may still change
+        dates = set(self.get_dates(max(self.start_date, high_water_mark + timedelta(days=1)), end_date))
+        for row in rows:
+            row_date = datetime.strptime(row['date'], '%Y%m%d')
+            if not self.is_final_date(row_date) or not self.is_final_row(row):
+                dates.add(row_date)
+
+        return sorted(dates)
+
+    def write_sync_rows(self, rows):
+        rows = sorted(rows, key=self.get_game_key)
+
+        with atomic_write(self.sync_file_path, newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def sync(self):
+        if self.output_format not in self.SYNC_FORMATS:
+            raise ValueError(f'sync writes {" or ".join(self.SYNC_FORMATS)} output, not {self.output_format}.')
+
+        if self.output_format == 'sqlite':
+            self.sync_store()
+        else:
+            self.sync_file()
+
+    def sync_file(self):
+        rows = self.read_sync_rows()
+        high_water_mark = max(row['date'] for row in rows) if len(rows) > 0 else None
+        urls = [self.get_url_from_datetime(sync_date) for sync_date in self.get_sync_dates(high_water_mark, rows)]
+
+        print(f'Syncing {len(urls)} date(s).')
+        if len(urls) == 0:
+            return
+
+        rows_by_key = {self.get_game_key(row): row for row in rows}
+        new_count = 0
+        for block in self.fetch_and_parse_all(urls).values():
+            for row in block:
+                key = self.get_game_key(row)
+                if key not in rows_by_key:
+                    new_count += 1
+
+                rows_by_key[key] = {column: str(value) for column, value in row.items()}
+
+        if len(rows_by_key) == 0:
+            print('No games found.')
+            return
+
+        self.write_sync_rows(rows_by_key.values())
+        print(f'Sync file {self.sync_file_path} has {len(rows_by_key)} games, {new_count} new.')
+
+    def sync_store(self):
+        # the sink creates the table, so the first sync reads an empty one
+        with self.open_sink(self.store_file_path) as sink:
+            high_water_mark, rows = self.read_store_sync_rows()
+            urls = [self.get_url_from_datetime(sync_date) for sync_date in self.get_sync_dates(high_water_mark, rows)]
+
+            print(f'Syncing {len(urls)} date(s).')
+            row_count = 0
+            for block in self.fetch_and_parse_all(urls).values():
+                self.write_block(sink, block)
+                row_count += len(block)
+
+        print(f'Upserted {row_count} game(s) into {self.store_file_path}.')
+
+    def parse_response(self, url, content):
+        # bs4 is imported by the first page parsed, the json calendar and live scoreboard never load it
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, 'html.parser')
+        return self.parse_results(soup, url)
 
     def scrape_single_thread(self):
         data = []
-        
-        i = 1
-        current_date = self.start_date
-        total_days = (self.end_date - self.start_date).days
-        while current_date < (self.end_date + timedelta(days=1)):
-            if current_date.month not in self.MONTHS:
-                continue
-            
+
+        urls = self.get_urls()
+        total_days = len(urls)
+        for i, url in enumerate(urls, 1):
             if i % self.DEFAULT_PRINT_COUNT == 0:
                 print(f'Getting day {i} of {total_days}.')
-            
-            url = self.get_url_from_datetime(current_date)
-            
+
             response = self.attempt_get(url)
             if response is None:
                 continue
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-            results = self.parse_results(soup, url)
+            results = self.parse_response(url, response.content)
 
             data.extend(results)
 
-            i += 1
-            current_date += timedelta(days=1)
-        
         self.save_data(data)
 
 if __name__ == '__main__':
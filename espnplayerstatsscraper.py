@@ -1,6 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import json
+import math
+import time
+from urllib.parse import parse_qs, urlparse
 
 from basescraper import BaseScraper
+from responsecache import CachedResponse
 
 class ESPNPlayerStatsScraper(BaseScraper):
         '''
@@ -9,7 +15,7 @@ class ESPNPlayerStatsScraper(BaseScraper):
         NOTE: this scraper scrapes the underlying api used by the webpage
         '''
             
-        BASE_URL = 'https://site.web.api.espn.com/apis/common/v3/sports/basketball/nba/statistics/byathlete?region=us&lang=en&contentorigin=espn&isqualified=true&page={}&limit={}&sort=offensive.avgPoints%3Adesc&season={}&seasontype={}'        
+        BASE_URL = 'https://site.web.api.espn.com/apis/common/v3/sports/basketball/nba/statistics/byathlete?region=us&lang=en&contentorigin=espn&isqualified={}&page={}&limit={}&sort=offensive.avgPoints%3Adesc&season={}&seasontype={}'        
         SEASON_TYPES = {
             2:'Regular Season',
             3:'Post Season'
@@ -17,43 +23,147 @@ class ESPNPlayerStatsScraper(BaseScraper):
         
         FILE_PREFIX = 'player_stats_data_espn'
 
+        OUTPUT_SCHEMA = [
+            ('id', 'int64'),
+            ('name', 'string'),
+            ('year', 'int32'),
+            ('season_type', 'string'),
+            ('games_played', 'int32'),
+            ('points_per_game', 'float64'),
+            ('total_points', 'float64'),
+        ]
+        PARTITION_COLUMN = 'season'
+        PRIMARY_KEY = ('id', 'year', 'season_type')
+        INDEX_COLUMNS = ('name', 'year')
+
         DEFAULT_PRINT_COUNT = 2
+
+        # athletes per page, smaller pages spread a season over more workers
+        DEFAULT_PAGE_SIZE = 100
             
-        def __init__(self, start_year, end_year, max_threads=None):
-            super().__init__(max_threads=max_threads)
+        def __init__(self, start_year, end_year, max_threads=None, page_size=None, qualified_only=False, **kwargs):
+            super().__init__(max_threads=max_threads, **kwargs)
             self.start_year = start_year
             self.end_year = end_year
             self.years = list(range(self.start_year, self.end_year + 1))
 
-        def scrape_multi_thread_worker(self, years, thread_id):
+            if page_size is None:
+                self.page_size = self.DEFAULT_PAGE_SIZE
+            else:
+                self.page_size = page_size
+
+            # only players with enough games for the stat leaders, the api's isqualified
+            self.qualified_only = qualified_only
+
+            # url -> (response, fetch seconds) of the first pages get_urls read the page counts from
+            self.first_pages = {}
+
+        def __getstate__(self):
+            state = super().__getstate__()
+            state['first_pages'] = {}
+            return state
+
+        def get_url(self, year, season_type, page, limit):
+            return self.BASE_URL.format(str(self.qualified_only).lower(), page, limit, year, season_type)
+
+        def get_page_count(self, season):
+            # the number of pages from the pagination of the season's first page, None when it cannot be read
+            # the first page is kept so the scrape does not request it again
+            year, season_type = season
+            url = self.get_url(year, season_type, 1, self.page_size)
+
+            start = time.perf_counter()
+            response = self.attempt_get(url)
+            if response is None:
+                return None
+
+            try:
+                athlete_count = int(json.loads(response.content)['pagination']['count'])
+            except (ValueError, KeyError, TypeError):
+                print(f'Unable to read the athlete count of {year} {self.SEASON_TYPES[season_type]} from {url}.')
+                return None
+
+            self.first_pages[url] = (response, time.perf_counter() - start)
+            return max(1, math.ceil(athlete_count / self.page_size))
+
+        def pop_first_page(self, url):
+            # the response of a first page get_urls already fetched, counted as a fetch of this run
+            first_page = self.first_pages.pop(url, None)
+            if first_page is None:
+                return None
+
+            response, seconds = first_page
+            self.metrics.record_fetch(seconds, len(response.content), 0, response.status_code, from_cache=isinstance(response, CachedResponse))
+            return response
+
+        def attempt_get(self, url, *args, **kwargs):
+            response = self.pop_first_page(url)
+            if response is not None:
+                return response
+
+            return super().attempt_get(url, *args, **kwargs)
+
+        async def attempt_get_async(self, client, url, *args, **kwargs):
+            response = self.pop_first_page(url)
+            if response is not None:
+                return response.content
+
+            return await super().attempt_get_async(client, url, *args, **kwargs)
+
+        def get_urls(self):
+            seasons = [(year, season_type) for year in self.years for season_type in self.SEASON_TYPES]
+
+            self.first_pages = {}
+            with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+                page_counts = list(executor.map(self.get_page_count, seasons))
+
+            # a season without a page count would be cut short without anyone noticing
+            failed_seasons = [
+                f'{year} {self.SEASON_TYPES[season_type]}' for (year, season_type), page_count in zip(seasons, page_counts) if page_count is None
+            ]
+            if len(failed_seasons) > 0:
+                raise RuntimeError(f'Unable to get the page count of {len(failed_seasons)} season(s): {", ".join(failed_seasons)}.')
+
+            urls = []
+            for (year, season_type), page_count in zip(seasons, page_counts):
+                for page in range(1, page_count + 1):
+                    urls.append(self.get_url(year, season_type, page, self.page_size))
+
+            print(f'{len(urls)} page(s) of {self.page_size} athletes for {len(seasons)} season(s).')
+            return urls
+
+        def get_shard_key(self, url):
+            # every page of a season goes to the same shard
+            return parse_qs(urlparse(url).query)['season'][0]
+
+        def is_immutable_url(self, url, fetched_at):
+            # the season was over when the page was fetched
+            year = int(parse_qs(urlparse(url).query)['season'][0])
+            return year < self.get_season_end_year(datetime.fromtimestamp(fetched_at))
+
+        def get_partition_value(self, row):
+            return row['year']
+
+        def parse_response(self, url, content):
+            query = parse_qs(urlparse(url).query)
+            year = int(query['season'][0])
+            season_type = int(query['seasontype'][0])
+
             data_list = []
-            for i, year in enumerate(years):
-                if i & self.DEFAULT_PRINT_COUNT == 0:
-                    print(f'Thread {thread_id:05} getting year {i + 1} of {len(years)} ({year}).')
-                for season_type in range(2):
-                    url = self.BASE_URL.format(1, 500, year, season_type + 2)
-                    response = self.attempt_get(url)
-                    if response is None:
-                        continue
-                    
-                    response_json = json.loads(response.text)
-                    for athlete in response_json['athletes']:
-                        data_dict = {
-                            'id': athlete['athlete']['id'],
-                            'name': athlete['athlete']['displayName'],                            
-                            'year': year,
-                            'season_type': self.SEASON_TYPES[season_type + 2],
-                            'games_played': athlete['categories'][0]['totals'][0],
-                            'points_per_game': athlete['categories'][1]['totals'][0],
-                            'total_points': float(athlete['categories'][0]['totals'][0]) * float(athlete['categories'][1]['totals'][0]),
-                        }
-                        data_list.append(data_dict)
-
-            self.save_data(data=data_list, file_prefix=self.FILE_PREFIX, thread_data=True, thread_id=thread_id)
-        
-        def scrape(self):
-            self.start_threads(self.scrape_multi_thread_worker, self.years)
-            self.consolidate_files(self.FILE_PREFIX, thread_data=True)
+            response_json = json.loads(content)
+            for athlete in response_json['athletes']:
+                data_dict = {
+                    'id': athlete['athlete']['id'],
+                    'name': athlete['athlete']['displayName'],                            
+                    'year': year,
+                    'season_type': self.SEASON_TYPES[season_type],
+                    'games_played': athlete['categories'][0]['totals'][0],
+                    'points_per_game': athlete['categories'][1]['totals'][0],
+                    'total_points': float(athlete['categories'][0]['totals'][0]) * float(athlete['categories'][1]['totals'][0]),
+                }
+                data_list.append(data_dict)
+
+            return data_list
 
 
 if __name__ == '__main__':
@@ -0,0 +1,298 @@
+from datetime import datetime, timezone
+import hashlib
+import os
+import time
+
+from espnboxscorescraper import ESPNBoxScoreScraper
+from espngameresultscraper import ESPNGameResultScraper
+
+
+class LiveScoreboardPoller:
+    '''
+    polls the scoreboard of a game day and the box scores of its live games until it is stopped
+    every request carries the ETag / Last-Modified of the previous response, so a scoreboard
+    that has not changed costs a 304 and no parsing, changed responses are parsed and diffed
+    against the previous poll and only the game rows and box score lines that changed are
+    passed to callback(file_prefix, rows) and written to each scraper's sink
+    '''
+
+    STATE_SCHEDULED = 'pre'
+    STATE_LIVE = 'in'
+    STATE_FINAL = 'post'
+
+    LIVE_INTERVAL_SECS = 15
+    # a game in the fourth quarter or overtime within CLOSE_GAME_MARGIN points
+    CLOSE_GAME_INTERVAL_SECS = 5
+    CLOSE_GAME_PERIOD = 4
+    CLOSE_GAME_MARGIN = 5
+    # with no live games the poller sleeps until the next game starts, checking at least this often
+    IDLE_INTERVAL_SECS = 300
+
+    def __init__(self, game_result_scraper=None, box_score_scraper=None, callback=None, write_changes=True, date_string=None):
+        # the scrapers make the requests (rate limits, retries, metrics) and parse the rows
+        if game_result_scraper is None:
+            today = datetime.now()
+            self.game_result_scraper = ESPNGameResultScraper(today, today, use_calendar=False)
+        else:
+            self.game_result_scraper = game_result_scraper
+
+        if box_score_scraper is None:
+            self.box_score_scraper = ESPNBoxScoreScraper(extract_mode='json')
+        else:
+            self.box_score_scraper = box_score_scraper
+
+        self.callback = callback
+        self.write_changes = write_changes
+
+        # the game day polled, None follows the local date once the previous day's games are over
+        self.fixed_date = date_string is not None
+        self.date_string = date_string or datetime.now().strftime('%Y%m%d')
+
+        # url -> validator headers and body digest of the last response
+        self.validators = {}
+        self.digests = {}
+
+        # the state of the previous poll, game key -> row and (game id, player page) -> line
+        self.game_rows = {}
+        self.box_score_lines = {}
+        self.events = []
+        # games whose final box score has been read
+        self.final_game_ids = set()
+
+        self.sinks = {}
+        self.live_folder_path = os.path.join(self.game_result_scraper.data_folder_path, 'live')
+        self.poll_count = 0
+
+    def get_conditional(self, scraper, url):
+        # (fetched, content) of url, fetched is False when it could not be fetched and
+        # content is None when it has not changed since the previous poll
+        response = scraper.attempt_get(url, headers=self.validators.get(url))
+        if response is None:
+            return False, None
+
+        if response.status_code == 304:
+            return True, None
+
+        validators = {}
+        if response.headers.get('ETag'):
+            validators['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = response.headers['Last-Modified']
+        self.validators[url] = validators
+
+        # servers without validators still often send the same bytes
+        digest = hashlib.sha1(response.content).digest()
+        if self.digests.get(url) == digest:
+            return True, None
+
+        self.digests[url] = digest
+        return True, response.content
+
+    def get_sink(self, scraper):
+        if scraper.FILE_PREFIX not in self.sinks:
+            scraper.create_folders([self.live_folder_path])
+            file_name = f'{scraper.FILE_PREFIX}_live_{self.date_string}{scraper.get_file_extension()}'
+            self.sinks[scraper.FILE_PREFIX] = scraper.open_sink(os.path.join(self.live_folder_path, file_name), append=True)
+
+        return self.sinks[scraper.FILE_PREFIX]
+
+    def emit(self, scraper, rows):
+        if len(rows) == 0:
+            return
+
+        if self.callback is not None:
+            self.callback(scraper.FILE_PREFIX, rows)
+
+        if self.write_changes:
+            sink = self.get_sink(scraper)
+            sink.write_block(rows)
+            sink.flush()
+
+    def get_event_state(self, event):
+        return event['status']['type']['state']
+
+    def get_event_game_id(self, event):
+        return str(event['id'])
+
+    def is_close_game(self, event):
+        if self.get_event_state(event) != self.STATE_LIVE or event['status'].get('period', 0) < self.CLOSE_GAME_PERIOD:
+            return False
+
+        try:
+            scores = [int(competitor['score']) for competitor in event['competitions'][0]['competitors']]
+        except (KeyError, ValueError):
+            return False
+
+        return max(scores) - min(scores) <= self.CLOSE_GAME_MARGIN
+
+    def poll_scoreboard(self):
+        # the changed game rows, the events of the previous poll stay in place when nothing changed
+        scraper = self.game_result_scraper
+        _, content = self.get_conditional(scraper, scraper.SCOREBOARD_API_URL.format(self.date_string))
+        if content is None:
+            return []
+
+        try:
+            self.events = self.box_score_scraper.load_json(content).get('events', [])
+            rows = scraper.extract_data_from_scoreboard_events(self.events, self.date_string)
+        except (ValueError, KeyError, IndexError, TypeError):
+            print(f'Unable to read the {self.date_string} scoreboard.')
+            return []
+
+        changed_rows = []
+        for row in rows:
+            key = scraper.get_game_key(row)
+            if self.game_rows.get(key) != row:
+                self.game_rows[key] = row
+                changed_rows.append(row)
+
+        return changed_rows
+
+    def poll_box_score(self, game_id):
+        # the changed lines of a game's box score as dicts, None when it could not be fetched or read
+        scraper = self.box_score_scraper
+        url = scraper.SUMMARY_URL.format(game_id)
+        scraper.add_url_date(url, self.date_string)
+
+        fetched, content = self.get_conditional(scraper, url)
+        if not fetched:
+            return None
+
+        if content is None:
+            return []
+
+        try:
+            block = scraper.extract_data_from_summary(scraper.load_json(content), game_id)
+        except (ValueError, KeyError, IndexError, TypeError):
+            print(f'Unable to read the box score of game {game_id}.')
+            # fetched in full next poll rather than answered as unchanged
+            self.validators.pop(url, None)
+            self.digests.pop(url, None)
+            return None
+
+        header, lines = block[0], block[1:]
+        changed_rows = []
+        for line in lines:
+            row = dict(zip(header, line))
+            key = (game_id, row['player_page_url'])
+            values = tuple(line)
+            if self.box_score_lines.get(key) != values:
+                self.box_score_lines[key] = values
+                changed_rows.append(row)
+
+        return changed_rows
+
+    def get_interval(self):
+        live_events = [event for event in self.events if self.get_event_state(event) == self.STATE_LIVE]
+        if any(self.is_close_game(event) for event in live_events):
+            return self.CLOSE_GAME_INTERVAL_SECS
+
+        if len(live_events) > 0:
+            return self.LIVE_INTERVAL_SECS
+
+        start_times = []
+        for event in self.events:
+            if self.get_event_state(event) == self.STATE_SCHEDULED:
+                try:
+                    # e.g. 2023-01-15T00:30Z
+                    start_times.append(datetime.strptime(event['date'], '%Y-%m-%dT%H:%MZ').replace(tzinfo=timezone.utc))
+                except (KeyError, ValueError):
+                    pass
+
+        if len(start_times) == 0:
+            return self.IDLE_INTERVAL_SECS
+
+        seconds_to_start = (min(start_times) - datetime.now(timezone.utc)).total_seconds()
+        return min(max(seconds_to_start, self.LIVE_INTERVAL_SECS), self.IDLE_INTERVAL_SECS)
+
+    def is_day_over(self):
+        return len(self.events) > 0 and all(self.get_event_state(event) == self.STATE_FINAL for event in self.events)
+
+    def has_final_box_scores(self):
+        return all(self.get_event_game_id(event) in self.final_game_ids for event in self.events)
+
+    def advance_date(self):
+        # moves on to the local date once nothing on the polled day is still to come
+        today = datetime.now().strftime('%Y%m%d')
+        if self.fixed_date or today == self.date_string:
+            return
+
+        if len(self.events) > 0 and not self.is_day_over():
+            return
+
+        print(f'Moving the live scoreboard from {self.date_string} to {today}.')
+        self.close_sinks()
+        self.date_string = today
+        self.events = []
+        self.game_rows = {}
+        self.box_score_lines = {}
+        self.final_game_ids = set()
+
+    def poll(self):
+        # one poll of the scoreboard and the live box scores, returns the seconds until the next one
+        start = time.perf_counter()
+        self.poll_count += 1
+        self.advance_date()
+
+        game_rows = self.poll_scoreboard()
+        self.emit(self.game_result_scraper, game_rows)
+
+        box_score_rows = []
+        for event in self.events:
+            game_id = self.get_event_game_id(event)
+            state = self.get_event_state(event)
+
+            # live games every poll, a finished game until its final lines have been read
+            if state != self.STATE_LIVE and (state != self.STATE_FINAL or game_id in self.final_game_ids):
+                continue
+
+            rows = self.poll_box_score(game_id)
+            if rows is None:
+                continue
+
+            box_score_rows += rows
+            if state == self.STATE_FINAL:
+                self.final_game_ids.add(game_id)
+
+        self.emit(self.box_score_scraper, box_score_rows)
+
+        interval = self.get_interval()
+        live_count = sum(self.get_event_state(event) == self.STATE_LIVE for event in self.events)
+        print(
+            f'Poll {self.poll_count} of {self.date_string}: {live_count} of {len(self.events)} games live, '
+            f'{len(game_rows)} game rows and {len(box_score_rows)} box score lines changed in {time.perf_counter() - start:.2f} seconds, '
+            f'next poll in {interval:.0f} seconds.'
+        )
+        return interval
+
+    def close_sinks(self):
+        for sink in self.sinks.values():
+            sink.close()
+
+        self.sinks = {}
+
+    def run(self, stop_when_final=False, max_polls=None):
+        # polls until interrupted, every game of the day is final (stop_when_final) or max_polls polls
+        try:
+            while True:
+                interval = self.poll()
+
+                if stop_when_final and self.is_day_over() and self.has_final_box_scores():
+                    print(f'Every game of {self.date_string} is final.')
+                    break
+
+                if max_polls is not None and self.poll_count >= max_polls:
+                    break
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print('Live scoreboard stopped.')
+        finally:
+            self.close_sinks()
+            self.game_result_scraper.close_session()
+            self.box_score_scraper.close_session()
+
+
+if __name__ == '__main__':
+    poller = LiveScoreboardPoller()
+    poller.run(stop_when_final=True)
@@ -1,11 +1,228 @@
+from datetime import datetime, timedelta
+import json
+import sys
+import time
+from threading import Thread
+import traceback
+
 from nbaplayerstatsscraper import NBAPlayerStatsScraper
 from espnplayerstatsscraper import ESPNPlayerStatsScraper
 from espngameresultscraper import ESPNGameResultScraper
 from espnboxscorescraper import ESPNBoxScoreScraper
+from ratelimiter import set_global_concurrency, set_host_concurrency
+
+
+class JobRunner:
+    '''
+    runs every job of a job spec at the same time, all of them drawing on one budget of
+    requests in flight (max_concurrency over every host and host_concurrency per host)
+    where the jobs with the lowest priority number get free slots first
+
+    a job spec is a dict (or a json file) like
+    {
+        "max_concurrency": 32,
+        "host_concurrency": {"stats.nba.com": 4},
+        "defaults": {"use_cache": true},
+        "jobs": [
+            {"scraper": "box_scores", "start_date": "2024-01-01", "end_date": "2024-01-31", "priority": 0},
+            {"scraper": "espn_player_stats", "start_year": 2024, "end_year": 2024, "priority": 1, "mode": "async"}
+        ]
+    }
+    every other key of a job (and of defaults) is passed to the scraper's constructor,
+    dates are written as YYYY-MM-DD, a box_scores job with dates scrapes the game results
+    of those dates as well (scrape_from_game_results) instead of reading url_file_path
+    '''
+
+    SCRAPERS = {
+        'game_results': ESPNGameResultScraper,
+        'box_scores': ESPNBoxScoreScraper,
+        'espn_player_stats': ESPNPlayerStatsScraper,
+        'nba_player_stats': NBAPlayerStatsScraper,
+    }
+    SCRAPE_MODES = {
+        'threads': 'scrape',
+        'async': 'scrape_async',
+        'pipelined': 'scrape_pipelined',
+    }
+    DATE_ARGUMENTS = ('start_date', 'end_date')
+    # a box_scores job with dates passes these to only one of its two scrapers
+    GAME_RESULT_ARGUMENTS = ('start_date', 'end_date', 'sync_file_path', 'use_calendar', 'calendar_file_path')
+    BOX_SCORE_ARGUMENTS = ('url_file_path', 'page_limit', 'page_start', 'extract_mode')
+    DATE_FORMAT = '%Y-%m-%d'
+
+    DEFAULT_MAX_CONCURRENCY = 32
+    DEFAULT_PRIORITY = 0
+
+    def __init__(self, job_spec):
+        self.job_spec = job_spec
+
+        self.max_concurrency = job_spec.get('max_concurrency', self.DEFAULT_MAX_CONCURRENCY)
+        self.host_concurrency = job_spec.get('host_concurrency', {})
+        self.defaults = job_spec.get('defaults', {})
+        self.jobs = [self.create_job(i, job) for i, job in enumerate(job_spec['jobs'])]
+
+    @classmethod
+    def from_file(cls, file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def get_scraper_arguments(self, job):
+        arguments = dict(self.defaults)
+        arguments.update({name: value for name, value in job.items() if name not in ('name', 'scraper', 'mode')})
+        arguments.setdefault('priority', self.DEFAULT_PRIORITY)
+
+        # a job alone may use the whole budget, the budget and not the thread count limits the requests
+        arguments.setdefault('max_threads', self.max_concurrency)
+
+        for name in self.DATE_ARGUMENTS:
+            if isinstance(arguments.get(name), str):
+                arguments[name] = datetime.strptime(arguments[name], self.DATE_FORMAT)
+
+        return arguments
+
+    def create_job(self, index, job):
+        # a dict with the job's name, its scrapers (whose metrics count towards the summary) and the function that runs it
+        if job['scraper'] not in self.SCRAPERS:
+            raise ValueError(f'Unknown scraper {job["scraper"]} in job {index}, expected one of {tuple(self.SCRAPERS)}.')
+
+        mode = job.get('mode', 'threads')
+        if mode not in self.SCRAPE_MODES:
+            raise ValueError(f'Unknown scrape mode {mode} in job {index}, expected one of {tuple(self.SCRAPE_MODES)}.')
+
+        name = job.get('name', f'{index}:{job["scraper"]}')
+        arguments = self.get_scraper_arguments(job)
+
+        if job['scraper'] == 'box_scores' and 'start_date' in arguments:
+            # scrape_from_game_results has no async or pipelined version
+            if mode != 'threads':
+                raise ValueError(f'Job {index} scrapes box scores by date, which only runs in the threads mode, not {mode}.')
+
+            game_result_arguments = {argument: value for argument, value in arguments.items() if argument not in self.BOX_SCORE_ARGUMENTS}
+            game_result_scraper = ESPNGameResultScraper(**game_result_arguments)
+
+            box_score_arguments = {argument: value for argument, value in arguments.items() if argument not in self.GAME_RESULT_ARGUMENTS}
+            box_score_scraper = ESPNBoxScoreScraper(**box_score_arguments)
+
+            return {
+                'name': name,
+                'scrapers': [game_result_scraper, box_score_scraper],
+                'function': lambda: box_score_scraper.scrape_from_game_results(game_result_scraper),
+            }
+
+        scraper = self.SCRAPERS[job['scraper']](**arguments)
+        return {
+            'name': name,
+            'scrapers': [scraper],
+            'function': getattr(scraper, self.SCRAPE_MODES[mode]),
+        }
+
+    def run_job(self, job):
+        start = time.perf_counter()
+        try:
+            job['function']()
+            job['error'] = None
+        except Exception:
+            traceback.print_exc()
+            job['error'] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+        finally:
+            # the job's pooled connections stay open until its scrapers are closed
+            for scraper in job['scrapers']:
+                scraper.close_session()
+
+        job['seconds'] = time.perf_counter() - start
+
+    def run(self):
+        # returns True when every job finished without an error
+        set_global_concurrency(self.max_concurrency)
+        for host, limit in self.host_concurrency.items():
+            set_host_concurrency(host, limit)
+
+        print(f'Running {len(self.jobs)} jobs with up to {self.max_concurrency} requests in flight.')
+
+        start = time.perf_counter()
+        threads = [Thread(target=self.run_job, args=(job,), name=job['name']) for job in self.jobs]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.print_summary(time.perf_counter() - start)
+
+        return all(job['error'] is None for job in self.jobs)
+
+    def get_metrics_totals(self, scrapers):
+        totals = {'pages': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'rows': 0}
+        for scraper in scrapers:
+            metrics = scraper.metrics
+            with metrics.lock:
+                totals['pages'] += metrics.pages_fetched
+                totals['failed'] += metrics.pages_failed
+                totals['retries'] += metrics.retries
+                totals['bytes'] += metrics.bytes_fetched
+                totals['rows'] += metrics.stage_rows.get('written', 0)
+
+        return totals
+
+    def format_totals(self, totals, seconds):
+        return (
+            f'{totals["pages"]} pages in {seconds:.1f} seconds, {totals["pages"] / max(seconds, 1e-9):.1f} pages/s, '
+            f'{totals["bytes"] / 1024 ** 2:.1f} MiB, {totals["retries"]} retries, {totals["failed"]} failed, {totals["rows"]} rows written'
+        )
+
+    def print_summary(self, seconds):
+        all_totals = self.get_metrics_totals([scraper for job in self.jobs for scraper in job['scrapers']])
+        print(f'All jobs: {self.format_totals(all_totals, seconds)}.')
+
+        for job in self.jobs:
+            totals = self.get_metrics_totals(job['scrapers'])
+            status = 'done' if job['error'] is None else f'failed ({job["error"]})'
+            print(f'    {job["name"]}: {status}, {self.format_totals(totals, job["seconds"])}.')
+
+
+def get_nightly_job_spec():
+    # yesterday's and today's games, then this season's player stats once the game pages have their slots
+    today = datetime.now()
+    yesterday = today - timedelta(days=1)
+    # espn names a season by the year it ends in, stats.nba.com by the year it starts in (2026-27)
+    season_end_year = today.year + 1 if today.month >= 10 else today.year
+    season_start_year = season_end_year - 1
+
+    return {
+        'max_concurrency': JobRunner.DEFAULT_MAX_CONCURRENCY,
+        'jobs': [
+            {
+                'name': 'box_scores',
+                'scraper': 'box_scores',
+                'start_date': yesterday.strftime(JobRunner.DATE_FORMAT),
+                'end_date': today.strftime(JobRunner.DATE_FORMAT),
+                'extract_mode': 'json',
+                'priority': 0,
+            },
+            {
+                'name': 'espn_player_stats',
+                'scraper': 'espn_player_stats',
+                'start_year': season_end_year,
+                'end_year': season_end_year,
+                'priority': 1,
+            },
+            {
+                'name': 'nba_player_stats',
+                'scraper': 'nba_player_stats',
+                'start_year': season_start_year,
+                'end_year': season_start_year,
+                'priority': 1,
+            },
+        ],
+    }
+
 
 if __name__ == '__main__':
-    nba_player_stats_scraper = NBAPlayerStatsScraper()
-    espn_player_stats_scraper = ESPNPlayerStatsScraper()
-    espn_game_results_scraper= ESPNGameResultScraper()
-    espn_box_score_scraper = ESPNBoxScoreScraper()
-    print('done')
+    # python main.py [job spec json file], the nightly refresh without one
+    if len(sys.argv) > 1:
+        runner = JobRunner.from_file(sys.argv[1])
+    else:
+        runner = JobRunner(get_nightly_job_spec())
+
+    if not runner.run():
+        sys.exit(1)
@@ -1,6 +1,12 @@
+import csv
+from datetime import datetime
 import json
+import os
+from threading import Lock
+from urllib.parse import parse_qs, urlparse
 
 from basescraper import BaseScraper
+from sinks import convert_value, import_pyarrow
 
 class NBAPlayerStatsScraper(BaseScraper):
         '''
@@ -15,54 +21,194 @@ class NBAPlayerStatsScraper(BaseScraper):
             1:'Playoffs'
         }
 
+        # stats.nba.com drops requests that do not look like they come from nba.com
+        HEADERS = {
+            'Referer': 'https://www.nba.com/',
+            'Origin': 'https://www.nba.com',
+            'x-nba-stats-origin': 'stats',
+            'x-nba-stats-token': 'true',
+        }
+
+        # stats.nba.com answers bursts with 429s and blocks
+        DEFAULT_RATE_LIMIT = 5
+
         DEFAULT_STAT_CATEGORIES = ['PTS']
+
+        # every leaders list has every stat column, a category only changes the sort order
+        # and, for these, the qualifying minimum and so the players in the list
+        QUALIFIED_STAT_CATEGORIES = ['FG_PCT', 'FG3_PCT', 'FT_PCT']
         
         FILE_PREFIX = 'player_stats_data_nba'
 
+        OUTPUT_SCHEMA = [
+            ('id', 'int64'),
+            ('name', 'string'),
+            ('full_year', 'string'),
+            ('end_year', 'int32'),
+            ('season_type', 'string'),
+            ('games_played', 'int32'),
+            ('points_per_game', 'float64'),
+            ('total_points', 'float64'),
+        ]
+        PARTITION_COLUMN = 'season'
+        PRIMARY_KEY = ('id', 'end_year', 'season_type')
+        INDEX_COLUMNS = ('name', 'end_year')
+
         DEFAULT_PRINT_COUNT = 5
             
-        def __init__(self, start_year, end_year, stat_categories=None, max_threads=None):
-            super().__init__(max_threads=max_threads)
+        def __init__(self, start_year, end_year, stat_categories=None, max_threads=None, **kwargs):
+            super().__init__(max_threads=max_threads, **kwargs)
             self.start_year = start_year
             self.end_year = end_year
             self.years = [f'{year}-{str(year + 1)[-2:]}' for year in range(start_year, end_year + 1)]
             
             if stat_categories is None:
                 self.stat_categories = self.DEFAULT_STAT_CATEGORIES
+            elif len(stat_categories) == 0:
+                raise ValueError('At least one stat category is needed, None scrapes the default ones.')
+            else:
+                # keeps the order, drops repeats
+                self.stat_categories = list(dict.fromkeys(stat_categories))
+
+            self.request_categories = self.get_request_categories()
+
+            # the primary keys of the rows written this run, a player in the leaders lists of several categories is written once
+            self.written_keys = set()
+            self.written_keys_lock = Lock()
+
+            # one column per stat category in the merged rows
+            self.OUTPUT_SCHEMA = self.OUTPUT_SCHEMA + [(stat_category.lower(), 'float64') for stat_category in self.stat_categories]
+
+        def get_request_categories(self):
+            # categories whose leaders lists hold the same players only need one request between them
+            shared_categories = [category for category in self.stat_categories if category not in self.QUALIFIED_STAT_CATEGORIES]
+            request_categories = shared_categories[:1]
+            request_categories.extend(category for category in self.stat_categories if category in self.QUALIFIED_STAT_CATEGORIES)
+
+            return request_categories
+
+        def __getstate__(self):
+            state = super().__getstate__()
+            del state['written_keys_lock']
+            return state
+
+        def __setstate__(self, state):
+            super().__setstate__(state)
+            self.written_keys_lock = Lock()
+
+        def get_urls(self):
+            # one url per season, season type and request category, each a fetch of its own
+            urls = []
+            for year in self.years:
+                for season_type in self.SEASON_TYPES.values():
+                    for stat_category in self.request_categories:
+                        urls.append(self.BASE_URL.format(year, season_type, stat_category))
+
+            with self.written_keys_lock:
+                self.written_keys = set()
+
+            season_count = len(self.years) * len(self.SEASON_TYPES)
+            print(f'{season_count} season(s), {len(urls)} request(s) for {len(self.stat_categories)} stat categories.')
+            return urls
+
+        def start_run_manifest(self, urls):
+            urls = super().start_run_manifest(urls)
+
+            # a resumed run only fetches the leaders lists left over, the players the committed lists
+            # of their seasons already wrote must not be written again
+            if self.resume:
+                written_keys = set()
+                for output_file in self.run_manifest.get_output_offsets():
+                    written_keys.update(self.read_output_keys(output_file))
+
+                with self.written_keys_lock:
+                    self.written_keys = written_keys
+
+                print(f'{len(written_keys)} player row(s) already written.')
+
+            return urls
+
+        def read_output_keys(self, file_path):
+            # sqlite upserts on the primary key, a player written twice is still one row
+            if self.output_format == 'sqlite' or not os.path.exists(file_path):
+                return set()
+
+            if self.output_format == 'parquet':
+                pyarrow = import_pyarrow()
+                rows = pyarrow.parquet.read_table(file_path, columns=list(self.PRIMARY_KEY)).to_pylist()
             else:
-                self.stat_categories = stat_categories
+                with open(file_path, 'r', newline='', encoding='utf-8') as f:
+                    rows = list(csv.DictReader(f))
+
+            type_names = dict(self.OUTPUT_SCHEMA)
+            return set(tuple(convert_value(row[column], type_names[column]) for column in self.PRIMARY_KEY) for row in rows)
+
+        def get_shard_key(self, url):
+            return parse_qs(urlparse(url).query)['Season'][0]
+
+        def is_immutable_url(self, url, fetched_at):
+            # the season was over when the page was fetched
+            year = parse_qs(urlparse(url).query)['Season'][0]
+            return int(year[:4]) + 1 < self.get_season_end_year(datetime.fromtimestamp(fetched_at))
+
+        def get_partition_value(self, row):
+            return row['end_year']
+
+        def parse_leaders(self, content):
+            # player id -> {column: value} for every row of a leaders list
+            result_set = json.loads(content)['resultSet']
+            headers = result_set['headers']
+
+            return {row[0]: dict(zip(headers, row)) for row in result_set['rowSet']}
+
+        def parse_response(self, url, content):
+            query = parse_qs(urlparse(url).query)
+            year = query['Season'][0]
+            season_type = query['SeasonType'][0]
 
-        def scrape_multi_thread_worker(self, years, thread_id):
             data_list = []
-            for i, year in enumerate(years):
-                if i & self.DEFAULT_PRINT_COUNT == 0:
-                    print(f'Thread {thread_id:05} getting year {i + 1} of {len(years)} ({year}).')
-                for k, v in self.SEASON_TYPES.items():
-                    for stat_category in self.stat_categories:
-                        url = self.BASE_URL.format(year, v, stat_category)
-                        response = self.attempt_get(url)
-                        if response is None:
-                            continue
-                        
-                        response_json = json.loads(response.text)
-                        for row in response_json['resultSet']['rowSet']:
-                            data_dict = {
-                                'id': row[0],
-                                'name': row[2],
-                                'full_year': year,
-                                'end_year': int(year[:4]) + 1,
-                                'season_type': v,
-                                'games_played': row[5],
-                                'points_per_game': row[23],
-                                'total_points': float(row[5]) * float(row[23]),
-                            }
-                            data_list.append(data_dict)
-
-            self.save_data(data=data_list, file_prefix=self.FILE_PREFIX, thread_data=True, thread_id=thread_id)
-        
-        def scrape(self):
-            self.start_threads(self.scrape_multi_thread_worker, self.years)
-            self.consolidate_files(self.FILE_PREFIX, thread_data=True)
+            for player_row in self.parse_leaders(content).values():
+                data_dict = {
+                    'id': player_row['PLAYER_ID'],
+                    'name': player_row['PLAYER'],
+                    'full_year': year,
+                    'end_year': int(year[:4]) + 1,
+                    'season_type': season_type,
+                    'games_played': player_row['GP'],
+                    'points_per_game': player_row['PTS'],
+                    'total_points': float(player_row['GP']) * float(player_row['PTS']),
+                }
+
+                for stat_category in self.stat_categories:
+                    data_dict[stat_category.lower()] = player_row.get(stat_category, '')
+
+                data_list.append(data_dict)
+
+            return data_list
+
+        def get_row_key(self, row):
+            return tuple(row[column] for column in self.PRIMARY_KEY)
+
+        def write_block(self, sink, block):
+            # merges the leaders lists of a season as they are written, every list has all the stat
+            # columns so a player's row from the first list written holds every category
+            with self.written_keys_lock:
+                new_rows = [row for row in block if self.get_row_key(row) not in self.written_keys]
+                self.written_keys.update(self.get_row_key(row) for row in new_rows)
+
+            super().write_block(sink, new_rows)
+
+        def scrape_shard(self, urls, file_path):
+            # a shard that is retried writes a new output, so its seasons' players are written again
+            seasons = set()
+            for url in urls:
+                query = parse_qs(urlparse(url).query)
+                seasons.add((int(query['Season'][0][:4]) + 1, query['SeasonType'][0]))
+
+            with self.written_keys_lock:
+                self.written_keys = set(key for key in self.written_keys if key[1:] not in seasons)
+
+            return super().scrape_shard(urls, file_path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+import bisect
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import random
+import time
+from threading import Condition, Lock
+
+
+class TokenBucket:
+    '''
+    allows rate requests per second on average with bursts of up to capacity
+    reserve() takes a token and returns how long the caller has to wait before using it
+    '''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        if capacity is None:
+            self.capacity = max(1, rate)
+        else:
+            self.capacity = capacity
+
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            # tokens can go negative, later callers queue up behind earlier ones
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class PriorityLimiter:
+    '''
+    limit on concurrent requests, when callers wait for a slot the ones with the lowest
+    priority number get it first, callers with the same priority in no particular order
+    '''
+
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        # priorities of the blocked callers, sorted
+        self.waiting = []
+        self.condition = Condition()
+
+    def is_available(self, priority):
+        return self.in_flight < int(self.limit) and (len(self.waiting) == 0 or self.waiting[0] >= priority)
+
+    def try_acquire(self, priority=0):
+        with self.condition:
+            if not self.is_available(priority):
+                return False
+
+            self.in_flight += 1
+            return True
+
+    def acquire(self, priority=0):
+        with self.condition:
+            bisect.insort(self.waiting, priority)
+            try:
+                while self.in_flight >= int(self.limit) or self.waiting[0] < priority:
+                    self.condition.wait()
+            finally:
+                self.waiting.remove(priority)
+
+            self.in_flight += 1
+            # callers behind this one may fit in the slots that are left
+            self.condition.notify_all()
+
+    def release(self, success=True):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+class AIMDLimiter(PriorityLimiter):
+    '''
+    limit on concurrent requests that adapts like tcp congestion control
+    it grows by one after a full window of successful requests and halves on an error
+    '''
+
+    # errors of requests that were already in flight when the limit was cut do not cut it again
+    DECREASE_INTERVAL_SECS = 1
+
+    def __init__(self, initial_limit, max_limit, min_limit=1):
+        super().__init__(initial_limit)
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decreased_at = 0
+
+    def release(self, success):
+        with self.condition:
+            self.in_flight -= 1
+
+            if success:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif time.monotonic() - self.decreased_at > self.DECREASE_INTERVAL_SECS:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self.decreased_at = time.monotonic()
+
+            self.condition.notify_all()
+
+
+class HostThrottle:
+    '''
+    token bucket and adaptive concurrency limit shared by every request to one host,
+    a request also takes a slot of the global limit over every host when there is one
+    '''
+
+    ASYNC_POLL_SECS = 0.01
+
+    def __init__(self, host, rate, max_concurrency, initial_concurrency):
+        self.host = host
+        if not rate:
+            self.bucket = None
+        else:
+            self.bucket = TokenBucket(rate)
+
+        self.limiter = AIMDLimiter(min(initial_concurrency, max_concurrency), max_concurrency)
+        self.global_limiter = global_limiter
+
+    def acquire(self, priority=0):
+        # the host slot first, so a request waiting on its host does not hold a global slot
+        self.limiter.acquire(priority)
+        if self.global_limiter is not None:
+            self.global_limiter.acquire(priority)
+
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    async def acquire_async(self, priority=0):
+        import asyncio
+
+        # the limiters block on a thread condition, poll instead of blocking the event loop
+        while not self.limiter.try_acquire(priority):
+            await asyncio.sleep(self.ASYNC_POLL_SECS)
+
+        while self.global_limiter is not None and not self.global_limiter.try_acquire(priority):
+            await asyncio.sleep(self.ASYNC_POLL_SECS)
+
+        if self.bucket is not None:
+            wait_time = self.bucket.reserve()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+
+    def release(self, success):
+        if self.global_limiter is not None:
+            self.global_limiter.release()
+
+        self.limiter.release(success)
+
+
+# one throttle per host for the whole process, so scrapers running side by side share it
+host_throttles = {}
+host_throttles_lock = Lock()
+
+# requests in flight over every host, None when only the per host limits apply
+global_limiter = None
+# host -> the most requests in flight to it, whatever the scrapers ask for
+host_concurrency_limits = {}
+
+
+def get_host_throttle(host, rate, max_concurrency, initial_concurrency):
+    with host_throttles_lock:
+        if host not in host_throttles:
+            host_throttles[host] = HostThrottle(host, rate, max_concurrency, initial_concurrency)
+
+        # the first scraper sets the rate, later ones with more workers can raise the concurrency cap
+        throttle = host_throttles[host]
+        throttle.limiter.max_limit = max(throttle.limiter.max_limit, max_concurrency)
+        apply_host_concurrency_limit(throttle)
+
+        return throttle
+
+
+def apply_host_concurrency_limit(throttle):
+    limit = host_concurrency_limits.get(throttle.host)
+    if limit is not None:
+        throttle.limiter.max_limit = limit
+        throttle.limiter.limit = min(throttle.limiter.limit, limit)
+
+
+def set_global_concurrency(limit):
+    # set it before the scrapers start, requests already in flight are not counted
+    global global_limiter
+    with host_throttles_lock:
+        global_limiter = None if limit is None else PriorityLimiter(limit)
+        for throttle in host_throttles.values():
+            throttle.global_limiter = global_limiter
+
+
+def set_host_concurrency(host, limit):
+    with host_throttles_lock:
+        host_concurrency_limits[host] = limit
+        if host in host_throttles:
+            apply_host_concurrency_limit(host_throttles[host])
+
+
+def reset_host_throttles():
+    # a forked process inherits the parent's throttles with its in flight counts and maybe a held lock
+    global host_throttles, host_throttles_lock, global_limiter
+    host_throttles = {}
+    host_throttles_lock = Lock()
+    if global_limiter is not None:
+        global_limiter = PriorityLimiter(global_limiter.limit)
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an http date
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_backoff_time(attempt, base_secs, max_secs, retry_after=None):
+    # exponential backoff with jitter so retrying threads do not hit the host in lockstep
+    if retry_after is not None:
+        return min(max_secs, retry_after) + random.uniform(0, base_secs)
+
+    backoff = min(max_secs, base_secs * 2 ** (attempt - 1))
+    return random.uniform(backoff / 2, backoff)
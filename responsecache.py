@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from threading import Lock
+
+from sinks import atomic_write
+
+
+class CachedResponse:
+    '''
+    a response read from the ResponseCache
+    has the parts of requests.Response the scrapers use
+    '''
+
+    status_code = 200
+
+    def __init__(self, url, content, etag=None, last_modified=None, fetched_at=None):
+        self.url = url
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    @property
+    def headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers['ETag'] = self.etag
+        if self.last_modified is not None:
+            headers['Last-Modified'] = self.last_modified
+
+        return headers
+
+    def get_age(self):
+        return time.time() - self.fetched_at
+
+    def get_revalidation_headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+
+        return headers
+
+
+class ResponseCache:
+    '''
+    on disk cache of response bodies keyed by the sha256 of the url
+    bodies are stored gzipped next to a small json file with the validators,
+    the least recently used entries are removed once the cache grows past max_bytes
+    '''
+
+    DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+    # evict down to this share of max_bytes so eviction does not run on every put
+    EVICTION_TARGET = 0.9
+
+    BODY_EXTENSION = '.gz'
+    META_EXTENSION = '.json'
+
+    def __init__(self, folder_path, max_bytes=None):
+        self.folder_path = folder_path
+        os.makedirs(self.folder_path, exist_ok=True)
+
+        if max_bytes is None:
+            self.max_bytes = self.DEFAULT_MAX_BYTES
+        else:
+            self.max_bytes = max_bytes
+
+        self.lock = Lock()
+        self.total_bytes = sum(size for _, size, _ in self.list_entries())
+
+    def get_key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.folder_path, key[:2], key)
+
+    def list_entries(self):
+        # (entry path, bytes on disk, last access) for every cached body
+        entries = []
+        for folder in os.scandir(self.folder_path):
+            if not folder.is_dir():
+                continue
+
+            for file in os.scandir(folder.path):
+                if not file.name.endswith(self.BODY_EXTENSION):
+                    continue
+
+                entry_path = file.path[:-len(self.BODY_EXTENSION)]
+                stat = file.stat()
+                try:
+                    meta_size = os.path.getsize(entry_path + self.META_EXTENSION)
+                except OSError:
+                    meta_size = 0
+
+                entries.append((entry_path, stat.st_size + meta_size, stat.st_mtime))
+
+        return entries
+
+    def get_entry_size(self, entry_path):
+        # bytes on disk of an entry's body and meta, 0 for a part that is not there
+        size = 0
+        for extension in (self.BODY_EXTENSION, self.META_EXTENSION):
+            try:
+                size += os.path.getsize(entry_path + extension)
+            except OSError:
+                pass
+
+        return size
+
+    def get(self, url):
+        entry_path = self.get_entry_path(self.get_key(url))
+
+        try:
+            with open(entry_path + self.META_EXTENSION, 'r') as f:
+                meta = json.load(f)
+
+            with gzip.open(entry_path + self.BODY_EXTENSION, 'rb') as f:
+                content = f.read()
+
+            # the body's mtime is the last access time for eviction
+            os.utime(entry_path + self.BODY_EXTENSION)
+        except (OSError, ValueError, EOFError):
+            return None
+
+        if meta['url'] != url:
+            return None
+
+        return CachedResponse(url, content, meta['etag'], meta['last_modified'], meta['fetched_at'])
+
+    def write_file(self, file_path, data):
+        with atomic_write(file_path, 'wb') as f:
+            f.write(data)
+
+    def write_meta(self, entry_path, url, etag, last_modified, fetched_at):
+        meta = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        self.write_file(entry_path + self.META_EXTENSION, meta_bytes)
+
+        return len(meta_bytes)
+
+    def put(self, url, content, headers):
+        entry_path = self.get_entry_path(self.get_key(url))
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        # a url fetched again replaces its entry, whose bytes are no longer in the cache
+        replaced_size = self.get_entry_size(entry_path)
+
+        body = gzip.compress(content)
+        self.write_file(entry_path + self.BODY_EXTENSION, body)
+        meta_size = self.write_meta(entry_path, url, headers.get('ETag'), headers.get('Last-Modified'), time.time())
+
+        with self.lock:
+            self.total_bytes += len(body) + meta_size - replaced_size
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+        return CachedResponse(url, content, headers.get('ETag'), headers.get('Last-Modified'), time.time())
+
+    def refresh(self, cached_response):
+        # a 304 means the cached body is still current
+        cached_response.fetched_at = time.time()
+        entry_path = self.get_entry_path(self.get_key(cached_response.url))
+        self.write_meta(entry_path, cached_response.url, cached_response.etag, cached_response.last_modified, cached_response.fetched_at)
+
+    def evict(self):
+        entries = sorted(self.list_entries(), key=lambda entry: entry[2])
+        total_bytes = sum(entry[1] for entry in entries)
+        target_bytes = self.max_bytes * self.EVICTION_TARGET
+
+        removed = 0
+        for entry_path, size, _ in entries:
+            if total_bytes <= target_bytes:
+                break
+
+            for extension in (self.BODY_EXTENSION, self.META_EXTENSION):
+                try:
+                    os.remove(entry_path + extension)
+                except OSError:
+                    pass
+
+            total_bytes -= size
+            removed += 1
+
+        self.total_bytes = total_bytes
+        print(f'Removed {removed} responses from the cache, {total_bytes / 1024 ** 2:.0f} MiB left.')
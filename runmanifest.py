@@ -0,0 +1,101 @@
+import os
+import shutil
+import sqlite3
+import time
+from threading import Lock
+
+
+class RunManifest:
+    '''
+    sqlite record of a scrape run, lets a run that died part way be resumed
+    every url is stored with its status and the output file and offset its rows
+    were written up to, outputs store the offset up to which their rows are committed
+    '''
+
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = Lock()
+
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS urls ('
+                'url TEXT PRIMARY KEY, status TEXT, output_file TEXT, output_offset INTEGER, updated_at REAL)'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS outputs (output_file TEXT PRIMARY KEY, committed_offset INTEGER)'
+            )
+
+    def get_output_offsets(self):
+        with self.lock:
+            return dict(self.connection.execute('SELECT output_file, committed_offset FROM outputs'))
+
+    def get_completed_urls(self):
+        with self.lock:
+            rows = self.connection.execute('SELECT url FROM urls WHERE status = ?', (self.STATUS_DONE,))
+            return set(row[0] for row in rows)
+
+    def register_output(self, output_file):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO outputs (output_file, committed_offset) VALUES (?, 0)', (output_file,)
+            )
+
+    def commit_urls(self, urls, output_file, output_offset):
+        # the rows of urls are on disk up to output_offset, mark them done in one transaction
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO urls (url, status, output_file, output_offset, updated_at) VALUES (?, ?, ?, ?, ?)',
+                [(url, self.STATUS_DONE, output_file, output_offset, now) for url in urls]
+            )
+            self.connection.execute(
+                'UPDATE outputs SET committed_offset = ? WHERE output_file = ?', (output_offset, output_file)
+            )
+
+    def mark_failed(self, url):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO urls (url, status, output_file, output_offset, updated_at) VALUES (?, ?, NULL, NULL, ?)',
+                (url, self.STATUS_FAILED, time.time())
+            )
+
+    def truncate_outputs(self):
+        # drop rows written after the last commit, they belong to urls that will be fetched again
+        for output_file, committed_offset in self.get_output_offsets().items():
+            # parquet outputs are folders of complete part files and never need truncating
+            if not os.path.isfile(output_file):
+                continue
+
+            if os.path.getsize(output_file) > committed_offset:
+                print(f'Truncating {output_file} to its last checkpoint ({committed_offset} bytes).')
+                with open(output_file, 'r+b') as f:
+                    f.truncate(committed_offset)
+
+    def reset(self):
+        # a new run, remove what an unfinished earlier run left behind
+        for output_file in self.get_output_offsets():
+            if os.path.isdir(output_file):
+                shutil.rmtree(output_file)
+            elif os.path.exists(output_file):
+                os.remove(output_file)
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM urls')
+            self.connection.execute('DELETE FROM outputs')
+
+    def delete(self):
+        with self.lock:
+            self.connection.close()
+
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.file_path + suffix):
+                os.remove(self.file_path + suffix)
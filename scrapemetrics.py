@@ -0,0 +1,287 @@
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import time
+from threading import Event, Lock, Thread, local
+
+from sinks import atomic_write
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.metrics.get_prometheus_text().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ScrapeMetrics:
+    '''
+    counters and timings of a scrape run, shared by all of a scraper's workers
+    every fetch records its latency, bytes, retries and outcome, every parse its time and rows,
+    and rows are counted per stage (parsed, written) so a slow stage shows up as a gap
+    the numbers are available as a progress line, prometheus text (a file, or an http endpoint)
+    and, with profiling on, one cProfile dump per stage
+    '''
+
+    # upper bounds of the latency histogram buckets, in seconds
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+    # percentiles are taken over the most recent samples
+    DEFAULT_SAMPLE_COUNT = 10000
+
+    STAGES = ('fetch', 'parse')
+
+    def __init__(self, scraper_name, profile_folder_path=None):
+        self.scraper_name = scraper_name
+        self.profile_folder_path = profile_folder_path
+
+        self.lock = Lock()
+        self.reset()
+
+        self.progress_thread = None
+        self.progress_stopped = Event()
+        self.server = None
+
+        # cProfile only sees the thread it was enabled on, one profiler per thread and stage
+        self.thread_profilers = local()
+        self.profilers = []
+
+    def reset(self):
+        with self.lock:
+            self.url_count = 0
+            self.started_at = time.time()
+            self.finished_at = None
+
+            self.pages_fetched = 0
+            self.pages_failed = 0
+            self.cache_hits = 0
+            self.bytes_fetched = 0
+            self.retries = 0
+            self.status_counts = {}
+            self.fetch_seconds = 0.0
+            self.fetch_buckets = [0] * len(self.LATENCY_BUCKETS)
+            self.fetch_samples = deque(maxlen=self.DEFAULT_SAMPLE_COUNT)
+
+            self.pages_parsed = 0
+            self.parse_errors = 0
+            self.parse_seconds = 0.0
+            self.parse_samples = deque(maxlen=self.DEFAULT_SAMPLE_COUNT)
+
+            self.stage_rows = {}
+
+    def add_urls(self, url_count):
+        with self.lock:
+            self.url_count += url_count
+
+    def record_fetch(self, seconds, byte_count, retries, status_code, from_cache=False):
+        # status_code is None when no response came back at all
+        with self.lock:
+            if byte_count is None:
+                self.pages_failed += 1
+            else:
+                self.pages_fetched += 1
+                self.bytes_fetched += byte_count
+
+            if from_cache:
+                self.cache_hits += 1
+
+            self.retries += retries
+            self.status_counts[status_code] = self.status_counts.get(status_code, 0) + 1
+
+            self.fetch_seconds += seconds
+            self.fetch_samples.append(seconds)
+            for i, bucket in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bucket:
+                    self.fetch_buckets[i] += 1
+                    break
+
+    def record_parse(self, seconds, row_count):
+        with self.lock:
+            self.pages_parsed += 1
+            self.parse_seconds += seconds
+            self.parse_samples.append(seconds)
+            self.stage_rows['parsed'] = self.stage_rows.get('parsed', 0) + row_count
+
+    def record_parse_error(self):
+        with self.lock:
+            self.parse_errors += 1
+
+    def record_rows(self, stage, row_count):
+        with self.lock:
+            self.stage_rows[stage] = self.stage_rows.get(stage, 0) + row_count
+
+    @contextmanager
+    def profile(self, stage):
+        # a no-op unless profiling is on, sections of one stage are dumped to one file
+        # cProfile cannot nest, a fetch made while parsing counts towards the parse profile
+        if self.profile_folder_path is None or getattr(self.thread_profilers, 'active', False):
+            yield
+            return
+
+        profilers = getattr(self.thread_profilers, 'profilers', None)
+        if profilers is None:
+            profilers = self.thread_profilers.profilers = {}
+
+        profiler = profilers.get(stage)
+        if profiler is None:
+            # only imported with profiling on
+            import cProfile
+
+            profiler = profilers[stage] = cProfile.Profile()
+            with self.lock:
+                self.profilers.append((stage, profiler))
+
+        self.thread_profilers.active = True
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.thread_profilers.active = False
+
+    def dump_profiles(self):
+        if self.profile_folder_path is None or len(self.profilers) == 0:
+            return
+
+        import pstats
+
+        os.makedirs(self.profile_folder_path, exist_ok=True)
+        for stage in self.STAGES:
+            stage_profilers = [profiler for profiler_stage, profiler in self.profilers if profiler_stage == stage]
+            if len(stage_profilers) == 0:
+                continue
+
+            stats = pstats.Stats(stage_profilers[0])
+            for profiler in stage_profilers[1:]:
+                stats.add(profiler)
+
+            file_path = os.path.join(self.profile_folder_path, f'{self.scraper_name}_{stage}.prof')
+            stats.dump_stats(file_path)
+            print(f'Wrote the {stage} profile to {file_path} (python -m pstats {file_path}).')
+
+    def get_percentile(self, samples, share):
+        if len(samples) == 0:
+            return 0.0
+
+        samples = sorted(samples)
+        return samples[min(len(samples) - 1, int(len(samples) * share))]
+
+    def get_summary(self):
+        with self.lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            fetch_samples = list(self.fetch_samples)
+            parse_samples = list(self.parse_samples)
+
+            # parsers can fetch pages of their own, so pages and urls do not have to match
+            summary = (
+                f'{self.scraper_name}: {self.pages_fetched} pages for {self.url_count} urls, {self.pages_fetched / max(elapsed, 1e-9):.1f} pages/s, '
+                f'{self.bytes_fetched / 1024 ** 2:.1f} MiB, {self.retries} retries, {self.pages_failed} failed, '
+                f'{self.cache_hits} from cache, rows {self.stage_rows}.'
+            )
+
+        return summary + (
+            f' Fetch p50/p99 {self.get_percentile(fetch_samples, 0.5) * 1000:.0f}/{self.get_percentile(fetch_samples, 0.99) * 1000:.0f} ms,'
+            f' parse p50/p99 {self.get_percentile(parse_samples, 0.5) * 1000:.0f}/{self.get_percentile(parse_samples, 0.99) * 1000:.0f} ms.'
+        )
+
+    def get_prometheus_text(self):
+        label = f'scraper="{self.scraper_name}"'
+        lines = []
+
+        def add(name, metric_type, help_text, samples):
+            lines.append(f'# HELP scraper_{name} {help_text}')
+            lines.append(f'# TYPE scraper_{name} {metric_type}')
+            for sample_labels, value in samples:
+                lines.append(f'scraper_{name}{{{label}{sample_labels}}} {value}')
+
+        with self.lock:
+            add('urls', 'gauge', 'Urls in the current run.', [('', self.url_count)])
+            add('pages_fetched_total', 'counter', 'Pages fetched.', [('', self.pages_fetched)])
+            add('pages_failed_total', 'counter', 'Urls given up on after every attempt.', [('', self.pages_failed)])
+            add('cache_hits_total', 'counter', 'Pages served by the response cache.', [('', self.cache_hits)])
+            add('bytes_fetched_total', 'counter', 'Bytes of page content fetched.', [('', self.bytes_fetched)])
+            add('retries_total', 'counter', 'Attempts after the first one.', [('', self.retries)])
+            add('responses_total', 'counter', 'Final responses by status code.', [
+                (f',status="{status_code if status_code is not None else "error"}"', count)
+                for status_code, count in self.status_counts.items()
+            ])
+
+            buckets = []
+            cumulative_count = 0
+            for bucket, count in zip(self.LATENCY_BUCKETS, self.fetch_buckets):
+                cumulative_count += count
+                buckets.append((f',le="{"+Inf" if bucket == float("inf") else bucket}"', cumulative_count))
+            lines.append('# HELP scraper_fetch_seconds Time to get a page, retries and throttling included.')
+            lines.append('# TYPE scraper_fetch_seconds histogram')
+            for sample_labels, value in buckets:
+                lines.append(f'scraper_fetch_seconds_bucket{{{label}{sample_labels}}} {value}')
+            lines.append(f'scraper_fetch_seconds_sum{{{label}}} {self.fetch_seconds}')
+            lines.append(f'scraper_fetch_seconds_count{{{label}}} {cumulative_count}')
+
+            add('pages_parsed_total', 'counter', 'Pages parsed.', [('', self.pages_parsed)])
+            add('parse_errors_total', 'counter', 'Pages that could not be parsed.', [('', self.parse_errors)])
+            add('parse_seconds_total', 'counter', 'Time spent parsing.', [('', self.parse_seconds)])
+            add('rows_total', 'counter', 'Rows out of each stage.', [(f',stage="{stage}"', count) for stage, count in self.stage_rows.items()])
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_file(self, file_path):
+        # for the node exporter textfile collector
+        with atomic_write(file_path) as f:
+            f.write(self.get_prometheus_text())
+
+    def start_server(self, port, host='127.0.0.1'):
+        # /metrics (any path really) in prometheus text format for as long as the process runs
+        if self.server is not None:
+            return
+
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f'Serving metrics on http://{host}:{self.server.server_address[1]}/metrics')
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def start_run(self, url_count, progress_secs=None, file_path=None):
+        # progress_secs prints a progress line (and rewrites file_path) every progress_secs
+        self.reset()
+        with self.lock:
+            self.url_count = url_count
+
+        if progress_secs:
+            self.progress_stopped.clear()
+            self.progress_thread = Thread(target=self.report_progress, args=(progress_secs, file_path), daemon=True)
+            self.progress_thread.start()
+
+    def report_progress(self, progress_secs, file_path):
+        while not self.progress_stopped.wait(progress_secs):
+            print(self.get_summary())
+            if file_path is not None:
+                self.write_prometheus_file(file_path)
+
+    def finish_run(self, file_path=None):
+        with self.lock:
+            self.finished_at = time.time()
+
+        if self.progress_thread is not None:
+            self.progress_stopped.set()
+            self.progress_thread.join()
+            self.progress_thread = None
+
+        print(self.get_summary())
+        if file_path is not None:
+            self.write_prometheus_file(file_path)
+
+        self.dump_profiles()
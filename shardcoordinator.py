@@ -0,0 +1,289 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+
+
+def get_shard_id(shard_key, shard_count):
+    # the same key always lands in the same shard, on every host and in every run
+    digest = hashlib.sha256(str(shard_key).encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % shard_count
+
+
+def get_default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class ShardCoordinator:
+    '''
+    sqlite record of a sharded run in a folder every worker can reach (a shared filesystem
+    with working file locks, or a local folder when all workers run on one host)
+    the run is split into shard_count shards, a worker claims a pending shard with a lease
+    and renews it while it works, a shard whose lease ran out (its worker died) can be
+    claimed again, and a shard only counts as done when the worker still holding its lease
+    completes it, so every shard's rows end up in exactly one output
+    a shard that still has urls that could not be fetched after DEFAULT_MAX_ATTEMPTS is failed
+    with those urls and has no output, workers that join the run later try it again
+    '''
+
+    STATUS_PENDING = 'pending'
+    STATUS_LEASED = 'leased'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    DEFAULT_LEASE_SECS = 300
+    # a shard with urls that could not be fetched is retried, up to this many attempts in total
+    DEFAULT_MAX_ATTEMPTS = 3
+    # how often an idle worker checks for shards whose lease ran out
+    DEFAULT_POLL_SECS = 5
+    # other workers hold the write lock for one short transaction at a time
+    DEFAULT_BUSY_TIMEOUT_SECS = 60
+
+    FILE_NAME = 'shards.sqlite'
+
+    def __init__(self, folder_path, shard_count, lease_secs=None, worker_id=None):
+        self.folder_path = folder_path
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path, exist_ok=True)
+
+        self.shard_count = shard_count
+
+        if lease_secs is None:
+            self.lease_secs = self.DEFAULT_LEASE_SECS
+        else:
+            self.lease_secs = lease_secs
+
+        if worker_id is None:
+            self.worker_id = get_default_worker_id()
+        else:
+            self.worker_id = worker_id
+
+        self.lock = Lock()
+        # transactions are started explicitly with BEGIN IMMEDIATE so a claim is never raced
+        self.connection = sqlite3.connect(
+            os.path.join(folder_path, self.FILE_NAME), timeout=self.DEFAULT_BUSY_TIMEOUT_SECS, isolation_level=None, check_same_thread=False
+        )
+        self.create_tables()
+
+        self.renew_thread = None
+        self.renew_stopped = Event()
+
+    def execute_transaction(self, function):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(self.connection)
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+
+            self.connection.execute('COMMIT')
+            return result
+
+    def create_tables(self):
+        def create(connection):
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS shards ('
+                'shard_id INTEGER PRIMARY KEY, status TEXT, worker_id TEXT, lease_expires_at REAL, '
+                'attempts INTEGER, output_file TEXT, url_count INTEGER, updated_at REAL)'
+            )
+            connection.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS urls (position INTEGER PRIMARY KEY, url TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS failed_urls (shard_id INTEGER, url TEXT)')
+
+            # the first worker plans the run, later ones have to agree with it
+            connection.execute('INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)', ('shard_count', str(self.shard_count)))
+            shard_count = int(connection.execute('SELECT value FROM settings WHERE name = ?', ('shard_count',)).fetchone()[0])
+            if shard_count != self.shard_count:
+                raise ValueError(f'The run in {self.folder_path} has {shard_count} shards, not {self.shard_count}.')
+
+            # the merging worker deletes the run, one that joins before then would find nothing to do
+            merged_by = connection.execute('SELECT value FROM settings WHERE name = ?', ('merged_by',)).fetchone()
+            if merged_by is not None:
+                raise ValueError(f'The run in {self.folder_path} was already merged by {merged_by[0]}, start the next run once it is deleted.')
+
+            connection.executemany(
+                'INSERT OR IGNORE INTO shards (shard_id, status, attempts, updated_at) VALUES (?, ?, 0, ?)',
+                [(shard_id, self.STATUS_PENDING, time.time()) for shard_id in range(self.shard_count)]
+            )
+
+            # a worker joining the run gives the failed shards another DEFAULT_MAX_ATTEMPTS
+            connection.execute('DELETE FROM failed_urls')
+            connection.execute(
+                'UPDATE shards SET status = ?, worker_id = NULL, attempts = 0, updated_at = ? WHERE status = ?',
+                (self.STATUS_PENDING, time.time(), self.STATUS_FAILED)
+            )
+
+        self.execute_transaction(create)
+
+    def plan_urls(self, urls):
+        # the urls of the run, the first worker to get here stores its urls and every worker scrapes those
+        # so workers whose get_urls would not agree (pages counted at different times) still split the same urls
+        def plan(connection):
+            cursor = connection.execute('INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)', ('url_count', str(len(urls))))
+            if cursor.rowcount == 1:
+                connection.executemany('INSERT INTO urls (position, url) VALUES (?, ?)', enumerate(urls))
+                return urls
+
+            return [row[0] for row in connection.execute('SELECT url FROM urls ORDER BY position')]
+
+        planned_urls = self.execute_transaction(plan)
+        if planned_urls != urls:
+            print(f'Using the {len(planned_urls)} url(s) the run was planned with, this worker found {len(urls)}.')
+
+        return planned_urls
+
+    def claim(self):
+        # the lowest pending or expired shard, None once every shard is done or leased
+        def claim_shard(connection):
+            now = time.time()
+            row = connection.execute(
+                'SELECT shard_id, worker_id FROM shards WHERE status = ? OR (status = ? AND lease_expires_at < ?) ORDER BY shard_id LIMIT 1',
+                (self.STATUS_PENDING, self.STATUS_LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            shard_id, previous_worker_id = row
+            if previous_worker_id is not None:
+                print(f'Shard {shard_id:05} lease of {previous_worker_id} expired, taking it over.')
+
+            connection.execute(
+                'UPDATE shards SET status = ?, worker_id = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ? WHERE shard_id = ?',
+                (self.STATUS_LEASED, self.worker_id, now + self.lease_secs, now, shard_id)
+            )
+            return shard_id
+
+        return self.execute_transaction(claim_shard)
+
+    def renew(self, shard_id):
+        # False once another worker has taken the shard over
+        def renew_lease(connection):
+            now = time.time()
+            cursor = connection.execute(
+                'UPDATE shards SET lease_expires_at = ?, updated_at = ? WHERE shard_id = ? AND status = ? AND worker_id = ?',
+                (now + self.lease_secs, now, shard_id, self.STATUS_LEASED, self.worker_id)
+            )
+            return cursor.rowcount == 1
+
+        return self.execute_transaction(renew_lease)
+
+    def complete(self, shard_id, output_file, url_count, publish_function=None):
+        # publish_function moves the shard's output into place, it only runs while the lease is still held
+        def complete_shard(connection):
+            row = connection.execute('SELECT status, worker_id FROM shards WHERE shard_id = ?', (shard_id,)).fetchone()
+            if row != (self.STATUS_LEASED, self.worker_id):
+                return False
+
+            if publish_function is not None:
+                publish_function()
+
+            connection.execute(
+                'UPDATE shards SET status = ?, lease_expires_at = NULL, output_file = ?, url_count = ?, updated_at = ? WHERE shard_id = ?',
+                (self.STATUS_DONE, output_file, url_count, time.time(), shard_id)
+            )
+            return True
+
+        return self.execute_transaction(complete_shard)
+
+    def fail(self, shard_id, failed_urls):
+        # records the urls a shard could not fetch, the shard is not retried by the workers already running
+        def fail_shard(connection):
+            row = connection.execute('SELECT status, worker_id FROM shards WHERE shard_id = ?', (shard_id,)).fetchone()
+            if row != (self.STATUS_LEASED, self.worker_id):
+                return False
+
+            connection.execute(
+                'UPDATE shards SET status = ?, lease_expires_at = NULL, output_file = NULL, updated_at = ? WHERE shard_id = ?',
+                (self.STATUS_FAILED, time.time(), shard_id)
+            )
+            connection.executemany('INSERT INTO failed_urls (shard_id, url) VALUES (?, ?)', [(shard_id, url) for url in failed_urls])
+            return True
+
+        return self.execute_transaction(fail_shard)
+
+    def release(self, shard_id):
+        # gives a shard back after a failure so another worker does not have to wait out the lease
+        def release_shard(connection):
+            connection.execute(
+                'UPDATE shards SET status = ?, worker_id = NULL, lease_expires_at = NULL, updated_at = ? WHERE shard_id = ? AND worker_id = ? AND status = ?',
+                (self.STATUS_PENDING, time.time(), shard_id, self.worker_id, self.STATUS_LEASED)
+            )
+
+        self.execute_transaction(release_shard)
+
+    def is_finished(self):
+        # every shard is done or failed
+        with self.lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM shards WHERE status NOT IN (?, ?)', (self.STATUS_DONE, self.STATUS_FAILED)
+            ).fetchone()[0] == 0
+
+    def wait(self):
+        # for the shards other workers are on, until they complete them or their leases run out
+        time.sleep(min(self.DEFAULT_POLL_SECS, self.lease_secs / 3))
+
+    def claim_merge(self):
+        # exactly one worker merges, the first to find every shard done
+        def claim(connection):
+            if connection.execute('SELECT COUNT(*) FROM shards WHERE status != ?', (self.STATUS_DONE,)).fetchone()[0] > 0:
+                return False
+
+            cursor = connection.execute('INSERT OR IGNORE INTO settings (name, value) VALUES (?, ?)', ('merged_by', self.worker_id))
+            return cursor.rowcount == 1
+
+        return self.execute_transaction(claim)
+
+    def get_attempts(self, shard_id):
+        with self.lock:
+            return self.connection.execute('SELECT attempts FROM shards WHERE shard_id = ?', (shard_id,)).fetchone()[0]
+
+    def get_failed_urls(self):
+        # the urls of the failed shards in shard order
+        with self.lock:
+            rows = self.connection.execute('SELECT url FROM failed_urls ORDER BY shard_id, rowid')
+            return [row[0] for row in rows]
+
+    def get_status_counts(self):
+        with self.lock:
+            return dict(self.connection.execute('SELECT status, COUNT(*) FROM shards GROUP BY status'))
+
+    def get_output_files(self):
+        # the outputs of the done shards in shard order
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT output_file FROM shards WHERE status = ? AND output_file IS NOT NULL ORDER BY shard_id', (self.STATUS_DONE,)
+            )
+            return [row[0] for row in rows]
+
+    def start_renewing(self, shard_id):
+        # renews the lease a few times per lease period until stop_renewing
+        self.renew_stopped.clear()
+        self.renew_thread = Thread(target=self.renew_until_stopped, args=(shard_id,), daemon=True)
+        self.renew_thread.start()
+
+    def renew_until_stopped(self, shard_id):
+        while not self.renew_stopped.wait(self.lease_secs / 3):
+            if not self.renew(shard_id):
+                print(f'Lost the lease on shard {shard_id:05}, its output will be discarded.')
+                return
+
+    def stop_renewing(self):
+        if self.renew_thread is not None:
+            self.renew_stopped.set()
+            self.renew_thread.join()
+            self.renew_thread = None
+
+    def close(self):
+        self.stop_renewing()
+        with self.lock:
+            self.connection.close()
+
+    def delete(self):
+        # removes the record of a closed run, so the next run in the folder plans its own urls
+        file_path = os.path.join(self.folder_path, self.FILE_NAME)
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(file_path + suffix):
+                os.remove(file_path + suffix)
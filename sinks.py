@@ -0,0 +1,444 @@
+from contextlib import contextmanager
+import csv
+from datetime import datetime
+import os
+import shutil
+import sqlite3
+import time
+from threading import get_ident
+
+# bytes copied at a time when concatenating csv files
+COPY_CHUNK_SIZE = 1024 * 1024
+
+PARQUET_EXTENSION = '.parquet'
+SQLITE_EXTENSION = '.sqlite'
+# values the scraped pages use for a missing number
+MISSING_VALUES = ('', '--', '-')
+
+
+def import_pyarrow():
+    # imported on first use, pyarrow and the numpy under it take longer to load than all a csv scrape needs
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet output requires pyarrow (pip install pyarrow).') from None
+
+    return pyarrow
+
+
+@contextmanager
+def atomic_write(file_path, mode='w', **open_kwargs):
+    # written under a temporary name and renamed over file_path once complete, so neither a
+    # reader nor a crash part way through ever sees half a file
+    temp_file_path = f'{file_path}.{os.getpid()}.{get_ident()}.tmp'
+    try:
+        with open(temp_file_path, mode, **open_kwargs) as f:
+            yield f
+
+        os.replace(temp_file_path, file_path)
+    finally:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+
+class CSVSink:
+    '''
+    writes the rows of each page to a csv file as soon as the page is parsed
+    a block is either a list of dicts or a header row followed by list rows,
+    the header is only written once per file, the file is opened on the first block
+    '''
+
+    def __init__(self, file_path, append=False):
+        self.file_path = file_path
+        self.append = append
+        self.file = None
+        self.writer = None
+        self.row_count = 0
+
+    def open(self):
+        if self.append:
+            self.file = open(self.file_path, 'a', newline='', encoding='utf-8')
+        else:
+            self.file = open(self.file_path, 'w', newline='', encoding='utf-8')
+
+        self.writer = csv.writer(self.file)
+        # appending to a file that already has its header
+        self.has_header = self.file.tell() > 0
+
+    def write_block(self, block):
+        if len(block) == 0:
+            return
+
+        if isinstance(block[0], dict):
+            columns = list(block[0])
+            rows = [[row.get(column, '') for column in columns] for row in block]
+        else:
+            columns = block[0]
+            rows = block[1:]
+
+        if self.file is None:
+            self.open()
+
+        if not self.has_header:
+            self.writer.writerow(columns)
+            self.has_header = True
+
+        self.writer.writerows(rows)
+        self.row_count += len(rows)
+
+    def flush(self):
+        # returns the size of the file once everything written so far is on disk
+        if self.file is None:
+            if os.path.exists(self.file_path):
+                return os.path.getsize(self.file_path)
+
+            return 0
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return os.fstat(self.file.fileno()).st_size
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def concatenate_csv_files(file_paths, output_file_path):
+    # byte copy of the files into one, the header line is only kept from the first file
+    has_header = False
+    with open(output_file_path, 'wb') as output_file:
+        for file_path in file_paths:
+            with open(file_path, 'rb') as f:
+                if has_header:
+                    f.readline()
+
+                if f.peek(1) == b'':
+                    continue
+
+                shutil.copyfileobj(f, output_file, COPY_CHUNK_SIZE)
+                has_header = True
+
+
+def convert_value(value, type_name):
+    # converts a scraped value to the python type pyarrow expects for type_name
+    if value is None or (isinstance(value, str) and value.strip() in MISSING_VALUES):
+        return None
+
+    if type_name == 'string':
+        return str(value)
+
+    if type_name == 'date32':
+        return datetime.strptime(str(value), '%Y%m%d').date()
+
+    try:
+        if type_name.startswith('int'):
+            try:
+                return int(value)
+            except ValueError:
+                return int(float(value))
+
+        if type_name.startswith('float'):
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return value
+
+
+class ParquetSink:
+    '''
+    writes rows to a parquet dataset folder with a fixed, typed schema
+    schema is a list of (column, pyarrow type name) pairs, rows are buffered and
+    written as one part file per partition, partition_function maps a row dict to
+    the value of the hive style partition folder ([partition_column]=[value])
+    '''
+
+    DEFAULT_ROW_GROUP_SIZE = 100000
+
+    def __init__(self, file_path, schema, partition_column=None, partition_function=None, append=False):
+        pyarrow = import_pyarrow()
+
+        # append is accepted for the CSVSink interface, new rows always go to new part files
+        self.file_path = file_path
+        self.schema = schema
+        self.arrow_schema = pyarrow.schema([(column, pyarrow.type_for_alias(type_name)) for column, type_name in schema])
+        self.partition_column = partition_column
+        self.partition_function = partition_function
+
+        self.buffers = {}
+        self.buffered_count = 0
+        self.part_count = 0
+        self.row_count = 0
+        # part file names must not clash between threads, processes and runs
+        self.part_prefix = f'part-{time.time_ns()}-{os.getpid()}-{get_ident()}'
+
+    def write_block(self, block):
+        if len(block) == 0:
+            return
+
+        if isinstance(block[0], dict):
+            rows = block
+        else:
+            rows = [dict(zip(block[0], row)) for row in block[1:]]
+
+        for row in rows:
+            if self.partition_function is None:
+                partition = None
+            else:
+                partition = self.partition_function(row)
+
+            values = [convert_value(row.get(column), type_name) for column, type_name in self.schema]
+            self.buffers.setdefault(partition, []).append(values)
+
+        self.buffered_count += len(rows)
+        self.row_count += len(rows)
+
+        if self.buffered_count >= self.DEFAULT_ROW_GROUP_SIZE:
+            self.write_parts()
+
+    def get_partition_folder_path(self, partition):
+        if partition is None:
+            return self.file_path
+
+        return os.path.join(self.file_path, f'{self.partition_column}={partition}')
+
+    def write_parts(self):
+        pyarrow = import_pyarrow()
+        for partition, rows in self.buffers.items():
+            folder_path = self.get_partition_folder_path(partition)
+            os.makedirs(folder_path, exist_ok=True)
+
+            columns = list(zip(*rows))
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.arrow_schema)],
+                schema=self.arrow_schema
+            )
+
+            file_path = os.path.join(folder_path, f'{self.part_prefix}-{self.part_count:05}{PARQUET_EXTENSION}')
+            with atomic_write(file_path, 'wb') as f:
+                pyarrow.parquet.write_table(table, f, compression='zstd')
+            self.part_count += 1
+
+        self.buffers = {}
+        self.buffered_count = 0
+
+    def flush(self):
+        # rows are only durable once they are in a part file, returns the parts written so far
+        self.write_parts()
+        return self.part_count
+
+    def close(self):
+        self.write_parts()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SQLiteSink:
+    '''
+    upserts rows into a table of an sqlite database shared by every scraper and thread
+    the table is created from the same typed schema as parquet output, with primary_key
+    as its primary key and one index per entry of index_columns (a column or a tuple of columns)
+    rows are buffered and written in one transaction per flush, a row whose key is already
+    in the table replaces the old values, so scraping a page again never duplicates rows
+    '''
+
+    SQL_TYPES = {
+        'int': 'INTEGER',
+        'float': 'REAL',
+        'string': 'TEXT',
+        # iso dates so they sort and compare as text
+        'date32': 'TEXT',
+    }
+    # other threads and processes hold the write lock for one batch at a time
+    DEFAULT_BUSY_TIMEOUT_SECS = 60
+    # rows buffered before write_block commits them, scrapes without checkpoints never call flush
+    DEFAULT_BATCH_SIZE = 10000
+
+    def __init__(self, file_path, table_name, schema, primary_key, index_columns=(), partition_column=None, partition_function=None, append=False):
+        # append is accepted for the CSVSink interface, rows are always upserted
+        self.file_path = file_path
+        self.table_name = table_name
+        self.schema = list(schema)
+        self.primary_key = primary_key
+        self.index_columns = index_columns
+        self.partition_function = partition_function
+
+        # the partition value (season) is stored as a column of its own
+        if partition_column is not None and partition_function is not None:
+            self.schema.append((partition_column, 'int32'))
+
+        self.partition_column = partition_column
+        self.columns = [column for column, _ in self.schema]
+
+        self.buffer = []
+        self.row_count = 0
+        self.committed_count = 0
+
+        self.connection = sqlite3.connect(file_path, timeout=self.DEFAULT_BUSY_TIMEOUT_SECS)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.create_table()
+
+        quoted_columns = ', '.join(quote_identifier(column) for column in self.columns)
+        updates = ', '.join(
+            f'{quote_identifier(column)} = excluded.{quote_identifier(column)}' for column in self.columns if column not in primary_key
+        )
+        self.upsert_sql = (
+            f'INSERT INTO {quote_identifier(table_name)} ({quoted_columns}) VALUES ({", ".join("?" * len(self.columns))}) '
+            f'ON CONFLICT ({", ".join(quote_identifier(column) for column in primary_key)}) DO UPDATE SET {updates}'
+        )
+
+    def get_sql_type(self, type_name):
+        if type_name.startswith('int'):
+            return self.SQL_TYPES['int']
+
+        if type_name.startswith('float'):
+            return self.SQL_TYPES['float']
+
+        return self.SQL_TYPES[type_name]
+
+    def create_table(self):
+        column_definitions = ', '.join(f'{quote_identifier(column)} {self.get_sql_type(type_name)}' for column, type_name in self.schema)
+        primary_key = ', '.join(quote_identifier(column) for column in self.primary_key)
+
+        with self.connection:
+            self.connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {quote_identifier(self.table_name)} ({column_definitions}, PRIMARY KEY ({primary_key}))'
+            )
+
+            # a table created by a run with other columns (nba stat categories) gains the new ones
+            table_columns = set(row[1] for row in self.connection.execute(f'PRAGMA table_info({quote_identifier(self.table_name)})'))
+            for column, type_name in self.schema:
+                if column not in table_columns:
+                    self.connection.execute(
+                        f'ALTER TABLE {quote_identifier(self.table_name)} ADD COLUMN {quote_identifier(column)} {self.get_sql_type(type_name)}'
+                    )
+
+            for columns in self.index_columns:
+                if isinstance(columns, str):
+                    columns = (columns,)
+
+                index_name = '_'.join((self.table_name,) + tuple(columns) + ('index',))
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} ON {quote_identifier(self.table_name)} '
+                    f'({", ".join(quote_identifier(column) for column in columns)})'
+                )
+
+    def convert_row(self, row):
+        values = []
+        for column, type_name in self.schema:
+            if column == self.partition_column and self.partition_function is not None:
+                value = self.partition_function(row)
+            else:
+                value = convert_value(row.get(column), type_name)
+
+            if type_name == 'date32' and value is not None:
+                value = value.isoformat()
+
+            values.append(value)
+
+        return values
+
+    def write_block(self, block):
+        if len(block) == 0:
+            return
+
+        if isinstance(block[0], dict):
+            rows = block
+        else:
+            rows = [dict(zip(block[0], row)) for row in block[1:]]
+
+        self.buffer.extend(self.convert_row(row) for row in rows)
+        self.row_count += len(rows)
+
+        if len(self.buffer) >= self.DEFAULT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        # one transaction per batch, returns the rows committed so far
+        if len(self.buffer) > 0:
+            with self.connection:
+                self.connection.executemany(self.upsert_sql, self.buffer)
+
+            self.committed_count += len(self.buffer)
+            self.buffer = []
+
+        return self.committed_count
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def quote_identifier(name):
+    # columns like +/- and 3pt are not valid bare sql identifiers
+    return '"' + name.replace('"', '""') + '"'
+
+
+def read_sqlite_rows(file_path, table_name, where='', parameters=()):
+    # rows of table_name as dicts, where is an sql condition with ? placeholders for parameters
+    connection = sqlite3.connect(file_path)
+    connection.row_factory = sqlite3.Row
+    try:
+        sql = f'SELECT * FROM {quote_identifier(table_name)}'
+        if where:
+            sql += f' WHERE {where}'
+
+        return [dict(row) for row in connection.execute(sql, parameters)]
+    finally:
+        connection.close()
+
+
+def read_sqlite_max(file_path, table_name, column):
+    # largest value of column in table_name, None for an empty table
+    connection = sqlite3.connect(file_path)
+    try:
+        return connection.execute(f'SELECT max({quote_identifier(column)}) FROM {quote_identifier(table_name)}').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def merge_parquet_datasets(folder_paths, output_folder_path):
+    # compacts the part files of each partition into one file, streaming one row group at a time
+    pyarrow = import_pyarrow()
+    part_files = {}
+    for folder_path in folder_paths:
+        for root, _, file_names in os.walk(folder_path):
+            partition = os.path.relpath(root, folder_path)
+            for file_name in sorted(file_names):
+                if file_name.endswith(PARQUET_EXTENSION):
+                    part_files.setdefault(partition, []).append(os.path.join(root, file_name))
+
+    for partition, file_paths in part_files.items():
+        partition_folder_path = os.path.normpath(os.path.join(output_folder_path, partition))
+        os.makedirs(partition_folder_path, exist_ok=True)
+
+        writer = None
+        for file_path in file_paths:
+            parquet_file = pyarrow.parquet.ParquetFile(file_path)
+            if writer is None:
+                output_file_path = os.path.join(partition_folder_path, f'part-00000{PARQUET_EXTENSION}')
+                writer = pyarrow.parquet.ParquetWriter(output_file_path, parquet_file.schema_arrow, compression='zstd')
+
+            for i in range(parquet_file.num_row_groups):
+                writer.write_table(parquet_file.read_row_group(i))
+
+        writer.close()
@@ -0,0 +1,95 @@
+from collections import deque
+import time
+from threading import Condition
+
+
+class WorkQueue:
+    '''
+    shared queue of work items for start_threads
+    workers pull the next item when they finish the previous one instead of
+    getting a fixed slice of the data, and the time spent on each item is recorded
+    an open queue can still be added to, get waits for new items until it is closed
+    '''
+
+    DEFAULT_SLOWEST_COUNT = 5
+
+    def __init__(self, items, closed=True):
+        self.items = deque(items)
+        self.total = len(self.items)
+        self.closed = closed
+        self.condition = Condition()
+        self.timings = []
+
+    def __len__(self):
+        return self.total
+
+    def add(self, item):
+        with self.condition:
+            if self.closed:
+                raise ValueError('Work queue is closed.')
+
+            self.items.append(item)
+            self.total += 1
+            self.condition.notify()
+
+    def close(self):
+        # no more items will be added, workers stop once the queue is empty
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        with self.condition:
+            while len(self.items) == 0 and not self.closed:
+                self.condition.wait()
+
+            if len(self.items) == 0:
+                raise IndexError('Work queue is empty.')
+
+            return self.items.popleft()
+
+    def task_done(self, item, seconds):
+        with self.condition:
+            self.timings.append((seconds, item))
+
+    def worker_items(self):
+        return WorkQueueView(self)
+
+    def print_timing_summary(self):
+        if len(self.timings) == 0:
+            return
+
+        timings = sorted(self.timings, key=lambda timing: timing[0])
+        seconds = [timing[0] for timing in timings]
+        count = len(seconds)
+
+        print(f'Processed {count} items. Mean: {sum(seconds) / count:.2f}s, median: {seconds[count // 2]:.2f}s, max: {seconds[-1]:.2f}s.')
+
+        for item_seconds, item in reversed(timings[-self.DEFAULT_SLOWEST_COUNT:]):
+            print(f'    {item_seconds:.2f}s {item}')
+
+
+class WorkQueueView:
+    '''
+    what a single worker sees of a WorkQueue, an iterable that takes items from
+    the shared queue on demand so it can replace a list slice in scrape_multi_thread_worker
+    '''
+
+    def __init__(self, work_queue):
+        self.work_queue = work_queue
+
+    def __len__(self):
+        return len(self.work_queue)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.work_queue.get()
+            except IndexError:
+                return
+
+            start = time.perf_counter()
+            try:
+                yield item
+            finally:
+                self.work_queue.task_done(item, time.perf_counter() - start)